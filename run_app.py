@@ -4,7 +4,7 @@ Simple script to run the stock recommender application
 """
 import os
 import sys
-from stock_recommender import app
+from stock_recommender import app, bootstrap_schema, bootstrap_metric_registry
 
 def main():
     """Main function to run the Flask application"""
@@ -21,15 +21,27 @@ def main():
         return
     
     print("✅ Environment variables configured")
+
+    # Verify/migrate the schema once up front so request handlers never issue DDL
+    if bootstrap_schema():
+        print("✅ Snowflake schema verified")
+    else:
+        print("⚠️  Schema check deferred until the database is reachable")
+    seeded = bootstrap_metric_registry()
+    if seeded:
+        print(f"✅ Metric registry seeded with {seeded} metrics")
     print("🌐 Starting Flask application on http://localhost:5000")
     print("📊 Available endpoints:")
     print("  - /                    : Main dashboard")
     print("  - /quarterly/<stock>   : Quarterly view for stock")
     print("  - /sector/<sector>     : Sector comparison")
+    print("  - /api/sector/<sector>/analytics : Sector medians, ranks and growth")
+    print("  - /api/features/<stock> : Growth, TTM and CAGR features")
     print("  - /test-scraper/<stock> : Test web scraping")
     print("  - /test-full-flow/<stock> : Test complete flow")
     print("  - /debug/<stock>       : Debug database content")
     print("  - /load-single/<stock> : Load single stock data")
+    print("  - /jobs/<job_id>       : Progress of a load job")
     print("="*50)
     
     # Run the Flask app
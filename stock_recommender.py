@@ -1,16 +1,34 @@
 # stock_recommender.py
 import requests
 import snowflake.connector
+from snowflake.connector.errors import NotSupportedError
 import pandas as pd
+import numpy as np
 from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
 from flask import Flask, render_template, request
 import plotly.graph_objs as go
 import json
 import os
+from html import escape
+import datetime
+import sys
 from dotenv import load_dotenv
 import re
 import time
-from typing import Dict, List, Tuple, Optional
+import atexit
+import random
+import hashlib
+import gzip
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from collections import OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Union
 import logging
 
 # Configure logging
@@ -96,168 +114,1228 @@ METRIC_CATEGORY_PATTERNS = {
     ]
 }
 
+# ------------------- Shared Cache Backend -------------------
+# Optional cache tier shared by every worker process. SHARED_CACHE_URL is a Redis URL
+# (redis://host:6379/0) or "memory://" for an in-process stand-in with the same interface;
+# unset disables the tier. Payload keys embed per-stock/per-category version counters that
+# the loader bumps in one MULTI/EXEC, so every worker moves to fresh keys at the same moment.
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL", "")
+SHARED_CACHE_PREFIX = os.getenv("SHARED_CACHE_PREFIX", "stockrec")
+
+class MemoryCacheBackend:
+    """Thread-safe in-memory stand-in for the subset of the Redis client API used here"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data: Dict[str, Tuple[object, Optional[float]]] = {}
+
+    def _live_locked(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._live_locked(key)
+
+    def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            return [self._live_locked(key) for key in keys]
+
+    def set(self, key: str, value, ex: Optional[int] = None):
+        if ex is not None and (isinstance(ex, bool) or not isinstance(ex, int) or ex <= 0):
+            # Redis rejects "EX 900.0" (and EX <= 0) rather than rounding it
+            raise ValueError("value is not an integer or out of range")
+        data = value.encode("utf-8") if isinstance(value, str) else value
+        with self._lock:
+            self._data[key] = (data, time.monotonic() + ex if ex else None)
+        return True
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._live_locked(key) or 0) + 1
+            self._data[key] = (str(value).encode("ascii"), None)
+            return value
+
+    def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        with self._lock:
+            fields = self._live_locked(key) or {}
+            fields[field] = fields.get(field, 0) + amount
+            self._data[key] = (fields, None)
+            return fields[field]
+
+    def hset(self, key: str, field: Optional[str] = None, value=None, mapping: Optional[Dict] = None) -> int:
+        updates = dict(mapping or {})
+        if field is not None:
+            updates[field] = value
+        with self._lock:
+            fields = self._live_locked(key) or {}
+            added = sum(1 for name in updates if name not in fields)
+            fields.update({name: int(count) for name, count in updates.items()})
+            self._data[key] = (fields, None)
+            return added
+
+    def hgetall(self, key: str) -> Dict[bytes, bytes]:
+        with self._lock:
+            fields = self._live_locked(key) or {}
+            return {field.encode("utf-8"): str(value).encode("ascii") for field, value in fields.items()}
+
+    def ping(self) -> bool:
+        return True
+
+    def pipeline(self, transaction: bool = True) -> "_MemoryPipeline":
+        return _MemoryPipeline(self)
+
+class _MemoryPipeline:
+    """Queues commands and applies them under the backend lock, like MULTI/EXEC"""
+
+    def __init__(self, backend: MemoryCacheBackend):
+        self._backend = backend
+        self._commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self) -> List:
+        with self._backend._lock:
+            return [getattr(self._backend, name)(*args, **kwargs) for name, args, kwargs in self._commands]
+
+def connect_shared_cache(url: str):
+    """Client for SHARED_CACHE_URL, or None when unset or unreachable (the app runs without it)"""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryCacheBackend()
+    try:
+        import redis
+    except ImportError:
+        logger.warning("⚠️ SHARED_CACHE_URL is set but the redis package is not installed; shared cache disabled")
+        return None
+    try:
+        client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        client.ping()
+        return client
+    except Exception as e:
+        logger.warning(f"⚠️ Shared cache at {url} unavailable ({e}); continuing without it")
+        return None
+
+SHARED_CACHE = connect_shared_cache(SHARED_CACHE_URL)
+
+def shared_cache_key(*parts: str) -> str:
+    return ":".join((SHARED_CACHE_PREFIX,) + parts)
+
 # ------------------- Dynamic Metric Categories -------------------
-DYNAMIC_METRIC_CATEGORIES = {
-    "Income Statement": set(),
-    "Balance Sheet": set(),
-    "Cash Flow": set(),
-    "Financial Ratios": set(),
-    "Per Share Data": set(),
-    "Valuation Metrics": set(),
-    "Other Financial Metrics": set()
-}
+METRIC_REGISTRY_FILE = os.getenv(
+    "METRIC_REGISTRY_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".scrape_cache", "metric_registry.json"),
+)
+METRIC_REGISTRY_MAX_METRICS = int(os.getenv("METRIC_REGISTRY_MAX_METRICS", "5000"))
+
+class MetricRegistry:
+    """Thread-safe record of every metric name seen, by category, persisted across restarts.
+
+    The loader thread and request threads both categorize metrics, so all access goes through
+    one lock and readers get copies. Each metric keeps an observation count; once
+    `max_metrics` names are known, new names are counted as dropped instead of stored.
+    With a shared cache backend, counts live in one hash that every process adds its
+    increments to on flush, and a fresh process starts from that hash instead of the file.
+    """
+
+    def __init__(self, path: str, max_metrics: int = 5000, shared=None):
+        self.path = path
+        self.max_metrics = max_metrics
+        self.shared = shared
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._metrics: Optional[Dict[str, Dict[str, int]]] = None
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._size = 0
+        self._dirty = False
+
+    def _load_shared(self) -> Dict[str, Dict[str, int]]:
+        loaded = {}
+        try:
+            fields = self.shared.hgetall(shared_cache_key("metric_registry"))
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read shared metric registry: {e}")
+            return loaded
+        for field, count in fields.items():
+            category, _, metric_name = field.decode("utf-8").partition("\x1f")
+            loaded.setdefault(category, {})[metric_name] = int(count)
+        return loaded
+
+    def _load_locked(self) -> Dict[str, Dict[str, int]]:
+        if self._metrics is None:
+            self._metrics = {category: {} for category in METRIC_CATEGORY_PATTERNS}
+            loaded = self._load_shared() if self.shared is not None else {}
+            if not loaded:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        loaded = json.load(f).get("metrics", {})
+                except (OSError, ValueError):
+                    loaded = {}
+            for category, metrics in loaded.items():
+                self._metrics.setdefault(category, {}).update(metrics)
+            self._size = sum(len(metrics) for metrics in self._metrics.values())
+        return self._metrics
+
+    def record(self, category: str, metric_name: str, count: int = 1, share: bool = True):
+        """Count `metric_name` under `category`; with `share`, the count is also added to the
+        shared hash on the next flush"""
+        with self._lock:
+            metrics = self._load_locked().setdefault(category, {})
+            if metric_name in metrics:
+                metrics[metric_name] += count
+            elif self._size < self.max_metrics:
+                metrics[metric_name] = count
+                self._size += 1
+            else:
+                self.dropped += 1
+                return
+            self._dirty = True
+            if self.shared is not None and share:
+                self._pending[(category, metric_name)] = self._pending.get((category, metric_name), 0) + count
+
+    def snapshot(self) -> Dict[str, List[str]]:
+        """Category -> metric names, for categories that have any"""
+        with self._lock:
+            return {category: list(metrics) for category, metrics in self._load_locked().items() if metrics}
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """Category -> number of distinct metrics and total observations"""
+        with self._lock:
+            return {
+                category: {"metrics": len(metrics), "observations": sum(metrics.values())}
+                for category, metrics in self._load_locked().items() if metrics
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load_locked()
+            return self._size
+
+    def seed_from_warehouse(self, conn) -> int:
+        """Populate from metrics already stored in Snowflake; returns how many were added"""
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT METRIC_CATEGORY, METRIC, COUNT(*)
+            FROM FINANCIALS_QUARTERLY
+            GROUP BY METRIC_CATEGORY, METRIC
+        """)
+        rows = [(category or "Other Financial Metrics", metric_name, int(count))
+                for category, metric_name, count in cur.fetchall()]
+        before = len(self)
+        for category, metric_name, count in rows:
+            self.record(category, metric_name, count, share=False)
+        if self.shared is not None and rows:
+            # Warehouse totals are absolute, so they're written with HSET rather than added:
+            # workers that all start empty and seed at once agree instead of multiplying them
+            try:
+                self.shared.hset(shared_cache_key("metric_registry"),
+                                 mapping={f"{category}\x1f{metric_name}": count
+                                          for category, metric_name, count in rows})
+            except Exception as e:
+                logger.warning(f"⚠️ Could not seed shared metric registry: {e}")
+        return len(self) - before
+
+    def flush(self):
+        """Write the registry to disk (and add new counts to the shared hash) if it changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            if self._pending:
+                try:
+                    pipe = self.shared.pipeline(transaction=True)
+                    for (category, metric_name), count in self._pending.items():
+                        pipe.hincrby(shared_cache_key("metric_registry"), f"{category}\x1f{metric_name}", count)
+                    pipe.execute()
+                    self._pending = {}
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not update shared metric registry: {e}")
+            payload = {"metrics": self._metrics, "saved_at": time.time()}
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(payload, f)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                logger.warning(f"Could not persist metric registry: {e}")
+
+    def status(self) -> Dict:
+        return {
+            "file": self.path,
+            "shared": self.shared is not None,
+            "metrics": len(self),
+            "max_metrics": self.max_metrics,
+            "dropped": self.dropped,
+            "categories": self.counts(),
+        }
+
+METRIC_REGISTRY = MetricRegistry(METRIC_REGISTRY_FILE, METRIC_REGISTRY_MAX_METRICS, SHARED_CACHE)
+atexit.register(METRIC_REGISTRY.flush)
+
+# Each category's patterns are folded into one compiled alternation, checked in the same
+# category order as before, so the first category with any matching pattern still wins.
+# `.*x.*` searched anywhere matches exactly where `x` does, so the wrapping is dropped.
+METRIC_CATEGORY_CACHE_SIZE = int(os.getenv("METRIC_CATEGORY_CACHE_SIZE", "4096"))
+
+def _compile_category_patterns(patterns: Dict) -> List[Tuple[str, re.Pattern]]:
+    compiled = []
+    for category, category_patterns in patterns.items():
+        parts = []
+        for pattern in category_patterns:
+            core = pattern[2:] if pattern.startswith(".*") else pattern
+            core = core[:-2] if core.endswith(".*") else core
+            parts.append(f"(?:{core})")
+        compiled.append((category, re.compile("|".join(parts))))
+    return compiled
+
+COMPILED_METRIC_CATEGORIES = _compile_category_patterns(METRIC_CATEGORY_PATTERNS)
+
+@lru_cache(maxsize=METRIC_CATEGORY_CACHE_SIZE)
+def _category_for(metric_lower: str) -> str:
+    for category, regex in COMPILED_METRIC_CATEGORIES:
+        if regex.search(metric_lower):
+            return category
+    return "Other Financial Metrics"
 
 def categorize_metric(metric_name: str) -> str:
     """Automatically categorize a metric based on its name using pattern matching"""
+    category = _category_for(metric_name.lower().strip())
+    METRIC_REGISTRY.record(category, metric_name)
+    return category
+
+def categorize_metric_reference(metric_name: str) -> str:
+    """Original per-pattern categorizer, kept as the reference for --benchmark-categorizer"""
     metric_lower = metric_name.lower().strip()
     
     # Check each category's patterns
     for category, patterns in METRIC_CATEGORY_PATTERNS.items():
         for pattern in patterns:
             if re.search(pattern, metric_lower):
-                DYNAMIC_METRIC_CATEGORIES[category].add(metric_name)
                 return category
     
     # Default category for unmatched metrics
-    DYNAMIC_METRIC_CATEGORIES["Other Financial Metrics"].add(metric_name)
     return "Other Financial Metrics"
 
+def benchmark_categorizer(names: List[str], repeat: int = 5) -> Dict:
+    """Time the reference, compiled and memoized categorizers over `names` and check they agree"""
+    def best_of(func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for name in names:
+                func(name)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    uncached = _category_for.__wrapped__
+    mismatches = [name for name in names
+                  if categorize_metric_reference(name) != uncached(name.lower().strip())]
+    _category_for.cache_clear()
+    timings = {
+        "reference": best_of(categorize_metric_reference),
+        "compiled": best_of(lambda name: uncached(name.lower().strip())),
+        "memoized": best_of(lambda name: _category_for(name.lower().strip())),
+    }
+    return {
+        "names": len(names),
+        "unique_names": len(set(names)),
+        **{f"{label}_ms": round(elapsed * 1000, 2) for label, elapsed in timings.items()},
+        "compiled_speedup": round(timings["reference"] / timings["compiled"], 2) if timings["compiled"] else None,
+        "memoized_speedup": round(timings["reference"] / timings["memoized"], 2) if timings["memoized"] else None,
+        "cache": _category_for.cache_info()._asdict(),
+        "identical": not mismatches,
+        "mismatches": mismatches[:20],
+    }
+
+def categorizer_benchmark_names(pages: List[Tuple[str, bytes]]) -> List[str]:
+    """Metric names as a load would see them: every metric of every page, plus the fallback set"""
+    names = []
+    for stock_code, content in pages:
+        data, _, _, _ = extract_financial_page(content, stock_code)
+        names.extend(data.keys())
+    for stock_data in FALLBACK_FINANCIAL_DATA.values():
+        names.extend(stock_data["data"].keys())
+    return names
+
 def get_all_metric_categories() -> Dict:
     """Get all metric categories including dynamically discovered ones"""
-    return {k: list(v) for k, v in DYNAMIC_METRIC_CATEGORIES.items() if v}
+    return METRIC_REGISTRY.snapshot()
 
 # ------------------- Batch Loader -------------------
-def load_all_data():
-    """Load all stock data with improved error handling and batch processing"""
+# Outcome of the most recent load_all_data run (rows written vs skipped), shown on /diagnostic
+LAST_LOAD_REPORT: Dict = {}
+
+def load_all_data(job: Optional["Job"] = None) -> Dict:
+    """Load all stock data with improved error handling and batch processing.
+
+    When run as a background job, per-stock progress, rows written and errors are reported
+    on `job`. Returns the load report (also kept in LAST_LOAD_REPORT).
+    """
     logger.info("🔄 Loading all data")
     
     try:
-        create_snowflake_table()
-        conn = snowflake_connect()
-        
-        total_stocks = sum(len(stocks) for stocks in STOCKS.values())
+        all_stocks = [stock for stocks in STOCKS.values() for stock in stocks]
+        total_stocks = len(all_stocks)
         current_stock = 0
-        
-        for category, stocks in STOCKS.items():
-            for stock in stocks:
+        start = time.monotonic()
+        if job is not None:
+            job.set_total(total_stocks)
+
+        with snowflake_connection() as conn:
+            ensure_schema(conn)
+            buffer = QuarterlyRowBuffer(conn, SNOWFLAKE_FLUSH_ROWS, SNOWFLAKE_FLUSH_SECONDS)
+
+            # Pages are downloaded concurrently (rate limited per host); parsing happens here as
+            # downloads complete, and rows from many stocks are merged together in large batches
+            for result in SCRAPE_ENGINE.fetch_pages(all_stocks):
+                stock = result.stock_code
                 current_stock += 1
-                logger.info(f"Processing {stock} ({current_stock}/{total_stocks})")
-                
+                logger.info(f"Processing {stock} ({current_stock}/{total_stocks}, fetched in {result.elapsed:.1f}s)")
+
+                error = None
                 try:
-                    data, quarters, stock_category, industry = get_financial_data(stock)
-                    if data and quarters:
-                        insert_quarterly_to_snowflake(conn, stock, data, quarters, stock_category, industry)
-                        logger.info(f"✅ Successfully loaded {stock} with {len(data)} metrics")
+                    data, quarters, stock_category, industry = scrape_result_to_financial_data(result)
+                    rows = quarterly_rows(stock, data, quarters, stock_category, industry) if data and quarters else []
+                    if rows:
+                        buffer.add(stock, rows)
+                        logger.info(f"✅ Buffered {stock} with {len(data)} metrics ({len(rows)} rows)")
                     else:
                         logger.warning(f"⚠️ No data found for {stock}")
+                        error = "no data found"
                 except Exception as e:
                     logger.error(f"❌ Error processing {stock}: {e}")
-                    continue
-                
-                # Add delay to avoid overwhelming the server
-                time.sleep(2)
-        
-        conn.close()
-        
+                    error = str(e)
+                if job is not None:
+                    job.advance(stock, rows_written=buffer.stats["rows_written"], error=error)
+
+            buffer.flush()
+
+        logger.info(f"⏱️ Processed {total_stocks} stocks in {time.monotonic() - start:.1f}s "
+                    f"(peak RSS {_peak_rss_mb()} MB); {buffer.stats['rows_written']} rows written, "
+                    f"{buffer.stats['rows_skipped']} unchanged rows skipped, in {buffer.stats['flushes']} flushes")
+        if buffer.failed_stocks:
+            logger.warning(f"⚠️ Failed to store: {', '.join(buffer.failed_stocks)}")
+        LAST_LOAD_REPORT.clear()
+        LAST_LOAD_REPORT.update(buffer.stats, stocks=total_stocks, failed_stocks=list(buffer.failed_stocks),
+                                seconds=round(time.monotonic() - start, 1), finished_at=time.time())
+        if job is not None:
+            job.rows_written = buffer.stats["rows_written"]
+            for stock in buffer.failed_stocks:
+                job.add_error(f"{stock}: failed to store")
+            job.message = (f"Loaded {total_stocks} stocks: {buffer.stats['rows_written']} rows written, "
+                           f"{buffer.stats['rows_skipped']} unchanged")
+
         # Log summary of discovered metrics
-        total_metrics = sum(len(metrics) for metrics in DYNAMIC_METRIC_CATEGORIES.values())
-        logger.info(f"✅ All data loaded successfully! Discovered {total_metrics} unique metrics")
+        METRIC_REGISTRY.flush()
+        logger.info(f"✅ All data loaded successfully! Discovered {len(METRIC_REGISTRY)} unique metrics")
         
-        for category, metrics in DYNAMIC_METRIC_CATEGORIES.items():
-            if metrics:
-                logger.info(f"📊 {category}: {len(metrics)} metrics")
+        for category, counts in METRIC_REGISTRY.counts().items():
+            logger.info(f"📊 {category}: {counts['metrics']} metrics")
+
+        return dict(LAST_LOAD_REPORT)
         
     except Exception as e:
         logger.error(f"❌ Error during data loading: {e}")
         raise
 
+# ------------------- Payload Cache -------------------
+# Built route payloads only change when the loader writes, so they're served from memory.
+# Keys are ("stock", code) or ("sector", name), optionally followed by a variant (e.g. a
+# quarter window); each carries one tag ("stock:TCS", "category:large cap") and a write
+# invalidates exactly the tags it touched. With a shared
+# backend the tag's version counter is part of the shared key, so writes in any process
+# invalidate every worker; the TTL bounds staleness otherwise (e.g. cron `--load-data`).
+PAYLOAD_CACHE_MAX_ENTRIES = int(os.getenv("PAYLOAD_CACHE_MAX_ENTRIES", "512"))
+PAYLOAD_CACHE_TTL = float(os.getenv("PAYLOAD_CACHE_TTL", "900"))
+
+def payload_cache_tag(key: Tuple) -> str:
+    kind, name = key[:2]
+    return f"stock:{name}" if kind == "stock" else f"category:{name.lower()}"
+
+def _shared_payload_key(key: Tuple, tag: str, version: int) -> str:
+    return shared_cache_key("payload", tag, str(version), *(str(part) for part in key[2:]))
+
+class PayloadCache:
+    """Two-tier payload cache: bounded in-process LRU with TTL, optionally backed by a shared store"""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 900, shared=None):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.shared = shared
+        self.stats = {"hits": 0, "shared_hits": 0, "misses": 0, "expired": 0, "evictions": 0,
+                      "invalidations": 0, "puts": 0, "stale_puts": 0, "shared_errors": 0}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._entries: "OrderedDict[Tuple, Tuple[object, float, str]]" = OrderedDict()
+        self._tags: Dict[str, set] = {}
+
+    def _shared_version(self, tag: str) -> Optional[int]:
+        """Current shared version of `tag` (0 if never bumped); None without a reachable shared tier"""
+        if self.shared is None:
+            return None
+        try:
+            return int(self.shared.get(shared_cache_key("version", tag)) or 0)
+        except Exception as e:
+            self._count("shared_errors")
+            logger.debug(f"Shared cache version read failed: {e}")
+            return None
+
+    def _count(self, stat: str, amount: int = 1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def lookup(self, key: Tuple) -> Tuple[Optional[object], Tuple]:
+        """(payload or None, token); pass the token back to put() after a miss"""
+        tag = payload_cache_tag(key)
+        version = self._shared_version(tag)
+        local_key = (key, version)
+        with self._lock:
+            token = (self._generation, version)
+            entry = self._entries.get(local_key)
+            if entry is not None:
+                value, expires_at, _ = entry
+                if time.monotonic() < expires_at:
+                    self._entries.move_to_end(local_key)
+                    self.stats["hits"] += 1
+                    return value, token
+                self._remove_locked(local_key)
+                self.stats["expired"] += 1
+
+        if version is not None:
+            try:
+                raw = self.shared.get(_shared_payload_key(key, tag, version))
+            except Exception as e:
+                self._count("shared_errors")
+                logger.debug(f"Shared cache read failed: {e}")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                with self._lock:
+                    self.stats["shared_hits"] += 1
+                    self._store_locked(local_key, value, tag)
+                return value, token
+
+        self._count("misses")
+        return None, token
+
+    def put(self, key: Tuple, value, token: Tuple):
+        """Cache a payload built after lookup() missed, unless an invalidation happened since"""
+        generation, version = token
+        tag = payload_cache_tag(key)
+        with self._lock:
+            if generation != self._generation:
+                # Read from the database before a local write landed; it may predate it
+                self.stats["stale_puts"] += 1
+                return
+            self._store_locked((key, version), value, tag)
+            self.stats["puts"] += 1
+        if version is not None:
+            # A payload built under an old version lands under an old key nobody reads any more
+            try:
+                self.shared.set(_shared_payload_key(key, tag, version), json.dumps(value),
+                                ex=max(1, int(self.ttl)))
+            except Exception as e:
+                self._count("shared_errors")
+                logger.debug(f"Shared cache write failed: {e}")
+
+    def invalidate_tags(self, tags: List[str]) -> int:
+        """Drop every entry carrying any of `tags` here, and bump their shared versions"""
+        dropped = 0
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for local_key in list(self._tags.get(tag, ())):
+                    self._remove_locked(local_key)
+                    dropped += 1
+            self.stats["invalidations"] += dropped
+        if self.shared is not None and tags:
+            try:
+                pipe = self.shared.pipeline(transaction=True)
+                for tag in tags:
+                    pipe.incr(shared_cache_key("version", tag))
+                pipe.execute()
+            except Exception as e:
+                self._count("shared_errors")
+                logger.warning(f"⚠️ Could not bump shared cache versions: {e}")
+        return dropped
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _store_locked(self, local_key: Tuple, value, tag: str):
+        if local_key in self._entries:
+            self._remove_locked(local_key)
+        self._entries[local_key] = (value, time.monotonic() + self.ttl, tag)
+        self._tags.setdefault(tag, set()).add(local_key)
+        while len(self._entries) > self.max_entries:
+            self._remove_locked(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _remove_locked(self, local_key: Tuple):
+        entry = self._entries.pop(local_key, None)
+        if entry is None:
+            return
+        keys = self._tags.get(entry[2])
+        if keys is not None:
+            keys.discard(local_key)
+            if not keys:
+                del self._tags[entry[2]]
+
+    def summary(self) -> Dict:
+        with self._lock:
+            summary = dict(self.stats)
+            summary["entries"] = len(self._entries)
+        lookups = summary["hits"] + summary["shared_hits"] + summary["misses"]
+        summary["hit_rate"] = round((summary["hits"] + summary["shared_hits"]) / lookups, 3) if lookups else None
+        summary["max_entries"] = self.max_entries
+        summary["ttl_seconds"] = self.ttl
+        summary["shared_backend"] = type(self.shared).__name__ if self.shared is not None else None
+        return summary
+
+PAYLOAD_CACHE = PayloadCache(PAYLOAD_CACHE_MAX_ENTRIES, PAYLOAD_CACHE_TTL, SHARED_CACHE)
+
+# ------------------- Cold Load Coalescing -------------------
+# A view of a stock that isn't stored yet scrapes and loads it inline. SingleFlight makes
+# concurrent misses for the same stock wait on one load instead of each scraping and
+# merging, and briefly remembers the outcome so requests arriving just after it finished
+# reuse it too. With COLD_LOAD_ASYNC (or ?async=1), the view returns a "loading" page at
+# once and polls while the load runs in the background.
+COLD_LOAD_ASYNC = os.getenv("COLD_LOAD_ASYNC", "false").lower() in ("1", "true", "yes")
+COLD_LOAD_WORKERS = int(os.getenv("COLD_LOAD_WORKERS", "2"))
+COLD_LOAD_TIMEOUT = float(os.getenv("COLD_LOAD_TIMEOUT", "120"))
+COLD_LOAD_OUTCOME_TTL = float(os.getenv("COLD_LOAD_OUTCOME_TTL", "30"))
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share its result or error"""
+
+    def __init__(self, outcome_ttl: float = 30):
+        self.outcome_ttl = outcome_ttl
+        self.stats = {"leaders": 0, "followers": 0, "reused": 0, "background": 0}
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._outcomes: Dict[str, Tuple[object, Optional[BaseException], float]] = {}
+
+    def _begin(self, key: str) -> Tuple[_Flight, bool]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.stats["followers"] += 1
+                return flight, False
+            flight = _Flight()
+            self._flights[key] = flight
+            self.stats["leaders"] += 1
+            return flight, True
+
+    def _run(self, key: str, flight: _Flight, fn):
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                self._outcomes[key] = (flight.result, flight.error, time.monotonic())
+            flight.done.set()
+
+    def outcome(self, key: str) -> Optional[Tuple[object, Optional[BaseException]]]:
+        """(result, error) of a call for `key` that finished within outcome_ttl, if any"""
+        with self._lock:
+            entry = self._outcomes.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[2] > self.outcome_ttl:
+                del self._outcomes[key]
+                return None
+            return entry[0], entry[1]
+
+    def do(self, key: str, fn, timeout: Optional[float] = None):
+        """Run `fn` for `key`, or wait for the call already running; re-raises its error"""
+        recent = self.outcome(key)
+        if recent is not None:
+            with self._lock:
+                self.stats["reused"] += 1
+            result, error = recent
+        else:
+            flight, leader = self._begin(key)
+            if leader:
+                self._run(key, flight, fn)
+            elif not flight.done.wait(timeout):
+                raise TimeoutError(f"Timed out after {timeout}s waiting for the in-flight load of {key}")
+            result, error = flight.result, flight.error
+        if error is not None:
+            raise error
+        return result
+
+    def submit(self, key: str, fn, executor: ThreadPoolExecutor) -> bool:
+        """Start `fn` in the background unless a call for `key` is already running"""
+        flight, leader = self._begin(key)
+        if leader:
+            with self._lock:
+                self.stats["background"] += 1
+            executor.submit(self._run, key, flight, fn)
+        return leader
+
+    def summary(self) -> Dict:
+        with self._lock:
+            summary = dict(self.stats)
+            summary["in_flight"] = sorted(self._flights)
+        return summary
+
+COLD_LOADS = SingleFlight(COLD_LOAD_OUTCOME_TTL)
+COLD_LOAD_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, COLD_LOAD_WORKERS), thread_name_prefix="cold-load")
+
+def cold_load_stock(stock_code: str) -> bool:
+    """Scrape one stock and store it on a connection of its own; True if data was stored"""
+    data, quarters, category, industry = get_financial_data(stock_code)
+    if not (data and quarters):
+        return False
+    with snowflake_connection() as conn:
+        ensure_schema(conn)
+        insert_quarterly_to_snowflake(conn, stock_code, data, quarters, category, industry)
+    logger.info(f"Successfully loaded data for {stock_code}")
+    return True
+
+def load_stock_once(stock_code: str) -> bool:
+    """cold_load_stock, coalesced with any concurrent load of the same stock"""
+    return COLD_LOADS.do(stock_code, lambda: cold_load_stock(stock_code), timeout=COLD_LOAD_TIMEOUT)
+
+def cold_load_async_requested() -> bool:
+    return COLD_LOAD_ASYNC or request.values.get("async") == "1"
+
+def cold_load_pending_response(stock: str) -> Optional[str]:
+    """Start (or join) a background load and return a self-refreshing "loading" page.
+
+    Returns None when a load of this stock has just finished, so the caller reports that
+    outcome instead of starting another one.
+    """
+    if COLD_LOADS.outcome(stock) is not None:
+        return None
+    COLD_LOADS.submit(stock, lambda: cold_load_stock(stock), COLD_LOAD_EXECUTOR)
+
+    if request.method == "POST":
+        # Re-post the same form (e.g. /visualize) rather than reloading, which would prompt
+        fields = "".join(f'<input type="hidden" name="{escape(name)}" value="{escape(value)}">'
+                         for name, value in request.form.items())
+        retry = f'<form id="retry" method="post" action="{escape(request.path)}">{fields}</form>'
+        script = "document.getElementById('retry').submit();"
+    else:
+        retry = ""
+        script = "location.reload();"
+    return f"""
+    <div class="container mt-5">
+        <div class="alert alert-info">
+            <h4>⏳ Loading data for {stock}...</h4>
+            <p>This stock hasn't been loaded yet. Fetching it now; this page refreshes automatically.</p>
+            <a href="/" class="btn btn-primary">← Back to Dashboard</a>
+        </div>
+        {retry}
+        <script>setTimeout(function () {{ {script} }}, 3000);</script>
+    </div>
+    """
+
+# ------------------- Background Jobs -------------------
+# /load-data and /load-single enqueue jobs on a small bounded pool instead of running in the
+# request (or in an untracked thread). A job's key identifies the work ("load-data",
+# "load-single:TCS"); submitting a key that is already queued or running returns the
+# existing job, so repeated clicks don't start overlapping loads. Progress is polled through
+# GET /jobs/<id>, and job history is kept in a local SQLite file so it survives restarts.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_HISTORY_DB = os.getenv(
+    "JOB_HISTORY_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".scrape_cache", "jobs.sqlite3"),
+)
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "500"))
+JOB_PROGRESS_PERSIST_SECONDS = float(os.getenv("JOB_PROGRESS_PERSIST_SECONDS", "2"))
+JOB_MAX_ERRORS = 50
+
+JOB_ACTIVE_STATES = ("queued", "running")
+
+class Job:
+    """One unit of background work and its progress (stocks done/total, rows written, errors)"""
+
+    def __init__(self, kind: str, key: str, job_id: Optional[str] = None):
+        self.id = job_id or hashlib.sha1(f"{key}:{time.time_ns()}:{random.random()}".encode()).hexdigest()[:12]
+        self.kind = kind
+        self.key = key
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.total = 0
+        self.done = 0
+        self.rows_written = 0
+        self.current: Optional[str] = None
+        self.errors: List[str] = []
+        self.message = ""
+        self.result: Optional[Dict] = None
+        self._lock = threading.Lock()
+        self._on_progress = None
+
+    def set_total(self, total: int):
+        with self._lock:
+            self.total = total
+        self._progressed()
+
+    def advance(self, stock_code: str, rows_written: Optional[int] = None, error: Optional[str] = None):
+        """Mark one stock as processed; rows_written is the job's running total, if known"""
+        with self._lock:
+            self.done += 1
+            self.current = stock_code
+            if rows_written is not None:
+                self.rows_written = rows_written
+            if error:
+                self._add_error(f"{stock_code}: {error}")
+        self._progressed()
+
+    def add_error(self, error: str):
+        with self._lock:
+            self._add_error(error)
+        self._progressed()
+
+    def _add_error(self, error: str):
+        if len(self.errors) < JOB_MAX_ERRORS:
+            self.errors.append(error)
+
+    def _progressed(self):
+        if self._on_progress is not None:
+            self._on_progress(self)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            finished = self.finished_at or time.time()
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "key": self.key,
+                "status": self.status,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "elapsed": round(finished - self.started_at, 1) if self.started_at else None,
+                "total": self.total,
+                "done": self.done,
+                "percent": round(100.0 * self.done / self.total, 1) if self.total else None,
+                "rows_written": self.rows_written,
+                "current": self.current,
+                "errors": list(self.errors),
+                "message": self.message,
+                "result": self.result,
+            }
+
+class JobHistory:
+    """SQLite-backed job history (one short-lived connection per operation)"""
+
+    COLUMNS = ("id", "kind", "job_key", "status", "created_at", "started_at", "finished_at",
+               "total", "done", "rows_written", "errors", "message", "result")
+
+    def __init__(self, path: str, limit: int = 500):
+        self.path = path
+        self.limit = limit
+        self.available = True
+        self._lock = threading.Lock()
+        try:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._memory = sqlite3.connect(":memory:", check_same_thread=False) if path == ":memory:" else None
+            with self._lock, self._connect() as db:
+                db.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY, kind TEXT, job_key TEXT, status TEXT,
+                        created_at REAL, started_at REAL, finished_at REAL,
+                        total INTEGER, done INTEGER, rows_written INTEGER,
+                        errors TEXT, message TEXT, result TEXT
+                    )
+                """)
+                db.execute("CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at)")
+                # Jobs a previous process left queued/running will never finish
+                db.execute("UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE status IN (?, ?)",
+                           (time.time(),) + JOB_ACTIVE_STATES)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Job history disabled ({path}): {e}")
+            self.available = False
+
+    def _connect(self):
+        return self._memory if self._memory is not None else sqlite3.connect(self.path, timeout=10)
+
+    def save(self, job: Job):
+        if not self.available:
+            return
+        record = job.to_dict()
+        values = (record["id"], record["kind"], record["key"], record["status"], record["created_at"],
+                  record["started_at"], record["finished_at"], record["total"], record["done"],
+                  record["rows_written"], json.dumps(record["errors"]), record["message"],
+                  json.dumps(record["result"], default=str))
+        try:
+            with self._lock, self._connect() as db:
+                db.execute(f"INSERT OR REPLACE INTO jobs ({', '.join(self.COLUMNS)}) "
+                           f"VALUES ({', '.join('?' * len(self.COLUMNS))})", values)
+                if job.finished_at is not None:
+                    db.execute("DELETE FROM jobs WHERE id NOT IN "
+                               "(SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?)", (self.limit,))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Could not record job {job.id}: {e}")
+
+    def _record(self, row) -> Dict:
+        record = dict(zip(self.COLUMNS, row))
+        record["key"] = record.pop("job_key")
+        record["errors"] = json.loads(record["errors"] or "[]")
+        record["result"] = json.loads(record["result"] or "null")
+        started, finished = record["started_at"], record["finished_at"]
+        record["elapsed"] = round(finished - started, 1) if started and finished else None
+        record["percent"] = round(100.0 * record["done"] / record["total"], 1) if record["total"] else None
+        return record
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        if not self.available:
+            return None
+        with self._lock, self._connect() as db:
+            row = db.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def recent(self, limit: int = 20) -> List[Dict]:
+        if not self.available:
+            return []
+        with self._lock, self._connect() as db:
+            rows = db.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs ORDER BY created_at DESC LIMIT ?",
+                              (limit,)).fetchall()
+        return [self._record(row) for row in rows]
+
+class JobManager:
+    """Bounded worker pool for background jobs, de-duplicated by job key"""
+
+    def __init__(self, workers: int = 2, history: Optional[JobHistory] = None):
+        self.workers = max(1, workers)
+        self.history = history
+        self.stats = {"submitted": 0, "deduplicated": 0, "succeeded": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._active: Dict[str, Job] = {}
+
+    def submit(self, kind: str, key: str, fn) -> Tuple[Job, bool]:
+        """Queue fn(job) unless a job with the same key is queued or running; (job, created)"""
+        with self._lock:
+            existing = self._active.get(key)
+            if existing is not None:
+                self.stats["deduplicated"] += 1
+                return existing, False
+            job = Job(kind, key)
+            job._on_progress = self._progress_saver()
+            self._active[key] = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > JOB_HISTORY_LIMIT:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.status in JOB_ACTIVE_STATES:
+                    break
+                self._jobs.popitem(last=False)
+            self.stats["submitted"] += 1
+        self._save(job)
+        self._executor.submit(self._run, job, fn)
+        logger.info(f"🗂️ Queued job {job.id} ({key})")
+        return job, True
+
+    def _progress_saver(self):
+        # Progress is persisted at most every JOB_PROGRESS_PERSIST_SECONDS; state changes always are
+        last_saved = [0.0]
+
+        def save(job: Job):
+            now = time.monotonic()
+            if now - last_saved[0] >= JOB_PROGRESS_PERSIST_SECONDS:
+                last_saved[0] = now
+                self._save(job)
+        return save
+
+    def _run(self, job: Job, fn):
+        with job._lock:
+            job.status = "running"
+            job.started_at = time.time()
+        self._save(job)
+        try:
+            result = fn(job)
+            with job._lock:
+                job.result = result
+                job.status = "succeeded"
+                job.message = job.message or "Completed"
+            self._count("succeeded")
+        except Exception as e:
+            logger.error(f"❌ Job {job.id} ({job.key}) failed: {e}")
+            with job._lock:
+                job.status = "failed"
+                job.message = str(e)
+                job._add_error(str(e))
+            self._count("failed")
+        finally:
+            with job._lock:
+                job.finished_at = time.time()
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+            self._save(job)
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _save(self, job: Job):
+        if self.history is not None:
+            self.history.save(job)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self.history.get(job_id) if self.history is not None else None
+
+    def recent(self, limit: int = 20) -> List[Dict]:
+        if self.history is not None and self.history.available:
+            return self.history.recent(limit)
+        with self._lock:
+            jobs = list(self._jobs.values())[-limit:]
+        return [job.to_dict() for job in reversed(jobs)]
+
+    def summary(self) -> Dict:
+        with self._lock:
+            summary = dict(self.stats)
+            summary["workers"] = self.workers
+            summary["active"] = {key: job.id for key, job in self._active.items()}
+        summary["history"] = self.history.path if self.history is not None and self.history.available else None
+        return summary
+
+JOB_MANAGER = JobManager(JOB_WORKERS, JobHistory(JOB_HISTORY_DB, JOB_HISTORY_LIMIT))
+
+def load_single_job(job: Job, stock_code: str) -> Dict:
+    """Job body for /load-single: scrape one stock, then store it on a connection of its own"""
+    job.set_total(1)
+    data, quarters, category, industry = get_financial_data(stock_code)
+    if not (data and quarters):
+        raise ValueError(f"No data found for {stock_code}. Please check if the stock code is correct.")
+    with snowflake_connection() as conn:
+        ensure_schema(conn)
+        outcome = insert_quarterly_to_snowflake(conn, stock_code, data, quarters, category, industry) or {}
+    job.advance(stock_code, rows_written=outcome.get("written", 0))
+    job.message = f"Successfully loaded {len(data)} metrics for {stock_code}"
+    return {"metrics_count": len(data), "quarters": quarters, "category": category, "industry": industry}
+
+# ------------------- Route Queries -------------------
+# Hot read queries, shared by the routes and --clustering-report so the report explains
+# exactly what the routes run.
+# quarterly_view and visualize read the pre-pivoted per-stock snapshot
+SNAPSHOT_LOOKUP_SQL = "SELECT PAYLOAD FROM FINANCIALS_SNAPSHOT WHERE STOCK_CODE=%s"
+SECTOR_CATEGORIES_SQL = "SELECT DISTINCT CATEGORY FROM FINANCIALS_QUARTERLY WHERE CATEGORY IS NOT NULL"
+SECTOR_VIEW_SQL = """
+    SELECT STOCK_CODE, METRIC, QUARTER, VALUE_NUM, METRIC_CATEGORY, PERIOD_ORDINAL
+    FROM FINANCIALS_QUARTERLY
+    WHERE CATEGORY=%s
+    ORDER BY METRIC_CATEGORY, STOCK_CODE, METRIC, PERIOD_ORDINAL
+"""
+# Last N dated periods of a sector, plus its TTM/undated columns
+# (params: category, PERIOD_ORDINAL_TTM, PERIOD_ORDINAL_TTM, N)
+SECTOR_VIEW_WINDOW_SQL = """
+    SELECT STOCK_CODE, METRIC, QUARTER, VALUE_NUM, METRIC_CATEGORY, PERIOD_ORDINAL
+    FROM FINANCIALS_QUARTERLY
+    WHERE CATEGORY=%s
+    QUALIFY PERIOD_ORDINAL IS NULL OR PERIOD_ORDINAL >= %s
+        OR DENSE_RANK() OVER (ORDER BY IFF(PERIOD_ORDINAL < %s, PERIOD_ORDINAL, NULL) DESC NULLS LAST) <= %s
+    ORDER BY METRIC_CATEGORY, STOCK_CODE, METRIC, PERIOD_ORDINAL
+"""
+# Only the quarterly results table holds real quarterly series. The annual sections are stored
+# under the same quarter labels (profit-loss rows as "Annual ...", and the balance sheet, cash
+# flow and ratio rows as they are), so each row records the page section it was read from
+# (SOURCE_SECTION) and growth, sector ranks and derived features only use the quarterly
+# results section: in SQL via QUARTERLY_SERIES_PREDICATE, on frames via quarterly_series_mask.
+QUARTERLY_SERIES_SECTION = "quarters"
+QUARTERLY_SERIES_PREDICATE = f"{{alias}}SOURCE_SECTION = '{QUARTERLY_SERIES_SECTION}'"
+
+def quarterly_series_mask(frame: pd.DataFrame) -> pd.Series:
+    """QUARTERLY_SERIES_PREDICATE over a frame with a SOURCE_SECTION column"""
+    return frame["SOURCE_SECTION"] == QUARTERLY_SERIES_SECTION
+
+# Sector comparison computed in the warehouse: for the target period, one row per quarterly
+# series metric and stock with its value, QoQ/YoY growth, rank among the sector's stocks, the
+# metric's median and quartiles across them, and how many of the sector's stocks it covers.
+# Named binds:
+# category, ordinal (a dated PERIOD_ORDINAL, or NULL for the latest period reported by at
+# least `coverage` of the sector's stocks, so early reporters don't shrink the comparison to
+# themselves), coverage and ttm (PERIOD_ORDINAL_TTM).
+SECTOR_ANALYTICS_MIN_COVERAGE = float(os.getenv("SECTOR_ANALYTICS_MIN_COVERAGE", "0.5"))
+SECTOR_ANALYTICS_SQL = f"""
+    WITH reported AS (
+        SELECT PERIOD_ORDINAL, COUNT(DISTINCT STOCK_CODE) AS STOCKS
+        FROM FINANCIALS_QUARTERLY
+        WHERE CATEGORY = %(category)s AND PERIOD_ORDINAL < %(ttm)s AND VALUE_NUM IS NOT NULL
+          AND {QUARTERLY_SERIES_PREDICATE.format(alias="")}
+        GROUP BY PERIOD_ORDINAL
+    ),
+    sector AS (
+        SELECT COUNT(DISTINCT STOCK_CODE) AS STOCKS
+        FROM FINANCIALS_QUARTERLY
+        WHERE CATEGORY = %(category)s
+    ),
+    target AS (
+        SELECT COALESCE(%(ordinal)s,
+                        MAX(IFF(r.STOCKS >= s.STOCKS * %(coverage)s, r.PERIOD_ORDINAL, NULL)),
+                        MAX(r.PERIOD_ORDINAL)) AS ORDINAL,
+               s.STOCKS AS SECTOR_STOCKS
+        FROM reported r CROSS JOIN sector s
+        GROUP BY s.STOCKS
+    ),
+    per_stock AS (
+        SELECT q.METRIC_CATEGORY, q.METRIC, q.STOCK_CODE, t.ORDINAL, t.SECTOR_STOCKS,
+               MAX(IFF(q.PERIOD_ORDINAL = t.ORDINAL, q.VALUE_NUM, NULL)) AS VALUE_NOW,
+               MAX(IFF(q.PERIOD_ORDINAL = t.ORDINAL - 3, q.VALUE_NUM, NULL)) AS VALUE_PREV_QUARTER,
+               MAX(IFF(q.PERIOD_ORDINAL = t.ORDINAL - 12, q.VALUE_NUM, NULL)) AS VALUE_PREV_YEAR
+        FROM FINANCIALS_QUARTERLY q
+        JOIN target t ON q.PERIOD_ORDINAL IN (t.ORDINAL, t.ORDINAL - 3, t.ORDINAL - 12)
+        WHERE q.CATEGORY = %(category)s AND {QUARTERLY_SERIES_PREDICATE.format(alias="q.")}
+        GROUP BY q.METRIC_CATEGORY, q.METRIC, q.STOCK_CODE, t.ORDINAL, t.SECTOR_STOCKS
+    )
+    SELECT METRIC_CATEGORY, METRIC, STOCK_CODE, ORDINAL, SECTOR_STOCKS, VALUE_NOW,
+           (VALUE_NOW - VALUE_PREV_QUARTER) / NULLIF(ABS(VALUE_PREV_QUARTER), 0) AS QOQ_GROWTH,
+           (VALUE_NOW - VALUE_PREV_YEAR) / NULLIF(ABS(VALUE_PREV_YEAR), 0) AS YOY_GROWTH,
+           RANK() OVER (PARTITION BY METRIC_CATEGORY, METRIC ORDER BY VALUE_NOW DESC) AS SECTOR_RANK,
+           COUNT(*) OVER (PARTITION BY METRIC_CATEGORY, METRIC) AS PEERS,
+           MEDIAN(VALUE_NOW) OVER (PARTITION BY METRIC_CATEGORY, METRIC) AS MEDIAN,
+           PERCENTILE_CONT(0.25) WITHIN GROUP (ORDER BY VALUE_NOW)
+               OVER (PARTITION BY METRIC_CATEGORY, METRIC) AS Q1,
+           PERCENTILE_CONT(0.75) WITHIN GROUP (ORDER BY VALUE_NOW)
+               OVER (PARTITION BY METRIC_CATEGORY, METRIC) AS Q3
+    FROM per_stock
+    WHERE VALUE_NOW IS NOT NULL
+    ORDER BY METRIC_CATEGORY, METRIC, SECTOR_RANK, STOCK_CODE
+"""
+SECTOR_ANALYTICS_COLUMNS = ["METRIC_CATEGORY", "METRIC", "STOCK_CODE", "ORDINAL", "SECTOR_STOCKS", "VALUE_NOW",
+                            "QOQ_GROWTH", "YOY_GROWTH", "SECTOR_RANK", "PEERS", "MEDIAN", "Q1", "Q3"]
+
+def sector_analytics_params(category: str, ordinal: Optional[int] = None) -> Dict:
+    return {"category": category, "ordinal": ordinal, "coverage": SECTOR_ANALYTICS_MIN_COVERAGE,
+            "ttm": PERIOD_ORDINAL_TTM}
+# Precomputed growth/TTM/CAGR features of one stock, chronological per metric
+FEATURES_LOOKUP_SQL = """
+    SELECT METRIC, METRIC_CATEGORY, QUARTER, VALUE_NUM, QOQ_GROWTH, YOY_GROWTH, TTM_VALUE, TTM_YOY_GROWTH,
+           CAGR_3Y, CAGR_5Y
+    FROM FINANCIALS_FEATURES
+    WHERE STOCK_CODE=%s
+    ORDER BY METRIC_CATEGORY, METRIC, PERIOD_ORDINAL
+"""
+DEBUG_SAMPLE_SQL = """
+    SELECT METRIC, QUARTER, VALUE, METRIC_CATEGORY
+    FROM FINANCIALS_QUARTERLY
+    WHERE STOCK_CODE=%s
+    ORDER BY METRIC_CATEGORY, METRIC, QUARTER
+    LIMIT 20
+"""
+METRICS_BY_CATEGORY_SQL = """
+    SELECT DISTINCT METRIC
+    FROM FINANCIALS_QUARTERLY
+    WHERE METRIC_CATEGORY = %s
+    ORDER BY METRIC
+"""
+# Window the report explains SECTOR_VIEW_WINDOW_SQL with (a typical ?quarters=N)
+CLUSTERING_REPORT_WINDOW = 8
+# route -> (query, bind): bind is None, the sample value that binds to its only %s, or
+# (sample value, function building the query's binds from it)
+ROUTE_QUERIES = {
+    "quarterly_view / visualize": (SNAPSHOT_LOOKUP_SQL, "STOCK_CODE"),
+    "api_stock_features": (FEATURES_LOOKUP_SQL, "STOCK_CODE"),
+    "debug_data": (DEBUG_SAMPLE_SQL, "STOCK_CODE"),
+    "sector_view (categories)": (SECTOR_CATEGORIES_SQL, None),
+    "sector_view": (SECTOR_VIEW_SQL, "CATEGORY"),
+    "sector_view (?quarters=N)": (SECTOR_VIEW_WINDOW_SQL, ("CATEGORY", lambda category: (
+        category, PERIOD_ORDINAL_TTM, PERIOD_ORDINAL_TTM, QUARTER_WINDOW_DEFAULT or CLUSTERING_REPORT_WINDOW))),
+    "api_sector_analytics": (SECTOR_ANALYTICS_SQL, ("CATEGORY", sector_analytics_params)),
+    "api_metrics_by_category": (METRICS_BY_CATEGORY_SQL, "METRIC_CATEGORY"),
+}
+
 # ------------------- Flask App -------------------
 app = Flask(__name__)
 
 @app.route("/quarterly/<stock>")
 def quarterly_view(stock):
+    # Stored codes, cache tags and loads are all upper case; /quarterly/tcs is TCS
+    stock = stock.strip().upper()
     try:
-        # Check if we can connect to Snowflake at all
-        try:
-            conn = snowflake_connect()
-            cur = conn.cursor()
-            # Test basic connectivity
-            cur.execute("SELECT 1")
-            cur.fetchone()
-        except Exception as db_error:
-            logger.error(f"Snowflake connection failed: {db_error}")
-            # Use fallback data directly when database is unavailable
-            return serve_fallback_quarterly_view(stock)
-        
-        # Try to ensure the table exists
-        try:
-            create_snowflake_table()
-        except Exception as table_error:
-            logger.error(f"Table creation failed: {table_error}")
-            conn.close()
-            return serve_fallback_quarterly_view(stock)
+        # Served from memory until this stock is written again (or the TTL passes)
+        cache_key = ("stock", stock)
+        payload, cache_token = PAYLOAD_CACHE.lookup(cache_key)
+        from_cache = payload is not None
+        if payload is None:
+            with snowflake_connection() as conn:
+                # Schema is verified once per process; later requests skip the DDL round trip
+                try:
+                    ensure_schema(conn)
+                except Exception as table_error:
+                    logger.error(f"Table creation failed: {table_error}")
+                    return serve_fallback_quarterly_view(stock)
 
-        # Check if data exists for this stock
-        cur.execute("""
-            SELECT METRIC, QUARTER, VALUE, METRIC_CATEGORY
-            FROM FINANCIALS_QUARTERLY
-            WHERE STOCK_CODE=%s
-            ORDER BY METRIC_CATEGORY, METRIC, QUARTER
-        """, (stock,))
-        rows = cur.fetchall()
+                # Check if data exists for this stock (one key lookup on the snapshot table)
+                payload = load_stock_payload(conn, stock)
 
-        # If no data found, try to load it automatically
-        if not rows:
-            logger.info(f"No data found for {stock}, attempting to load...")
-            try:
-                # Get financial data (with fallback)
-                data, quarters, category, industry = get_financial_data(stock)
-                
-                if data and quarters:
-                    # Insert the data
-                    insert_quarterly_to_snowflake(conn, stock, data, quarters, category, industry)
-                    logger.info(f"Successfully loaded data for {stock}")
-                    
-                    # Re-query the database
-                    cur.execute("""
-                        SELECT METRIC, QUARTER, VALUE, METRIC_CATEGORY
-                        FROM FINANCIALS_QUARTERLY
-                        WHERE STOCK_CODE=%s
-                        ORDER BY METRIC_CATEGORY, METRIC, QUARTER
-                    """, (stock,))
-                    rows = cur.fetchall()
-                else:
-                    conn.close()
+            # If no data found, try to load it automatically. Concurrent requests for the same
+            # stock share one scrape+load, and none of them holds a pooled connection meanwhile.
+            if not payload:
+                logger.info(f"No data found for {stock}, attempting to load...")
+                if cold_load_async_requested():
+                    pending = cold_load_pending_response(stock)
+                    if pending is not None:
+                        return pending
+                try:
+                    if load_stock_once(stock):
+                        # Re-query the database
+                        with snowflake_connection() as conn:
+                            payload = load_stock_payload(conn, stock)
+                    else:
+                        return f"""
+                        <div class="container mt-5">
+                            <div class="alert alert-warning">
+                                <h4>⚠️ No data available for {stock}</h4>
+                                <p>Unable to fetch financial data from external sources.</p>
+                                <a href="/" class="btn btn-primary">← Back to Dashboard</a>
+                                <a href="/test-scraper/{stock}" class="btn btn-secondary" target="_blank">🔧 Test Data Source</a>
+                            </div>
+                        </div>
+                        """
+                except Exception as load_error:
+                    logger.error(f"Failed to load data for {stock}: {load_error}")
                     return f"""
                     <div class="container mt-5">
-                        <div class="alert alert-warning">
-                            <h4>⚠️ No data available for {stock}</h4>
-                            <p>Unable to fetch financial data from external sources.</p>
-                            <a href="/" class="btn btn-primary">← Back to Dashboard</a>
-                            <a href="/test-scraper/{stock}" class="btn btn-secondary" target="_blank">🔧 Test Data Source</a>
+                        <div class="alert alert-danger">
+                            <h4>❌ Error loading data for {stock}</h4>
+                            <p>Error: {str(load_error)}</p>
+                            <div class="mt-3">
+                                <a href="/" class="btn btn-primary">← Back to Dashboard</a>
+                                <a href="/test-scraper/{stock}" class="btn btn-secondary" target="_blank">🔧 Test Data Source</a>
+                                <a href="/debug/{stock}" class="btn btn-info" target="_blank">🔍 Debug Database</a>
+                            </div>
                         </div>
                     </div>
                     """
-            except Exception as load_error:
-                logger.error(f"Failed to load data for {stock}: {load_error}")
-                conn.close()
-                return f"""
-                <div class="container mt-5">
-                    <div class="alert alert-danger">
-                        <h4>❌ Error loading data for {stock}</h4>
-                        <p>Error: {str(load_error)}</p>
-                        <div class="mt-3">
-                            <a href="/" class="btn btn-primary">← Back to Dashboard</a>
-                            <a href="/test-scraper/{stock}" class="btn btn-secondary" target="_blank">🔧 Test Data Source</a>
-                            <a href="/debug/{stock}" class="btn btn-info" target="_blank">🔍 Debug Database</a>
-                        </div>
-                    </div>
-                </div>
-                """
 
         # If still no data after attempting to load
-        if not rows:
-            conn.close()
+        if not payload:
             return f"""
             <div class="container mt-5">
                 <div class="alert alert-info">
@@ -274,64 +1352,49 @@ def quarterly_view(stock):
                     fetch(`/load-single/${{stock}}`, {{method: 'POST'}})
                     .then(response => response.json())
                     .then(data => {{
-                        if (data.status === 'success') {{
-                            location.reload();
+                        if (data.job_id) {{
+                            waitForJob(data.job_id);
                         }} else {{
                             alert('Error: ' + data.message);
                         }}
                     }});
                 }}
+                function waitForJob(jobId) {{
+                    fetch(`/jobs/${{jobId}}`)
+                    .then(response => response.json())
+                    .then(job => {{
+                        if (job.status === 'queued' || job.status === 'running') {{
+                            setTimeout(() => waitForJob(jobId), 2000);
+                        }} else if (job.status === 'succeeded') {{
+                            location.reload();
+                        }} else {{
+                            alert('Error: ' + job.message);
+                        }}
+                    }});
+                }}
                 </script>
             </div>
             """
 
-        # Process the data for display
-        financial_data = {}
-        quarters = []
-        categories = {}
-
-        for metric, quarter, value, metric_category in rows:
-            if metric not in financial_data:
-                financial_data[metric] = {}
-                categories[metric] = metric_category
-            financial_data[metric][quarter] = value
-            if quarter not in quarters:
-                quarters.append(quarter)
+        if not from_cache:
+            PAYLOAD_CACHE.put(cache_key, payload, cache_token)
 
-        # Sort quarters chronologically
-        quarters.sort()
+        # The snapshot is already categorized and in chronological quarter order, so the
+        # optional ?quarters=N window is a slice
+        payload = window_payload(payload, requested_window())
+        quarters = payload["quarters"]
+        categorized_data = payload["categorized"]
 
-        # Convert row format and group by category
-        categorized_data = {}
-        for metric, quarter_data in financial_data.items():
-            category = categories[metric]
-            if category not in categorized_data:
-                categorized_data[category] = {}
-            
-            # Clean and filter values for charts
-            values = []
-            for q in quarters:
-                value = quarter_data.get(q, "")
-                # Ensure we have valid numeric data
-                if value and str(value).strip() and value != "":
-                    try:
-                        # Try to convert to float to validate
-                        float(value)
-                        values.append(str(value))
-                    except (ValueError, TypeError):
-                        values.append("")
-                else:
-                    values.append("")
-            
-            categorized_data[category][metric] = values
-
-        conn.close()
         return render_template("quarterly.html",
                                stock=stock,
                                quarters=quarters,
                                financial_data=json.dumps(categorized_data),
                                metric_categories=categorized_data)
-    
+
+    except SnowflakeUnavailableError as db_error:
+        logger.error(f"Snowflake connection failed: {db_error}")
+        # Use fallback data directly when database is unavailable
+        return serve_fallback_quarterly_view(stock)
     except Exception as e:
         logger.error(f"Error in quarterly view for {stock}: {e}")
         return f"""
@@ -347,74 +1410,64 @@ def quarterly_view(stock):
         </div>
         """
 
+def match_sector_category(cur, sector: str) -> Optional[str]:
+    """The stored CATEGORY matching `sector` case-insensitively, if any"""
+    # First, get all available sectors/categories
+    cur.execute(SECTOR_CATEGORIES_SQL)
+    available_categories = [row[0] for row in cur.fetchall()]
+
+    # Try to find the sector, case-insensitive
+    for cat in available_categories:
+        if cat.lower() == sector.lower():
+            return cat
+    return None
+
 @app.route("/sector/<sector>")
 def sector_view(sector):
     try:
         # First try database approach
-        
-                       
         try:
-            conn = snowflake_connect()
-            cur = conn.cursor()
+            window = requested_window()
+            cache_key = ("sector", sector.lower(), window) if window else ("sector", sector.lower())
+            cached, cache_token = PAYLOAD_CACHE.lookup(cache_key)
+            if cached is not None:
+                return render_template("sector.html",
+                                       sector=sector,
+                                       quarters=cached["quarters"],
+                                       financial_data=cached["categorized"],
+                                       financial_json=json.dumps(cached["categorized"]))
 
-            # First, get all available sectors/categories
-            cur.execute("SELECT DISTINCT CATEGORY FROM FINANCIALS_QUARTERLY WHERE CATEGORY IS NOT NULL")
-            available_categories = [row[0] for row in cur.fetchall()]
-            
-            # Try to find the sector, case-insensitive
-            matched_category = None
-            for cat in available_categories:
-                if cat.lower() == sector.lower():
-                    matched_category = cat
-                    break
-            
-            if matched_category:
-                cur.execute("""
-                    SELECT STOCK_CODE, METRIC, QUARTER, VALUE, METRIC_CATEGORY
-                    FROM FINANCIALS_QUARTERLY
-                    WHERE CATEGORY=%s
-                    ORDER BY METRIC_CATEGORY, STOCK_CODE, METRIC
-                """, (matched_category,))
-                
-                rows = cur.fetchall()
+            quarters, categorized_data = [], {}
+            with snowflake_connection() as conn:
+                cur = conn.cursor()
 
-                if rows:
-                    # Process database data
-                    
-                    sector_data = {}
-                    quarters = set()
-                    
-                    for stock, metric, quarter, value, metric_category in rows:
-                        
-                        quarters.add(quarter)
-                        key = (stock, metric, metric_category)
-                        if key not in sector_data:
-                            sector_data[key] = {}
-                        sector_data[key][quarter] = value
+                matched_category = match_sector_category(cur, sector)
+
+                if matched_category:
+                    # Only the last N periods are fetched when a window is asked for
+                    if window:
+                        cur.execute(SECTOR_VIEW_WINDOW_SQL,
+                                    (matched_category, PERIOD_ORDINAL_TTM, PERIOD_ORDINAL_TTM, window))
+                    else:
+                        cur.execute(SECTOR_VIEW_SQL, (matched_category,))
 
-                    quarters = sorted(quarters)
+                    # Pivoted batch by batch as the Arrow result batches download, into
+                    # {category: {"STOCK - metric": values}}
+                    stats = FetchStats("sector_view")
+                    quarters, categorized_data = pivot_sector(iter_result_frames(cur, PIVOT_COLUMNS, stats))
+                    record_fetch(stats, matched_category)
 
-                    # Group by metric category
-                    categorized_data = {}
-                    for (stock, metric, metric_category), quarter_data in sector_data.items():
-                        
-                        if metric_category not in categorized_data:
-                            categorized_data[metric_category] = {}
-                        
-                        display_key = f"{stock} - {metric}"
-                        categorized_data[metric_category][display_key] = [
-                            quarter_data.get(q, "") for q in quarters
-                        ]
-
-                    conn.close()
-                    logger.warning(f"Returning Data for render {matched_category}: {matched_category}")
-                    return render_template("sector.html",
-                                           sector=sector,
-                                           quarters=quarters,
-                                           financial_data=(categorized_data),
-                                           financial_json=json.dumps(categorized_data))
-                    
-            conn.close()
+            if categorized_data:
+
+                # Dropped whenever any stock in this category is written
+                PAYLOAD_CACHE.put(cache_key, {"quarters": quarters, "categorized": categorized_data}, cache_token)
+
+                logger.warning(f"Returning Data for render {matched_category}: {matched_category}")
+                return render_template("sector.html",
+                                       sector=sector,
+                                       quarters=quarters,
+                                       financial_data=(categorized_data),
+                                       financial_json=json.dumps(categorized_data))
         except Exception as db_error:
             logger.warning(f"Database approach failed for sector {sector}: {db_error}")
         
@@ -584,74 +1637,60 @@ def index():
 
 @app.route("/visualize", methods=["POST"])
 def visualize():
-    stock = request.form['stock']
+    stock = request.form['stock'].strip().upper()
     try:
-        # Ensure table exists
-        create_snowflake_table()
-        
-        conn = snowflake_connect()
-        cur = conn.cursor()
-        
-        # Select only the columns we need to avoid datetime serialization issues
-        cur.execute("""
-            SELECT STOCK_CODE, METRIC, QUARTER, VALUE, INDUSTRY, CATEGORY, METRIC_CATEGORY
-            FROM FINANCIALS_QUARTERLY 
-            WHERE STOCK_CODE=%s
-            ORDER BY METRIC_CATEGORY, METRIC, QUARTER
-        """, (stock,))
-        rows = cur.fetchall()
-
-        # If no data found, try to load it automatically
-        if not rows:
-            logger.info(f"No data found for {stock}, attempting to load...")
-            try:
-                # Get financial data (with fallback)
-                data, quarters, category, industry = get_financial_data(stock)
-                
-                if data and quarters:
-                    # Insert the data
-                    insert_quarterly_to_snowflake(conn, stock, data, quarters, category, industry)
-                    logger.info(f"Successfully loaded data for {stock}")
-                    
-                    # Re-query the database
-                    cur.execute("""
-                        SELECT STOCK_CODE, METRIC, QUARTER, VALUE, INDUSTRY, CATEGORY, METRIC_CATEGORY
-                        FROM FINANCIALS_QUARTERLY 
-                        WHERE STOCK_CODE=%s
-                        ORDER BY METRIC_CATEGORY, METRIC, QUARTER
-                    """, (stock,))
-                    rows = cur.fetchall()
-                else:
-                    conn.close()
+        cache_key = ("stock", stock)
+        payload, cache_token = PAYLOAD_CACHE.lookup(cache_key)
+        from_cache = payload is not None
+        if payload is None:
+            with snowflake_connection() as conn:
+                # Ensure table exists (no-op once the schema has been verified)
+                ensure_schema(conn)
+
+                # Pre-pivoted snapshot: one key lookup, no per-request pivoting
+                payload = load_stock_payload(conn, stock)
+
+            # If no data found, try to load it automatically. Concurrent requests for the same
+            # stock share one scrape+load, and none of them holds a pooled connection meanwhile.
+            if not payload:
+                logger.info(f"No data found for {stock}, attempting to load...")
+                if cold_load_async_requested():
+                    pending = cold_load_pending_response(stock)
+                    if pending is not None:
+                        return pending
+                try:
+                    if load_stock_once(stock):
+                        # Re-query the database
+                        with snowflake_connection() as conn:
+                            payload = load_stock_payload(conn, stock)
+                    else:
+                        return f"""
+                        <div class="container mt-5">
+                            <div class="alert alert-warning">
+                                <h4>⚠️ No data available for {stock}</h4>
+                                <p>Unable to fetch financial data from external sources.</p>
+                                <a href="/" class="btn btn-primary">← Back to Dashboard</a>
+                                <a href="/test-scraper/{stock}" class="btn btn-secondary" target="_blank">🔧 Test Data Source</a>
+                            </div>
+                        </div>
+                        """
+                except Exception as load_error:
+                    logger.error(f"Failed to load data for {stock}: {load_error}")
                     return f"""
                     <div class="container mt-5">
-                        <div class="alert alert-warning">
-                            <h4>⚠️ No data available for {stock}</h4>
-                            <p>Unable to fetch financial data from external sources.</p>
-                            <a href="/" class="btn btn-primary">← Back to Dashboard</a>
-                            <a href="/test-scraper/{stock}" class="btn btn-secondary" target="_blank">🔧 Test Data Source</a>
+                        <div class="alert alert-danger">
+                            <h4>❌ Error loading data for {stock}</h4>
+                            <p>Error: {str(load_error)}</p>
+                            <div class="mt-3">
+                                <a href="/" class="btn btn-primary">← Back to Dashboard</a>
+                                <a href="/test-scraper/{stock}" class="btn btn-secondary" target="_blank">🔧 Test Data Source</a>
+                            </div>
                         </div>
                     </div>
                     """
-            except Exception as load_error:
-                logger.error(f"Failed to load data for {stock}: {load_error}")
-                conn.close()
-                return f"""
-                <div class="container mt-5">
-                    <div class="alert alert-danger">
-                        <h4>❌ Error loading data for {stock}</h4>
-                        <p>Error: {str(load_error)}</p>
-                        <div class="mt-3">
-                            <a href="/" class="btn btn-primary">← Back to Dashboard</a>
-                            <a href="/test-scraper/{stock}" class="btn btn-secondary" target="_blank">🔧 Test Data Source</a>
-                        </div>
-                    </div>
-                </div>
-                """
 
         # If still no data
-        if not rows:
-            conn.close()
+        if not payload:
             return f"""
             <div class="container mt-5">
                 <div class="alert alert-info">
@@ -662,31 +1701,14 @@ def visualize():
             </div>
             """
 
-        # Group data by metric category and quarter
-        categorized_data = {}
-        quarters = set()
-        
-        for stock_code, metric, quarter, value, industry, category, metric_category in rows:
-            quarters.add(quarter)
-            
-            if metric_category not in categorized_data:
-                categorized_data[metric_category] = {}
-            if metric not in categorized_data[metric_category]:
-                categorized_data[metric_category][metric] = {}
-            
-            categorized_data[metric_category][metric][quarter] = value
-
-        # Sort quarters chronologically
-        quarters = sorted(quarters)
+        if not from_cache:
+            PAYLOAD_CACHE.put(cache_key, payload, cache_token)
 
-        # Convert to format expected by template
-        formatted_data = {}
-        for category, metrics in categorized_data.items():
-            formatted_data[category] = {}
-            for metric, quarter_data in metrics.items():
-                formatted_data[category][metric] = [quarter_data.get(q, "") for q in quarters]
+        # The snapshot is already in the format expected by the template
+        payload = window_payload(payload, requested_window())
+        quarters = payload["quarters"]
+        formatted_data = payload["categorized"]
 
-        conn.close()
         return render_template("visualize.html",
                             stock=stock,
                             years=quarters,  # Use actual quarters instead of generic years
@@ -709,46 +1731,158 @@ def visualize():
 def debug_data(stock):
     """Debug route to see raw data structure"""
     try:
-        conn = snowflake_connect()
-        cur = conn.cursor()
+        with snowflake_connection() as conn:
+            cur = conn.cursor()
 
-        # First check if table exists and has data
-        cur.execute("SELECT COUNT(*) FROM FINANCIALS_QUARTERLY")
-        total_count = cur.fetchone()[0]
-        
-        # Check for specific stock
-        cur.execute("SELECT COUNT(*) FROM FINANCIALS_QUARTERLY WHERE STOCK_CODE=%s", (stock,))
-        stock_count = cur.fetchone()[0]
+            # First check if table exists and has data
+            cur.execute("SELECT COUNT(*) FROM FINANCIALS_QUARTERLY")
+            total_count = cur.fetchone()[0]
 
-        cur.execute("""
-            SELECT METRIC, QUARTER, VALUE, METRIC_CATEGORY
-            FROM FINANCIALS_QUARTERLY
-            WHERE STOCK_CODE=%s
-            ORDER BY METRIC_CATEGORY, METRIC, QUARTER
-            LIMIT 20
-        """, (stock,))
-        rows = cur.fetchall()
+            # Check for specific stock
+            cur.execute("SELECT COUNT(*) FROM FINANCIALS_QUARTERLY WHERE STOCK_CODE=%s", (stock,))
+            stock_count = cur.fetchone()[0]
 
-        debug_info = {
-            "table_total_rows": total_count,
-            "stock_rows": stock_count,
-            "sample_rows": rows,
-            "unique_categories": list(set([row[3] for row in rows])) if rows else [],
-            "unique_quarters": list(set([row[1] for row in rows])) if rows else [],
-            "value_types": [type(row[2]).__name__ for row in rows[:5]] if rows else [],
-            "data_structure_test": {
-                "stock": stock,
-                "has_data": len(rows) > 0,
-                "first_metric": rows[0] if rows else None
+            cur.execute(DEBUG_SAMPLE_SQL, (stock,))
+            rows = cur.fetchall()
+
+            debug_info = {
+                "table_total_rows": total_count,
+                "stock_rows": stock_count,
+                "sample_rows": rows,
+                "unique_categories": list(set([row[3] for row in rows])) if rows else [],
+                "unique_quarters": list(set([row[1] for row in rows])) if rows else [],
+                "value_types": [type(row[2]).__name__ for row in rows[:5]] if rows else [],
+                "data_structure_test": {
+                    "stock": stock,
+                    "has_data": len(rows) > 0,
+                    "first_metric": rows[0] if rows else None
+                }
             }
-        }
-        
-        conn.close()
+
         return f"<pre>{json.dumps(debug_info, indent=2, default=str)}</pre>"
         
     except Exception as e:
         return f"<pre>Error: {str(e)}</pre>"
 
+# ------------------- HTML Parser Backends -------------------
+# BeautifulSoup tree builders in order of preference. Every backend must produce the same
+# extraction output for the same page; --verify-parsers checks this against golden files.
+PARSER_BACKENDS = ["lxml", "html.parser"]
+REFERENCE_PARSER_BACKEND = "html.parser"
+PARSER_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "screener_pages")
+SCRAPE_PARSER = os.getenv("SCRAPE_PARSER", "auto")
+
+def available_parser_backends() -> List[str]:
+    """Registered backends whose tree builder is importable here (html.parser always is)"""
+    names = list(PARSER_BACKENDS)
+    if REFERENCE_PARSER_BACKEND not in names:
+        names.append(REFERENCE_PARSER_BACKEND)
+    return [name for name in names if builder_registry.lookup(name) is not None]
+
+def resolve_parser_backend(name: Optional[str] = None) -> str:
+    """Pick the configured backend, falling back to the fastest available one"""
+    name = name or SCRAPE_PARSER
+    available = available_parser_backends()
+    if name != "auto":
+        if name in available:
+            return name
+        logger.warning(f"⚠️ HTML parser backend '{name}' unavailable, using {available[0]}")
+    return available[0]
+
+ACTIVE_PARSER_BACKEND = resolve_parser_backend()
+
+def parse_html(content: bytes, backend: Optional[str] = None) -> BeautifulSoup:
+    """Build a BeautifulSoup tree with the active (or given) parser backend"""
+    return BeautifulSoup(content, backend or ACTIVE_PARSER_BACKEND)
+
+# ------------------- Partial Page Parsing -------------------
+# Only these sections (plus the breadcrumb) feed the extractors; everything after them
+# (shareholding, documents, scripts) is neither downloaded nor parsed.
+FINANCIAL_SECTION_IDS = ("quarters", "profit-loss", "balance-sheet", "cash-flow", "ratios")
+SCRAPE_STREAM_EARLY_STOP = os.getenv("SCRAPE_STREAM_EARLY_STOP", "true").lower() in ("1", "true", "yes")
+SCRAPE_PARTIAL_PARSE = os.getenv("SCRAPE_PARTIAL_PARSE", "true").lower() in ("1", "true", "yes")
+SCRAPE_STREAM_CHUNK_SIZE = 64 * 1024
+
+_SECTION_START_RE = re.compile(rb"<section\b[^>]*>", re.I)
+_ID_ATTR_RE = re.compile(rb"""\bid\s*=\s*["']?([^"'\s>]+)""", re.I)
+_BREADCRUMB_START_RE = re.compile(rb"""<div\b[^>]*\bclass\s*=\s*["'][^"']*\bbreadcrumb\b[^>]*>""", re.I)
+_DIV_TAG_RE = re.compile(rb"<(/?)div\b", re.I)
+_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([\w-]+)""", re.I)
+
+def _section_starts(content: bytes) -> List[Tuple[int, str]]:
+    """(offset, id) of every <section> start tag, in document order"""
+    starts = []
+    for match in _SECTION_START_RE.finditer(content):
+        id_match = _ID_ATTR_RE.search(match.group(0))
+        starts.append((match.start(), id_match.group(1).decode("ascii", "ignore") if id_match else ""))
+    return starts
+
+def financial_sections_end(content: bytes) -> Optional[int]:
+    """Offset of the first non-financial <section> after every financial section has begun, if any"""
+    pending = set(FINANCIAL_SECTION_IDS)
+    for offset, section_id in _section_starts(content):
+        if not pending and section_id not in FINANCIAL_SECTION_IDS:
+            return offset
+        pending.discard(section_id)
+    return None
+
+def read_page_body(res: requests.Response) -> Tuple[bytes, bool]:
+    """Read a streamed response, stopping once all financial sections have arrived.
+
+    Returns (body, truncated). Stopping early drops the connection instead of returning it to
+    the keep-alive pool, which is cheaper than downloading the rest of a large page.
+    """
+    if not SCRAPE_STREAM_EARLY_STOP:
+        return res.content, False
+    body = bytearray()
+    try:
+        for chunk in res.iter_content(SCRAPE_STREAM_CHUNK_SIZE):
+            body.extend(chunk)
+            cut = financial_sections_end(body)
+            if cut is not None:
+                return bytes(body[:cut]), True
+        return bytes(body), False
+    finally:
+        res.close()
+
+def _breadcrumb_fragment(content: bytes) -> bytes:
+    """The breadcrumb <div> and its children, matched by counting nested divs"""
+    start = _BREADCRUMB_START_RE.search(content)
+    if not start:
+        return b""
+    depth = 0
+    for tag in _DIV_TAG_RE.finditer(content, start.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            end = content.find(b">", tag.end())
+            return content[start.start():end + 1 if end != -1 else len(content)]
+    return content[start.start():]
+
+def financial_fragment(content: bytes) -> Optional[bytes]:
+    """A minimal document holding just the breadcrumb and the financial sections, or None"""
+    starts = _section_starts(content)
+    wanted = [i for i, (_, section_id) in enumerate(starts) if section_id in FINANCIAL_SECTION_IDS]
+    if not wanted:
+        return None
+    begin = starts[wanted[0]][0]
+    end = next((offset for offset, section_id in starts[wanted[-1] + 1:]
+                if section_id not in FINANCIAL_SECTION_IDS), len(content))
+
+    breadcrumb = _breadcrumb_fragment(content[:begin]) or _breadcrumb_fragment(content[end:])
+    charset = _CHARSET_RE.search(content[:4096])
+    head = b'<meta charset="' + (charset.group(1) if charset else b"utf-8") + b'">'
+    return b"".join([b"<html><head>", head, b"</head><body>", breadcrumb, content[begin:end], b"</body></html>"])
+
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far (None where unsupported)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
 # ------------------- Enhanced Screener Scraper -------------------
 def clean_metric_name(metric_name: str) -> str:
     """Clean metric name while preserving important special characters"""
@@ -758,6 +1892,79 @@ def clean_metric_name(metric_name: str) -> str:
     cleaned = re.sub(r'\s+', ' ', cleaned)
     return cleaned
 
+PERIOD_LABEL_FORMAT = "%b %Y"  # screener column headers: "Mar 2024"
+
+# Periods are ordered by an integer key computed once, when rows are loaded, and stored with
+# each row as PERIOD_ORDINAL: months since year 0 for "Mar 2024" labels (quarterly and annual
+# columns alike), PERIOD_ORDINAL_TTM for the trailing-twelve-months column so it follows every
+# dated period, and NULL for anything else. Routes order and window by it instead of parsing
+# labels per request.
+PERIOD_ORDINAL_TTM = 10 ** 6
+TTM_LABELS = ("TTM",)
+
+def period_ordinal(quarter: str) -> Optional[int]:
+    """'Mar 2024' -> 24290; 'TTM' -> PERIOD_ORDINAL_TTM; None for other labels"""
+    label = (quarter or "").strip()
+    if label.upper() in TTM_LABELS:
+        return PERIOD_ORDINAL_TTM
+    try:
+        parsed = datetime.datetime.strptime(label, PERIOD_LABEL_FORMAT)
+    except ValueError:
+        return None
+    return parsed.year * 12 + parsed.month - 1
+
+def period_label(ordinal: int) -> str:
+    """Inverse of period_ordinal: 24290 -> 'Mar 2024'"""
+    if ordinal >= PERIOD_ORDINAL_TTM:
+        return TTM_LABELS[0]
+    return datetime.date(ordinal // 12, ordinal % 12 + 1, 1).strftime(PERIOD_LABEL_FORMAT)
+
+def period_ordinals(quarters: pd.Series) -> pd.Series:
+    """Vectorized period_ordinal over a column of QUARTER labels (nullable Int64)"""
+    labels = quarters.astype(str).str.strip()
+    parsed = pd.to_datetime(labels, format=PERIOD_LABEL_FORMAT, errors="coerce")
+    ordinals = (parsed.dt.year * 12 + parsed.dt.month - 1).astype("Int64")
+    return ordinals.mask(labels.str.upper().isin(TTM_LABELS), PERIOD_ORDINAL_TTM)
+
+def period_sort_key(quarter: str, ordinal: Optional[int]) -> Tuple:
+    """Chronological order by PERIOD_ORDINAL; labels without one sort last, by name"""
+    return (ordinal is None, ordinal if ordinal is not None else 0, quarter)
+
+def window_payload(payload: Dict, last: Optional[int]) -> Dict:
+    """Keep the `last` most recent dated periods of a {"quarters", "ordinals", "categorized"}
+    payload, plus any trailing TTM/undated columns. Quarters are already in ordinal order, so
+    this is a slice, sized from the stored ordinals."""
+    quarters = payload["quarters"]
+    if not last:
+        return payload
+    ordinals = payload.get("ordinals")
+    if ordinals is None:  # snapshot written before ordinals were stored in it
+        ordinals = [period_ordinal(quarter) for quarter in quarters]
+    dated = sum(1 for ordinal in ordinals if ordinal is not None and ordinal < PERIOD_ORDINAL_TTM)
+    start = max(0, dated - last)
+    if start == 0:
+        return payload
+    return dict(payload, quarters=quarters[start:], ordinals=ordinals[start:], categorized={
+        category: {label: values[start:] for label, values in metrics.items()}
+        for category, metrics in payload["categorized"].items()
+    })
+
+QUARTER_WINDOW_DEFAULT = int(os.getenv("QUARTER_WINDOW_DEFAULT", "0"))
+
+def requested_window() -> Optional[int]:
+    """Last-N-periods window from ?quarters=N (or a form field); 0 or absent shows every period"""
+    window = request.values.get("quarters", QUARTER_WINDOW_DEFAULT, type=int)
+    return window if window and window > 0 else None
+
+def format_number(value) -> str:
+    """VALUE_NUM (Decimal/float/None) as the plain numeric string the templates expect"""
+    if value is None:
+        return ""
+    if isinstance(value, Decimal):
+        text = format(value.normalize(), "f")
+        return "0" if text in ("-0", "") else text
+    return repr(float(value))
+
 def clean_value(val: str) -> str:
     """Clean financial values while preserving numbers and percentages"""
     if not val or val == "-" or val.lower() == "n/a":
@@ -797,58 +2004,313 @@ def get_financial_data(stock_code: str) -> Tuple[Dict, List, str, str]:
     """
     url = SCREENER_URL.format(stock_code)
     logger.info(f"🔎 Fetching ALL metrics for {stock_code} from: {url}")
-    
-    try:
-        res = requests.get(url, headers=HEADERS, timeout=30)
-        res.raise_for_status()
-        
-        if res.status_code != 200:
-            logger.error(f"❌ Failed to fetch {stock_code}: HTTP {res.status_code}")
-            # Try fallback data
-            return use_fallback_data(stock_code)
 
-        soup = BeautifulSoup(res.content, "html.parser")
+    # Network, HTTP and parse errors all degrade to fallback data inside these helpers
+    return scrape_result_to_financial_data(fetch_screener_page(stock_code))
 
-        # Extract industry and sector/category info
-        category, industry = extract_company_info(soup)
-        
-        # Extract ALL financial data from multiple sections
-        all_data, quarters = extract_all_financial_data(soup, stock_code)
-        
-        # If no data extracted, try fallback
-        if not all_data or not quarters:
-            logger.warning(f"No data extracted from scraping for {stock_code}, trying fallback")
-            return use_fallback_data(stock_code)
-        
-        return all_data, quarters, category, industry
-        
-    except requests.RequestException as e:
-        logger.error(f"❌ Request failed for {stock_code}: {e}")
-        # Try fallback data
-        return use_fallback_data(stock_code)
-    except Exception as e:
-        logger.error(f"❌ Unexpected error for {stock_code}: {e}")
-        # Try fallback data
-        return use_fallback_data(stock_code)
+def extract_financial_page(content: bytes, stock_code: str, backend: Optional[str] = None,
+                           partial: Optional[bool] = None) -> Tuple[Dict, List, str, str]:
+    """Parse a downloaded screener page into (data_dict, quarters_list, category, industry)"""
+    partial = SCRAPE_PARTIAL_PARSE if partial is None else partial
+    fragment = financial_fragment(content) if partial else None
+    if fragment is not None:
+        result = _extract_from_markup(fragment, stock_code, backend)
+        if result[0] and result[1]:
+            return result
+        logger.info(f"Partial parse found no data for {stock_code}, parsing the full page")
+    return _extract_from_markup(content, stock_code, backend)
+
+def _extract_from_markup(content: bytes, stock_code: str, backend: Optional[str] = None) -> Tuple[Dict, List, str, str]:
+    soup = parse_html(content, backend)
+    index = FinancialPageIndex(soup)
+
+    # Extract industry and sector/category info
+    category, industry = company_info_from_breadcrumb(index.breadcrumb)
+
+    # Extract ALL financial data from multiple sections
+    all_data, quarters = extract_all_financial_data(soup, stock_code, index)
+    return all_data, quarters, category, industry
 
 def extract_company_info(soup: BeautifulSoup) -> Tuple[str, str]:
     """Extract company category and industry from breadcrumb"""
     try:
-        breadcrumb = soup.select_one(".breadcrumb")
-        if breadcrumb:
-            breadcrumb_text = breadcrumb.get_text().strip()
-            parts = breadcrumb_text.split('›')
-            if len(parts) >= 3:
-                category = parts[1].strip()
-                industry = parts[2].strip()
-                return category, industry
+        return company_info_from_breadcrumb(soup.select_one(".breadcrumb"))
     except Exception as e:
         logger.warning(f"Could not extract company info: {e}")
     
     return "", ""
 
-def extract_all_financial_data(soup: BeautifulSoup, stock_code: str) -> Tuple[Dict, List]:
-    """Extract ALL financial data from multiple sections of the page"""
+def company_info_from_breadcrumb(breadcrumb) -> Tuple[str, str]:
+    """Split a "Home › Category › Industry" breadcrumb element into (category, industry)"""
+    if breadcrumb:
+        breadcrumb_text = breadcrumb.get_text().strip()
+        parts = breadcrumb_text.split('›')
+        if len(parts) >= 3:
+            category = parts[1].strip()
+            industry = parts[2].strip()
+            return category, industry
+    return "", ""
+
+# ------------------- Single-Pass Page Index -------------------
+PER_SHARE_KEYWORDS = ['per share', 'eps', 'book value', 'dividend']
+QUARTER_HEADER_PATTERNS = ["mar", "jun", "sep", "dec", "q1", "q2", "q3", "q4"]
+RATIO_CLASS_PATTERN = re.compile(r".*ratio.*", re.I)
+
+class IndexedTable:
+    """One <table>: header texts, raw cell texts and lazily cleaned rows, each computed once"""
+    __slots__ = ("tag", "header", "rows", "containers", "_cleaned")
+
+    def __init__(self, tag, containers: set):
+        self.tag = tag
+        self.header = [th.get_text().strip() for th in tag.select("thead tr th")]
+        self.rows = [[td.get_text() for td in tr.find_all("td")] for tr in tag.select("tbody tr")]
+        # ids of the indexed sections/divs this table sits inside
+        self.containers = containers
+        self._cleaned: List[Optional[Tuple[str, List[str]]]] = [None] * len(self.rows)
+
+    def cleaned(self, row_index: int) -> Tuple[str, List[str]]:
+        """(metric name, every cleaned value cell) for a row; callers slice as needed"""
+        cached = self._cleaned[row_index]
+        if cached is None:
+            cells = self.rows[row_index]
+            cached = (clean_metric_name(cells[0]), [clean_value(text) for text in cells[1:]])
+            self._cleaned[row_index] = cached
+        return cached
+
+class FinancialPageIndex:
+    """Indexes every section, table and candidate container of a screener page in one tree walk.
+
+    The extract_* rules are then replayed against this index, so each cell's text is read and
+    cleaned at most once no matter how many extractors look at its table.
+    """
+
+    def __init__(self, soup: BeautifulSoup):
+        self.sections = []
+        self.sections_by_id: Dict[str, object] = {}
+        self.ratio_sections = []
+        self.ratio_divs = []
+        self.quarter_section = None       # first section[id*='quarter']
+        self.quarter_div = None           # first div[class*='quarter']
+        self.quarter_table = None         # first table[class*='quarter']
+        self.responsive_table = None      # first .table-responsive table
+        self.breadcrumb = None
+        self.tables: List[IndexedTable] = []
+        self._table_for_tag: Dict[int, IndexedTable] = {}
+
+        containers = {}  # id(tag) -> tag for elements whose tables we need to look up later
+        for tag in soup.find_all(True):
+            name = tag.name
+            classes = tag.get("class") or []
+            class_attr = " ".join(classes)
+
+            if self.breadcrumb is None and "breadcrumb" in classes:
+                self.breadcrumb = tag
+
+            if name == "section":
+                self.sections.append(tag)
+                containers[id(tag)] = tag
+                section_id = tag.get("id")
+                if section_id:
+                    self.sections_by_id.setdefault(section_id, tag)
+                    if self.quarter_section is None and "quarter" in section_id:
+                        self.quarter_section = tag
+                if any(RATIO_CLASS_PATTERN.search(c) for c in classes):
+                    self.ratio_sections.append(tag)
+            elif name == "div":
+                if self.quarter_div is None and "quarter" in class_attr:
+                    self.quarter_div = tag
+                    containers[id(tag)] = tag
+                if any(RATIO_CLASS_PATTERN.search(c) for c in classes):
+                    self.ratio_divs.append(tag)
+                    containers[id(tag)] = tag
+            elif name == "table":
+                inside = set()
+                responsive = False
+                for parent in tag.parents:
+                    if id(parent) in containers:
+                        inside.add(id(parent))
+                    if not responsive and "table-responsive" in (parent.get("class") or []):
+                        responsive = True
+                table = IndexedTable(tag, inside)
+                self.tables.append(table)
+                self._table_for_tag[id(tag)] = table
+                if self.quarter_table is None and "quarter" in class_attr:
+                    self.quarter_table = table
+                if self.responsive_table is None and responsive:
+                    self.responsive_table = table
+
+    def tables_in(self, container) -> List[IndexedTable]:
+        """Tables nested in an indexed section/div (or the table itself), in document order"""
+        if container is None:
+            return []
+        if id(container) in self._table_for_tag:
+            return [self._table_for_tag[id(container)]]
+        key = id(container)
+        return [table for table in self.tables if key in table.containers]
+
+def _rows_with_width(tables: List[IndexedTable], width: int, prefix: str = "") -> Dict:
+    """Rows having at least `width` value cells, trimmed to `width`, skipping all-empty rows"""
+    data = {}
+    for table in tables:
+        for i, cells in enumerate(table.rows):
+            if len(cells) < width + 1:
+                continue
+            metric, values = table.cleaned(i)
+            values = values[:width]
+            if metric and any(v for v in values):
+                data[f"{prefix}{metric}"] = values
+    return data
+
+class ExtractedFinancials(dict):
+    """{metric: [value per period]} as extracted from a page, plus `sections`: the id of the page
+    section each metric's values were read from (the last one, when sections repeat a metric).
+    The loader stores it as SOURCE_SECTION, since a metric's name doesn't say which table it
+    came from."""
+
+    def __init__(self, data: Optional[Dict] = None, sections: Optional[Dict[str, str]] = None):
+        super().__init__(data or {})
+        self.sections: Dict[str, str] = dict(sections or {})
+
+    def add(self, section: str, data: Dict):
+        for metric, values in data.items():
+            self[metric] = values
+            self.sections[metric] = section
+
+    def extend(self, other: "ExtractedFinancials"):
+        self.update(other)
+        self.sections.update(other.sections)
+
+def _single_pass_quarterly(index: FinancialPageIndex, stock_code: str) -> Tuple[Dict, List]:
+    # Same selector cascade as extract_quarterly_data(): containers first, then single tables
+    container = None
+    for candidate in (index.sections_by_id.get("quarters"), index.quarter_section, index.quarter_div):
+        if candidate is not None:
+            container = candidate
+            break
+
+    if container is not None:
+        tables = index.tables_in(container)
+    else:
+        table = index.quarter_table or index.responsive_table
+        if table is None:
+            for candidate in index.tables:
+                if len(candidate.header) > 3:
+                    header_text = " ".join(candidate.header).lower()
+                    if any(pattern in header_text for pattern in QUARTER_HEADER_PATTERNS):
+                        table = candidate
+                        break
+        if table is None:
+            logger.warning(f"⚠️ Quarterly data not found for {stock_code}")
+            return {}, []
+        tables = [table]
+
+    quarters = [text for table in tables for text in table.header][1:]
+    if not quarters:
+        logger.warning(f"⚠️ No quarters found for {stock_code}")
+        return {}, []
+
+    data = _rows_with_width(tables, len(quarters))
+    logger.info(f"📈 Extracted {len(data)} quarterly metrics for {stock_code}")
+    return data, quarters
+
+def _single_pass_annual(index: FinancialPageIndex, stock_code: str) -> Tuple[Dict, List]:
+    section = index.sections_by_id.get("profit-loss")
+    if section is None:
+        return {}, []
+    tables = index.tables_in(section)
+    years = [text for table in tables for text in table.header][1:]
+    data = _rows_with_width(tables, len(years), prefix="Annual ")
+    logger.info(f"📅 Extracted {len(data)} annual metrics for {stock_code}")
+    return data, years
+
+def _single_pass_ratios(index: FinancialPageIndex, stock_code: str, quarters: List) -> Dict:
+    data = {}
+    for container in index.ratio_sections or index.ratio_divs:
+        tables = index.tables_in(container)
+        if not tables:
+            continue
+        table = tables[0]
+        for i, cells in enumerate(table.rows):
+            if len(cells) < 2:
+                continue
+            metric, values = table.cleaned(i)
+            if metric and any(v for v in values):
+                data[metric] = (values + [""] * len(quarters))[:len(quarters)]
+    if data:
+        logger.info(f"📊 Extracted {len(data)} ratio metrics for {stock_code}")
+    return data
+
+def _single_pass_per_share(index: FinancialPageIndex, stock_code: str, quarters: List) -> ExtractedFinancials:
+    data = ExtractedFinancials()
+    width = len(quarters)
+    for section in index.sections:
+        section_id = section.get("id") or ""
+        for table in index.tables_in(section):
+            for i, cells in enumerate(table.rows):
+                if len(cells) < 2:
+                    continue
+                metric, values = table.cleaned(i)
+                if not any(keyword in metric.lower() for keyword in PER_SHARE_KEYWORDS):
+                    continue
+                if len(cells) >= width + 1:
+                    values = values[:width]
+                else:
+                    # Handle single value metrics
+                    values = [values[0]] + [""] * (width - 1)
+                if any(v for v in values):
+                    data.add(section_id, {metric: values})
+    if data:
+        logger.info(f"📈 Extracted {len(data)} per share metrics for {stock_code}")
+    return data
+
+def extract_all_financial_data(soup: BeautifulSoup, stock_code: str,
+                               index: Optional[FinancialPageIndex] = None) -> Tuple[Dict, List]:
+    """Extract ALL financial data from multiple sections of the page in a single tree walk"""
+    all_data = ExtractedFinancials()
+    quarters = []
+
+    try:
+        index = index or FinancialPageIndex(soup)
+
+        # 1. Quarterly Results (main financial statements)
+        quarterly_data, quarterly_quarters = _single_pass_quarterly(index, stock_code)
+        if quarterly_data and quarterly_quarters:
+            all_data.add(QUARTERLY_SERIES_SECTION, quarterly_data)
+            quarters = quarterly_quarters
+
+        # 2. Annual Results if available
+        annual_data, annual_quarters = _single_pass_annual(index, stock_code)
+        if annual_data:
+            all_data.add("profit-loss", annual_data)
+            if not quarters:
+                quarters = annual_quarters
+
+        # 3. Ratios section
+        all_data.add("ratios", _single_pass_ratios(index, stock_code, quarters))
+
+        # 4./5. Balance Sheet and Cash Flow details
+        for section_id, label in (("balance-sheet", "🏦 Extracted {} balance sheet metrics"),
+                                  ("cash-flow", "💰 Extracted {} cash flow metrics")):
+            section = index.sections_by_id.get(section_id)
+            if section is None:
+                continue
+            section_data = _rows_with_width(index.tables_in(section), len(quarters))
+            if section_data:
+                logger.info(f"{label.format(len(section_data))} for {stock_code}")
+                all_data.add(section_id, section_data)
+
+        # 6. Per Share data from every section
+        all_data.extend(_single_pass_per_share(index, stock_code, quarters))
+
+        logger.info(f"📊 Extracted {len(all_data)} total metrics for {stock_code}")
+        return all_data, quarters
+
+    except Exception as e:
+        logger.error(f"Error extracting all financial data for {stock_code}: {e}")
+        return ExtractedFinancials(), []
+
+def extract_all_financial_data_multipass(soup: BeautifulSoup, stock_code: str) -> Tuple[Dict, List]:
+    """Original six-walk extractor, kept as the reference for --benchmark-parse"""
     all_data = {}
     quarters = []
     
@@ -1084,99 +2546,2003 @@ def extract_cashflow_data(soup: BeautifulSoup, stock_code: str, quarters: List)
         logger.warning(f"Could not extract cash flow data for {stock_code}: {e}")
         return {}
 
-def extract_per_share_data(soup: BeautifulSoup, stock_code: str, quarters: List) -> Dict:
-    """Extract per share data and other key metrics"""
+def extract_per_share_data(soup: BeautifulSoup, stock_code: str, quarters: List) -> Dict:
+    """Extract per share data and other key metrics"""
+    try:
+        # Look for per share data in various sections
+        data = {}
+        
+        # Check for per share ratios or metrics
+        for section in soup.find_all("section"):
+            tables = section.find_all("table")
+            for table in tables:
+                for row in table.select("tbody tr"):
+                    cols = row.find_all("td")
+                    if len(cols) >= 2:
+                        metric = clean_metric_name(cols[0].get_text())
+                        
+                        # Check if this is a per share metric
+                        if any(keyword in metric.lower() for keyword in ['per share', 'eps', 'book value', 'dividend']):
+                            if len(cols) >= len(quarters) + 1:
+                                values = [clean_value(td.get_text()) for td in cols[1:len(quarters)+1]]
+                            else:
+                                # Handle single value metrics
+                                values = [clean_value(cols[1].get_text())] + [""] * (len(quarters) - 1)
+                            
+                            if any(v for v in values):
+                                data[metric] = values
+        
+        if data:
+            logger.info(f"📈 Extracted {len(data)} per share metrics for {stock_code}")
+        return data
+        
+    except Exception as e:
+        logger.warning(f"Could not extract per share data for {stock_code}: {e}")
+        return {}
+
+# ------------------- Shared HTTP Session -------------------
+SCRAPE_CACHE_DIR = os.getenv(
+    "SCRAPE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".scrape_cache")
+)
+# Keep this at least as large as SCRAPE_MAX_WORKERS so every worker can hold a live connection
+SCRAPE_HTTP_POOL_SIZE = int(os.getenv("SCRAPE_HTTP_POOL_SIZE", "10"))
+
+try:
+    import brotli  # noqa: F401  (urllib3 decodes "br" transparently when this is installed)
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+def build_http_session() -> requests.Session:
+    """Keep-alive session with a connection pool sized for the scrape workers"""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.headers["Accept-Encoding"] = "gzip, deflate, br" if BROTLI_AVAILABLE else "gzip, deflate"
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=SCRAPE_HTTP_POOL_SIZE,
+        pool_maxsize=SCRAPE_HTTP_POOL_SIZE,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+HTTP_SESSION = build_http_session()
+
+# ------------------- Raw Page Cache -------------------
+SCRAPE_PAGE_CACHE_TTL = float(os.getenv("SCRAPE_PAGE_CACHE_TTL", str(6 * 3600)))
+SCRAPE_PAGE_CACHE_MAX_MB = float(os.getenv("SCRAPE_PAGE_CACHE_MAX_MB", "200"))
+# Work from cached pages only (no network); set by --offline for replay and benchmarking
+SCRAPE_OFFLINE = os.getenv("SCRAPE_OFFLINE", "").lower() in ("1", "true", "yes")
+# Bump whenever extraction output changes so memoized parse results are not reused
+EXTRACTOR_VERSION = 3
+
+class PageCache:
+    """Size-bounded, persistent cache of raw screener responses keyed by ticker and URL.
+
+    Pages are stored gzip-compressed next to a JSON index holding their ETag/Last-Modified
+    validators, SHA-256 content hash and access times. Entries younger than `ttl` are served
+    without touching the network; older ones are revalidated with a conditional GET. When the
+    cache grows past `max_bytes` the least recently used entries are evicted. The data parsed
+    from a page is memoized against its content hash, so an identical page is never re-parsed.
+    """
+
+    def __init__(self, directory: str, ttl: float, max_bytes: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(directory, "index.json")
+        self._lock = threading.RLock()
+        self._index: Optional[Dict[str, Dict]] = None
+        self.stats = {
+            "hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "stores": 0,
+            "evictions": 0, "parse_memo_hits": 0,
+        }
+
+    @staticmethod
+    def key(stock_code: str, url: str) -> str:
+        return hashlib.sha1(f"{stock_code}|{url}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def content_hash(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def _load_index_locked(self) -> Dict[str, Dict]:
+        if self._index is None:
+            try:
+                with open(self._index_path, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _write_json(self, path: str, payload):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    def _save_index_locked(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_json(self._index_path, self._index)
+        except OSError as e:
+            logger.warning(f"Could not persist page cache index: {e}")
+
+    def _remove_locked(self, key: str):
+        self._index.pop(key, None)
+        for suffix in (".html.gz", ".parsed.json"):
+            try:
+                os.remove(self._path(key, suffix))
+            except OSError:
+                pass
+
+    def _evict_locked(self):
+        total = sum(entry["size"] for entry in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= entry["size"]
+            self._remove_locked(key)
+            self.stats["evictions"] += 1
+
+    def record(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def lookup(self, stock_code: str, url: str) -> Optional[Dict]:
+        """Index entry plus raw content for a page, or None. `fresh` tells whether it is within TTL."""
+        key = self.key(stock_code, url)
+        with self._lock:
+            entry = self._load_index_locked().get(key)
+            if entry is None:
+                return None
+            try:
+                with gzip.open(self._path(key, ".html.gz"), "rb") as f:
+                    content = f.read()
+            except OSError:
+                self._remove_locked(key)
+                return None
+            entry["last_access"] = time.time()
+            result = dict(entry)
+        result["key"] = key
+        result["content"] = content
+        result["fresh"] = time.time() - entry["fetched_at"] < self.ttl
+        return result
+
+    def store(self, stock_code: str, url: str, content: bytes, validators: Dict) -> str:
+        """Save a freshly downloaded page; returns its content hash"""
+        key = self.key(stock_code, url)
+        digest = self.content_hash(content)
+        with self._lock:
+            index = self._load_index_locked()
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                tmp_path = self._path(key, f".{threading.get_ident()}.tmp")
+                with gzip.open(tmp_path, "wb", compresslevel=5) as f:
+                    f.write(content)
+                os.replace(tmp_path, self._path(key, ".html.gz"))
+            except OSError as e:
+                logger.warning(f"Could not cache page for {stock_code}: {e}")
+                return digest
+
+            previous = index.get(key)
+            if previous and previous.get("sha256") != digest:
+                # Content changed, so the memoized parse no longer applies
+                try:
+                    os.remove(self._path(key, ".parsed.json"))
+                except OSError:
+                    pass
+            now = time.time()
+            index[key] = {
+                "stock_code": stock_code,
+                "url": url,
+                "sha256": digest,
+                "size": os.path.getsize(self._path(key, ".html.gz")),
+                "fetched_at": now,
+                "last_access": now,
+                "validators": validators,
+            }
+            self.stats["stores"] += 1
+            self._evict_locked()
+            self._save_index_locked()
+        return digest
+
+    def mark_revalidated(self, key: str):
+        """Server said 304: restart the TTL clock for this entry"""
+        with self._lock:
+            entry = self._load_index_locked().get(key)
+            if entry:
+                entry["fetched_at"] = entry["last_access"] = time.time()
+                self.stats["revalidated"] += 1
+                self._save_index_locked()
+
+    def conditional_headers(self, entry: Optional[Dict]) -> Dict:
+        validators = (entry or {}).get("validators") or {}
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def load_parsed(self, key: str, digest: str) -> Optional[Dict]:
+        """Memoized extraction result for this exact page content, if any"""
+        try:
+            with open(self._path(key, ".parsed.json"), "r", encoding="utf-8") as f:
+                memo = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if memo.get("sha256") != digest or memo.get("extractor_version") != EXTRACTOR_VERSION:
+            return None
+        self.record("parse_memo_hits")
+        return memo["parsed"]
+
+    def store_parsed(self, key: str, digest: str, parsed: Dict):
+        with self._lock:
+            if key not in self._load_index_locked():
+                return
+            try:
+                self._write_json(self._path(key, ".parsed.json"), {
+                    "sha256": digest, "extractor_version": EXTRACTOR_VERSION, "parsed": parsed
+                })
+            except OSError as e:
+                logger.warning(f"Could not memoize parse result: {e}")
+
+    def entries(self) -> List[Dict]:
+        with self._lock:
+            return [dict(entry, key=key) for key, entry in self._load_index_locked().items()]
+
+    def flush(self):
+        """Persist access times so LRU order survives restarts"""
+        with self._lock:
+            if self._index is not None:
+                self._save_index_locked()
+
+    def summary(self) -> Dict:
+        with self._lock:
+            index = self._load_index_locked()
+            summary = dict(self.stats)
+            summary["entries"] = len(index)
+            summary["bytes"] = sum(entry["size"] for entry in index.values())
+        summary["max_bytes"] = self.max_bytes
+        summary["ttl_seconds"] = self.ttl
+        summary["offline"] = SCRAPE_OFFLINE
+        return summary
+
+PAGE_CACHE = PageCache(
+    os.path.join(SCRAPE_CACHE_DIR, "pages"),
+    ttl=SCRAPE_PAGE_CACHE_TTL,
+    max_bytes=int(SCRAPE_PAGE_CACHE_MAX_MB * 1024 * 1024),
+)
+atexit.register(PAGE_CACHE.flush)
+
+
+# ------------------- Concurrent Scrape Engine -------------------
+SCRAPE_MAX_WORKERS = int(os.getenv("SCRAPE_MAX_WORKERS", "4"))
+# Per-host politeness: sustained requests/second plus a small burst allowance
+SCRAPE_RATE_PER_HOST = float(os.getenv("SCRAPE_RATE_PER_HOST", "1.0"))
+SCRAPE_BURST_PER_HOST = int(os.getenv("SCRAPE_BURST_PER_HOST", "2"))
+SCRAPE_MAX_RETRIES = int(os.getenv("SCRAPE_MAX_RETRIES", "4"))
+SCRAPE_BACKOFF_BASE = float(os.getenv("SCRAPE_BACKOFF_BASE", "1.0"))
+SCRAPE_BACKOFF_MAX = float(os.getenv("SCRAPE_BACKOFF_MAX", "60"))
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens per second with up to `capacity` banked"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, seconds: float):
+        """Drain the bucket so no request to this host goes out for roughly `seconds`"""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+class HostRateLimiter:
+    """One token bucket per host, created lazily"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.burst)
+            return self._buckets[host]
+
+    def acquire(self, url: str):
+        self.bucket(urlparse(url).netloc).acquire()
+
+SCRAPE_RATE_LIMITER = HostRateLimiter(SCRAPE_RATE_PER_HOST, SCRAPE_BURST_PER_HOST)
+
+def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Full-jitter exponential backoff, honouring a numeric Retry-After header when present"""
+    if retry_after:
+        try:
+            return min(SCRAPE_BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(SCRAPE_BACKOFF_MAX, SCRAPE_BACKOFF_BASE * (2 ** attempt)))
+
+def fetch_with_retry(url: str, max_retries: int = None, **kwargs) -> requests.Response:
+    """Rate-limited GET that retries 429/5xx responses and transient network errors"""
+    max_retries = SCRAPE_MAX_RETRIES if max_retries is None else max_retries
+    kwargs.setdefault("timeout", 30)
+    bucket = SCRAPE_RATE_LIMITER.bucket(urlparse(url).netloc)
+
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            res = HTTP_SESSION.get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= max_retries:
+                raise
+            delay = _retry_delay(attempt)
+            logger.warning(f"⏳ {url} failed ({e}); retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        if res.status_code in RETRYABLE_STATUS_CODES and attempt < max_retries:
+            delay = _retry_delay(attempt, res.headers.get("Retry-After"))
+            if res.status_code == 429:
+                # Slow every worker hitting this host, not just the one that got throttled
+                bucket.penalize(delay)
+            logger.warning(f"⏳ {url} returned HTTP {res.status_code}; retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            res.close()
+            time.sleep(delay)
+            continue
+
+        return res
+
+class ScrapeResult:
+    """Outcome of the fetch stage for one ticker; parsing happens in the consumer"""
+    __slots__ = ("stock_code", "url", "content", "status_code", "error", "elapsed",
+                 "source", "cache_key", "content_hash")
+
+    def __init__(self, stock_code: str, url: str, content: Optional[bytes] = None,
+                 status_code: Optional[int] = None, error: Optional[str] = None, elapsed: float = 0.0,
+                 source: str = "network", cache_key: Optional[str] = None, content_hash: Optional[str] = None):
+        self.stock_code = stock_code
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.error = error
+        self.elapsed = elapsed
+        # "network", "cache" (fresh, no request sent) or "revalidated" (server answered 304)
+        self.source = source
+        self.cache_key = cache_key
+        self.content_hash = content_hash
+
+    @property
+    def ok(self) -> bool:
+        return self.content is not None and self.error is None
+
+def fetch_screener_page(stock_code: str, offline: Optional[bool] = None) -> ScrapeResult:
+    """Get a company page, preferring the page cache and revalidating stale copies with a conditional GET"""
+    offline = SCRAPE_OFFLINE if offline is None else offline
+    url = SCREENER_URL.format(stock_code)
+    start = time.monotonic()
+    try:
+        cached = PAGE_CACHE.lookup(stock_code, url)
+        if cached and (cached["fresh"] or offline):
+            PAGE_CACHE.record("hits")
+            return ScrapeResult(stock_code, url, content=cached["content"], status_code=200,
+                                elapsed=time.monotonic() - start, source="cache",
+                                cache_key=cached["key"], content_hash=cached["sha256"])
+        if offline:
+            PAGE_CACHE.record("misses")
+            return ScrapeResult(stock_code, url, error="not in page cache (offline mode)",
+                                elapsed=time.monotonic() - start)
+        PAGE_CACHE.record("stale" if cached else "misses")
+
+        res = fetch_with_retry(url, headers=PAGE_CACHE.conditional_headers(cached), stream=True)
+
+        if res.status_code == 304 and cached:
+            res.close()
+            PAGE_CACHE.mark_revalidated(cached["key"])
+            return ScrapeResult(stock_code, url, content=cached["content"], status_code=304,
+                                elapsed=time.monotonic() - start, source="revalidated",
+                                cache_key=cached["key"], content_hash=cached["sha256"])
+        if res.status_code != 200:
+            res.close()
+            return ScrapeResult(stock_code, url, status_code=res.status_code,
+                                error=f"HTTP {res.status_code}", elapsed=time.monotonic() - start)
+
+        validators = {
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified"),
+        }
+        content, truncated = read_page_body(res)
+        if truncated:
+            logger.debug(f"Stopped reading {stock_code} after the financial sections ({len(content)} bytes)")
+        digest = PAGE_CACHE.store(stock_code, url, content, validators)
+        return ScrapeResult(stock_code, url, content=content, status_code=res.status_code,
+                            elapsed=time.monotonic() - start, cache_key=PageCache.key(stock_code, url),
+                            content_hash=digest)
+    except Exception as e:
+        return ScrapeResult(stock_code, url, error=str(e), elapsed=time.monotonic() - start)
+
+class ScrapeEngine:
+    """Bounded-concurrency fetch stage: downloads pages on a thread pool, yields them as they finish"""
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max(1, max_workers)
+
+    def fetch_pages(self, stock_codes: List[str]):
+        """Yield a ScrapeResult per ticker in completion order.
+
+        At most 2 x max_workers pages are in flight or buffered at once, so memory stays flat
+        when the consumer (parse + insert) is slower than the network.
+        """
+        pending = list(stock_codes)
+        window = self.max_workers * 2
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scrape") as pool:
+            in_flight = set()
+            while pending or in_flight:
+                while pending and len(in_flight) < window:
+                    in_flight.add(pool.submit(fetch_screener_page, pending.pop(0)))
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+SCRAPE_ENGINE = ScrapeEngine(SCRAPE_MAX_WORKERS)
+
+def scrape_result_to_financial_data(result: ScrapeResult) -> Tuple[Dict, List, str, str]:
+    """Parse stage: turn a fetched page into financial data, using fallback data on failure"""
+    if not result.ok:
+        logger.error(f"❌ Failed to fetch {result.stock_code}: {result.error}")
+        return use_fallback_data(result.stock_code)
+
+    # Identical bytes were parsed before: reuse that result instead of walking the HTML again
+    if result.cache_key and result.content_hash:
+        memo = PAGE_CACHE.load_parsed(result.cache_key, result.content_hash)
+        if memo is not None:
+            logger.info(f"♻️ {result.stock_code} page unchanged ({result.source}), reusing parsed data")
+            data = ExtractedFinancials(memo["data"], memo.get("sections"))
+            return data, memo["quarters"], memo["category"], memo["industry"]
+
+    try:
+        data, quarters, category, industry = extract_financial_page(result.content, result.stock_code)
+    except Exception as e:
+        logger.error(f"❌ Unexpected error for {result.stock_code}: {e}")
+        return use_fallback_data(result.stock_code)
+
+    if not data or not quarters:
+        logger.warning(f"No data extracted from scraping for {result.stock_code}, trying fallback")
+        return use_fallback_data(result.stock_code)
+
+    # Only memoize genuinely scraped pages, never fallback data
+    if result.cache_key and result.content_hash:
+        PAGE_CACHE.store_parsed(result.cache_key, result.content_hash, {
+            "data": data, "sections": getattr(data, "sections", {}), "quarters": quarters,
+            "category": category, "industry": industry
+        })
+    return data, quarters, category, industry
+
+def load_benchmark_pages(directory: Optional[str] = None) -> List[Tuple[str, bytes]]:
+    """Saved pages to benchmark against: *.html files in `directory`, else the page cache"""
+    pages = []
+    if directory:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith((".html", ".htm")):
+                with open(os.path.join(directory, name), "rb") as f:
+                    pages.append((os.path.splitext(name)[0].upper(), f.read()))
+        return pages
+    for entry in PAGE_CACHE.entries():
+        cached = PAGE_CACHE.lookup(entry["stock_code"], entry["url"])
+        if cached:
+            pages.append((entry["stock_code"], cached["content"]))
+    return pages
+
+def benchmark_parse(pages: List[Tuple[str, bytes]], repeat: int = 3) -> Dict:
+    """Time the multi-pass and single-pass extractors on the same parsed trees and check they agree"""
+    previous_level = logger.level
+    logger.setLevel(logging.WARNING)  # per-section info logs would dominate the timings
+    rows = []
+    try:
+        for stock_code, content in pages:
+            soup = parse_html(content)
+            timings = {}
+            results = {}
+            for label, extractor in (("multi_pass", extract_all_financial_data_multipass),
+                                     ("single_pass", extract_all_financial_data)):
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    results[label] = extractor(soup, stock_code)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[label] = best
+            rows.append({
+                "stock_code": stock_code,
+                "kib": round(len(content) / 1024, 1),
+                "multi_pass_ms": round(timings["multi_pass"] * 1000, 2),
+                "single_pass_ms": round(timings["single_pass"] * 1000, 2),
+                "speedup": round(timings["multi_pass"] / timings["single_pass"], 2) if timings["single_pass"] else None,
+                "identical": results["multi_pass"] == results["single_pass"],
+            })
+    finally:
+        logger.setLevel(previous_level)
+
+    multi = sum(r["multi_pass_ms"] for r in rows)
+    single = sum(r["single_pass_ms"] for r in rows)
+    return {
+        "pages": rows,
+        "total_multi_pass_ms": round(multi, 2),
+        "total_single_pass_ms": round(single, 2),
+        "overall_speedup": round(multi / single, 2) if single else None,
+        "all_identical": all(r["identical"] for r in rows),
+    }
+
+def benchmark_partial_parse(pages: List[Tuple[str, bytes]], repeat: int = 3) -> Dict:
+    """Compare full-page and partial (financial sections only) parsing: time, peak memory, agreement"""
+    import tracemalloc
+
+    previous_level = logger.level
+    logger.setLevel(logging.WARNING)
+    rows = []
+    try:
+        for stock_code, content in pages:
+            cut = financial_sections_end(content)
+            timings, peaks, results = {}, {}, {}
+            for label, partial in (("full", False), ("partial", True)):
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    results[label] = extract_financial_page(content, stock_code, partial=partial)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[label] = best
+                tracemalloc.start()
+                extract_financial_page(content, stock_code, partial=partial)
+                peaks[label] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            rows.append({
+                "stock_code": stock_code,
+                "kib": round(len(content) / 1024, 1),
+                "streamed_kib": round((cut if cut is not None else len(content)) / 1024, 1),
+                "full_ms": round(timings["full"] * 1000, 2),
+                "partial_ms": round(timings["partial"] * 1000, 2),
+                "full_peak_kib": round(peaks["full"] / 1024, 1),
+                "partial_peak_kib": round(peaks["partial"] / 1024, 1),
+                "identical": results["full"] == results["partial"],
+            })
+    finally:
+        logger.setLevel(previous_level)
+
+    full = sum(r["full_ms"] for r in rows)
+    partial = sum(r["partial_ms"] for r in rows)
+    return {
+        "pages": rows,
+        "total_full_ms": round(full, 2),
+        "total_partial_ms": round(partial, 2),
+        "overall_speedup": round(full / partial, 2) if partial else None,
+        "max_full_peak_kib": max((r["full_peak_kib"] for r in rows), default=0),
+        "max_partial_peak_kib": max((r["partial_peak_kib"] for r in rows), default=0),
+        "all_identical": all(r["identical"] for r in rows),
+    }
+
+def verify_parser_backends(pages: List[Tuple[str, bytes]], golden_dir: Optional[str] = None,
+                           write_golden: bool = False) -> Dict:
+    """Check every available backend extracts exactly what the reference backend does.
+
+    With `golden_dir`, reference output is also compared with (or, with `write_golden`, saved to)
+    <golden_dir>/<STOCK>.golden.json so regressions in the reference parser are caught too.
+    No pages, or a page without its golden file, fails the check rather than passing vacuously.
+    """
+    previous_level = logger.level
+    logger.setLevel(logging.WARNING)
+    backends = available_parser_backends()
+    report = {"backends": backends, "pages": [], "all_identical": bool(pages)}
+    if not pages:
+        report["error"] = "no pages to verify"
+    try:
+        for stock_code, content in pages:
+            outputs, timings = {}, {}
+            for backend in backends:
+                start = time.perf_counter()
+                data, quarters, category, industry = extract_financial_page(content, stock_code, backend)
+                timings[backend] = round((time.perf_counter() - start) * 1000, 2)
+                outputs[backend] = {"data": data, "sections": getattr(data, "sections", {}), "quarters": quarters,
+                                    "category": category, "industry": industry}
+
+            reference = outputs[REFERENCE_PARSER_BACKEND]
+            page = {
+                "stock_code": stock_code,
+                "ms": timings,
+                "mismatched_backends": [b for b in backends if outputs[b] != reference],
+            }
+            if golden_dir:
+                golden_path = os.path.join(golden_dir, f"{stock_code}.golden.json")
+                if write_golden:
+                    with open(golden_path, "w", encoding="utf-8") as f:
+                        json.dump(reference, f, indent=2, ensure_ascii=False)
+                    page["golden"] = "written"
+                elif os.path.exists(golden_path):
+                    with open(golden_path, "r", encoding="utf-8") as f:
+                        golden_matches = json.load(f) == reference
+                    page["golden"] = "match" if golden_matches else "MISMATCH"
+                    if not golden_matches:
+                        report["all_identical"] = False
+                else:
+                    page["golden"] = "missing"
+                    report["all_identical"] = False
+            if page["mismatched_backends"]:
+                report["all_identical"] = False
+            report["pages"].append(page)
+    finally:
+        logger.setLevel(previous_level)
+    return report
+
+def replay_cached_pages() -> Dict:
+    """Re-run extraction over every cached page (no network, no memo) and time it"""
+    timings = []
+    for entry in PAGE_CACHE.entries():
+        cached = PAGE_CACHE.lookup(entry["stock_code"], entry["url"])
+        if not cached:
+            continue
+        start = time.perf_counter()
+        data, quarters, category, industry = extract_financial_page(cached["content"], entry["stock_code"])
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        print(f"  {entry['stock_code']:<12} {len(cached['content']) / 1024:8.1f} KiB  "
+              f"{len(data):4d} metrics  {len(quarters):3d} periods  {elapsed * 1000:8.1f} ms")
+    total = sum(timings)
+    return {
+        "pages": len(timings),
+        "total_seconds": round(total, 4),
+        "avg_ms_per_page": round(total / len(timings) * 1000, 2) if timings else 0.0,
+        "max_ms_per_page": round(max(timings) * 1000, 2) if timings else 0.0,
+    }
+
+# ------------------- Enhanced Snowflake Integration -------------------
+def snowflake_connect():
+    """Create Snowflake connection with better error handling"""
+    try:
+        logger.info("Connecting to Snowflake...")
+        
+        # Validate environment variables
+        required_vars = ["SNOWFLAKE_USER", "SNOWFLAKE_PASSWORD", "SNOWFLAKE_ACCOUNT"]
+        for var in required_vars:
+            if not os.getenv(var):
+                raise ValueError(f"Missing required environment variable: {var}")
+        
+        conn = snowflake.connector.connect(
+            user=os.getenv("SNOWFLAKE_USER"),
+            password=os.getenv("SNOWFLAKE_PASSWORD"),
+            account=os.getenv("SNOWFLAKE_ACCOUNT"),
+            warehouse='SNOWFLAKE_LEARNING_WH',
+            database='STOCK_DB',
+            schema='STOCK_SOURCE',
+            client_session_keep_alive=True,
+            # Keep NUMBER(38, 8) as decimal in Arrow results; iter_result_frames narrows it to
+            # float64 only where that's exact
+            arrow_number_to_decimal=True
+        )
+        
+        logger.info("✅ Snowflake connection established")
+        return conn
+
+    except Exception as e:
+        logger.error(f"❌ Snowflake connection failed: {e}")
+        raise
+
+# ------------------- Snowflake Connection Pool -------------------
+SNOWFLAKE_POOL_SIZE = int(os.getenv("SNOWFLAKE_POOL_SIZE", "5"))
+SNOWFLAKE_POOL_TIMEOUT = float(os.getenv("SNOWFLAKE_POOL_TIMEOUT", "30"))
+SNOWFLAKE_POOL_MAX_IDLE = float(os.getenv("SNOWFLAKE_POOL_MAX_IDLE", "600"))
+SNOWFLAKE_POOL_MAX_LIFETIME = float(os.getenv("SNOWFLAKE_POOL_MAX_LIFETIME", "3600"))
+SNOWFLAKE_POOL_PING_AFTER = float(os.getenv("SNOWFLAKE_POOL_PING_AFTER", "60"))
+
+class SnowflakeUnavailableError(Exception):
+    """Raised when no healthy Snowflake connection can be checked out of the pool"""
+
+class _PooledConnection:
+    """A Snowflake connection plus the bookkeeping the pool needs to recycle it"""
+    __slots__ = ("conn", "created_at", "last_used_at")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+class SnowflakeConnectionPool:
+    """Thread-safe, bounded pool of Snowflake connections with health checks and recycling"""
+
+    def __init__(self, connect_fn, max_size: int = 5, timeout: float = 30.0,
+                 max_idle: float = 600.0, max_lifetime: float = 3600.0, ping_after: float = 60.0):
+        self._connect_fn = connect_fn
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+
+        self._cond = threading.Condition()
+        self._idle: List[_PooledConnection] = []
+        self._size = 0
+        self._stats = {
+            "checkouts": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "health_check_failures": 0,
+            "idle_evictions": 0,
+            "lifetime_recycles": 0,
+            "checkout_timeouts": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def _expired(self, entry: _PooledConnection, now: float) -> bool:
+        return now - entry.created_at >= self.max_lifetime
+
+    def _close_entry(self, entry: _PooledConnection):
+        """Close a connection that is leaving the pool (caller must hold no lock)"""
+        try:
+            entry.conn.close()
+        except Exception as e:
+            logger.warning(f"Error closing pooled Snowflake connection: {e}")
+
+    def _evict_idle_locked(self, now: float) -> List[_PooledConnection]:
+        """Drop idle connections past their idle or lifetime limits; returns them for closing"""
+        keep, evicted = [], []
+        for entry in self._idle:
+            if now - entry.last_used_at >= self.max_idle:
+                self._stats["idle_evictions"] += 1
+                evicted.append(entry)
+            elif self._expired(entry, now):
+                self._stats["lifetime_recycles"] += 1
+                evicted.append(entry)
+            else:
+                keep.append(entry)
+        self._idle = keep
+        self._size -= len(evicted)
+        self._stats["connections_closed"] += len(evicted)
+        return evicted
+
+    def _is_healthy(self, entry: _PooledConnection) -> bool:
+        """Cheap liveness check; only pings the server when the connection sat idle for a while"""
+        try:
+            if entry.conn.is_closed():
+                return False
+            if time.monotonic() - entry.last_used_at >= self.ping_after:
+                cur = entry.conn.cursor()
+                try:
+                    cur.execute("SELECT 1")
+                    cur.fetchone()
+                finally:
+                    cur.close()
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled Snowflake connection failed health check: {e}")
+            return False
+
+    def checkout(self) -> _PooledConnection:
+        """Borrow a healthy connection, creating one if the pool has spare capacity"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            entry = None
+            to_close: List[_PooledConnection] = []
+            with self._cond:
+                while True:
+                    evicted = self._evict_idle_locked(time.monotonic())
+                    if evicted:
+                        to_close.extend(evicted)
+                        self._cond.notify_all()
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["checkout_timeouts"] += 1
+                        raise SnowflakeUnavailableError(
+                            f"Timed out after {self.timeout:.1f}s waiting for a Snowflake connection "
+                            f"(pool size {self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+
+            for stale in to_close:
+                self._close_entry(stale)
+
+            if entry is None:
+                try:
+                    entry = _PooledConnection(self._connect_fn())
+                except Exception as e:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise SnowflakeUnavailableError(str(e)) from e
+                with self._cond:
+                    self._stats["connections_created"] += 1
+            elif not self._is_healthy(entry):
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                self._discard(entry)
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._stats["checkouts"] += 1
+                self._stats["total_wait_seconds"] += waited
+                self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+            entry.last_used_at = time.monotonic()
+            return entry
+
+    def _discard(self, entry: _PooledConnection):
+        with self._cond:
+            self._size -= 1
+            self._stats["connections_closed"] += 1
+            self._cond.notify()
+        self._close_entry(entry)
+
+    def release(self, entry: _PooledConnection, discard: bool = False):
+        """Return a borrowed connection; broken or over-age connections are closed instead"""
+        now = time.monotonic()
+        if not discard and self._expired(entry, now):
+            with self._cond:
+                self._stats["lifetime_recycles"] += 1
+            discard = True
+        if discard:
+            self._discard(entry)
+            return
+        entry.last_used_at = now
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a pooled connection; rolls back and returns it on exit"""
+        entry = self.checkout()
+        broken = False
+        try:
+            yield entry.conn
+        except Exception:
+            try:
+                entry.conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.release(entry, discard=broken)
+
+    def close_all(self):
+        """Close every idle connection (in-use connections are closed when released)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._stats["connections_closed"] += len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._close_entry(entry)
+
+    def stats(self) -> Dict:
+        """Snapshot of pool metrics for diagnostics"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max_size"] = self.max_size
+        checkouts = stats["checkouts"]
+        stats["avg_wait_seconds"] = round(stats["total_wait_seconds"] / checkouts, 4) if checkouts else 0.0
+        stats["total_wait_seconds"] = round(stats["total_wait_seconds"], 4)
+        stats["max_wait_seconds"] = round(stats["max_wait_seconds"], 4)
+        return stats
+
+SNOWFLAKE_POOL = SnowflakeConnectionPool(
+    snowflake_connect,
+    max_size=SNOWFLAKE_POOL_SIZE,
+    timeout=SNOWFLAKE_POOL_TIMEOUT,
+    max_idle=SNOWFLAKE_POOL_MAX_IDLE,
+    max_lifetime=SNOWFLAKE_POOL_MAX_LIFETIME,
+    ping_after=SNOWFLAKE_POOL_PING_AFTER,
+)
+atexit.register(SNOWFLAKE_POOL.close_all)
+
+def snowflake_connection():
+    """Borrow a connection from the shared pool: `with snowflake_connection() as conn: ...`"""
+    return SNOWFLAKE_POOL.connection()
+
+# ------------------- Schema Management -------------------
+# Versioned, append-only list of (version, description, statements). Each statement must be
+# idempotent so a partially applied migration can simply be re-run.
+# Every hot read filters on STOCK_CODE or CATEGORY (see ROUTE_QUERIES); clustering on both
+# keeps those scans proportional to one stock or sector as the table grows
+QUARTERLY_CLUSTERING_KEY = "(CATEGORY, STOCK_CODE)"
+
+SCHEMA_MIGRATIONS = [
+    (1, "Create FINANCIALS_QUARTERLY", [
+        """
+        CREATE TABLE IF NOT EXISTS FINANCIALS_QUARTERLY (
+            STOCK_CODE STRING,
+            METRIC STRING,
+            QUARTER STRING,
+            VALUE STRING,
+            INDUSTRY STRING,
+            CATEGORY STRING,
+            METRIC_CATEGORY STRING,
+            DATA_SOURCE STRING DEFAULT 'SCREENER',
+            CREATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
+            UPDATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
+        )
+        """,
+    ]),
+    (2, "Add ROW_HASH for change detection", [
+        "ALTER TABLE FINANCIALS_QUARTERLY ADD COLUMN IF NOT EXISTS ROW_HASH STRING",
+    ]),
+    (3, "Add typed VALUE_NUM and PERIOD_DATE columns", [
+        "ALTER TABLE FINANCIALS_QUARTERLY ADD COLUMN IF NOT EXISTS VALUE_NUM NUMBER(38, 8)",
+        "ALTER TABLE FINANCIALS_QUARTERLY ADD COLUMN IF NOT EXISTS PERIOD_DATE DATE",
+        """
+        UPDATE FINANCIALS_QUARTERLY
+        SET VALUE_NUM = TRY_TO_NUMBER(VALUE, 38, 8),
+            PERIOD_DATE = LAST_DAY(TRY_TO_DATE(QUARTER, 'MON YYYY'))
+        WHERE VALUE_NUM IS NULL OR PERIOD_DATE IS NULL
+        """,
+    ]),
+    (4, "Cluster FINANCIALS_QUARTERLY by (CATEGORY, STOCK_CODE)", [
+        f"ALTER TABLE FINANCIALS_QUARTERLY CLUSTER BY {QUARTERLY_CLUSTERING_KEY}",
+    ]),
+    (5, "Create FINANCIALS_SNAPSHOT", [
+        """
+        CREATE TABLE IF NOT EXISTS FINANCIALS_SNAPSHOT (
+            STOCK_CODE STRING PRIMARY KEY,
+            PAYLOAD VARIANT,
+            ROW_COUNT INTEGER,
+            UPDATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
+        )
+        """,
+    ]),
+    (6, "Add PERIOD_ORDINAL for chronological ordering", [
+        "ALTER TABLE FINANCIALS_QUARTERLY ADD COLUMN IF NOT EXISTS PERIOD_ORDINAL INTEGER",
+        f"""
+        UPDATE FINANCIALS_QUARTERLY
+        SET PERIOD_ORDINAL = IFF(UPPER(TRIM(QUARTER)) IN ({", ".join(f"'{label}'" for label in TTM_LABELS)}),
+                                 {PERIOD_ORDINAL_TTM},
+                                 YEAR(PERIOD_DATE) * 12 + MONTH(PERIOD_DATE) - 1)
+        WHERE PERIOD_ORDINAL IS NULL
+        """,
+    ]),
+    (7, "Create FINANCIALS_FEATURES", [
+        """
+        CREATE TABLE IF NOT EXISTS FINANCIALS_FEATURES (
+            STOCK_CODE STRING,
+            METRIC STRING,
+            METRIC_CATEGORY STRING,
+            QUARTER STRING,
+            PERIOD_ORDINAL INTEGER,
+            VALUE_NUM NUMBER(38, 8),
+            QOQ_GROWTH FLOAT,
+            YOY_GROWTH FLOAT,
+            TTM_VALUE FLOAT,
+            TTM_YOY_GROWTH FLOAT,
+            CAGR_3Y FLOAT,
+            CAGR_5Y FLOAT,
+            UPDATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
+        )
+        CLUSTER BY (STOCK_CODE)
+        """,
+    ]),
+    (8, "Drop features computed for annual-section metrics", [
+        """
+        DELETE FROM FINANCIALS_FEATURES
+        WHERE METRIC LIKE 'Annual %' OR METRIC_CATEGORY IS DISTINCT FROM 'Income Statement'
+        """,
+    ]),
+    # Rows stored before this can't say which table they came from: the old metric-name test
+    # stands in until the stock's next load, which rewrites every row (SOURCE_SECTION is hashed)
+    (9, "Add SOURCE_SECTION, the page section each row was read from", [
+        "ALTER TABLE FINANCIALS_QUARTERLY ADD COLUMN IF NOT EXISTS SOURCE_SECTION STRING",
+        f"""
+        UPDATE FINANCIALS_QUARTERLY
+        SET SOURCE_SECTION = '{QUARTERLY_SERIES_SECTION}'
+        WHERE SOURCE_SECTION IS NULL AND METRIC_CATEGORY = 'Income Statement' AND NOT STARTSWITH(METRIC, 'Annual ')
+        """,
+    ]),
+]
+
+class SchemaManager:
+    """Verifies and migrates the warehouse schema once per process, then caches the result"""
+
+    def __init__(self, migrations: List[Tuple[int, str, List[str]]]):
+        self.migrations = sorted(migrations, key=lambda m: m[0])
+        self.target_version = self.migrations[-1][0] if self.migrations else 0
+        self._lock = threading.Lock()
+        self._verified = False
+        self.current_version: Optional[int] = None
+        self.verified_at: Optional[str] = None
+        self.applied_this_process: List[int] = []
+
+    @property
+    def verified(self) -> bool:
+        return self._verified
+
+    def ensure(self, conn=None) -> int:
+        """Apply any pending migrations on first call; later calls return immediately"""
+        if self._verified:
+            return self.current_version
+
+        with self._lock:
+            if self._verified:
+                return self.current_version
+            if conn is None:
+                with snowflake_connection() as pooled_conn:
+                    self._migrate(pooled_conn)
+            else:
+                self._migrate(conn)
+            self._verified = True
+            self.verified_at = time.strftime("%Y-%m-%d %H:%M:%S")
+            return self.current_version
+
+    def invalidate(self):
+        """Force the next ensure() to re-check the warehouse (e.g. after a table was dropped)"""
+        with self._lock:
+            self._verified = False
+
+    def _migrate(self, conn):
+        cur = conn.cursor()
+        try:
+            logger.info("📋 Verifying Snowflake schema...")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS SCHEMA_MIGRATIONS (
+                    VERSION INTEGER,
+                    DESCRIPTION STRING,
+                    APPLIED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
+                )
+            """)
+            cur.execute("SELECT COALESCE(MAX(VERSION), 0) FROM SCHEMA_MIGRATIONS")
+            version = cur.fetchone()[0] or 0
+
+            for migration_version, description, statements in self.migrations:
+                if migration_version <= version:
+                    continue
+                logger.info(f"🔧 Applying schema migration {migration_version}: {description}")
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO SCHEMA_MIGRATIONS (VERSION, DESCRIPTION) VALUES (%s, %s)",
+                    (migration_version, description)
+                )
+                conn.commit()
+                version = migration_version
+                self.applied_this_process.append(migration_version)
+
+            self.current_version = version
+            logger.info(f"✅ Schema verified at version {version}")
+        except Exception as e:
+            logger.error(f"❌ Schema migration failed: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def status(self) -> Dict:
+        return {
+            "verified": self._verified,
+            "current_version": self.current_version,
+            "target_version": self.target_version,
+            "verified_at": self.verified_at,
+            "applied_this_process": list(self.applied_this_process),
+        }
+
+SCHEMA_MANAGER = SchemaManager(SCHEMA_MIGRATIONS)
+
+def ensure_schema(conn=None) -> int:
+    """Make sure FINANCIALS_QUARTERLY is at the latest schema version (DDL only on first call)"""
+    return SCHEMA_MANAGER.ensure(conn)
+
+def bootstrap_schema() -> bool:
+    """Verify the schema at process startup; failures are logged and retried on first use"""
+    try:
+        ensure_schema()
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Schema bootstrap deferred to first use: {e}")
+        return False
+
+def bootstrap_metric_registry() -> int:
+    """Seed an empty metric registry from the warehouse so categories show without a reload"""
+    if len(METRIC_REGISTRY):
+        return 0
+    try:
+        with snowflake_connection() as conn:
+            added = METRIC_REGISTRY.seed_from_warehouse(conn)
+        METRIC_REGISTRY.flush()
+        logger.info(f"📊 Seeded metric registry with {added} metrics from Snowflake")
+        return added
+    except Exception as e:
+        logger.warning(f"⚠️ Metric registry not seeded: {e}")
+        return 0
+
+def clustering_report(conn) -> Dict:
+    """Clustering health of FINANCIALS_QUARTERLY plus partition pruning for each route's query"""
+    cur = conn.cursor()
+    cur.execute(f"SELECT SYSTEM$CLUSTERING_INFORMATION('FINANCIALS_QUARTERLY', '{QUARTERLY_CLUSTERING_KEY}')")
+    info = json.loads(cur.fetchone()[0])
+    report = {
+        "clustering_key": QUARTERLY_CLUSTERING_KEY,
+        "total_partitions": info.get("total_partition_count"),
+        "constant_partitions": info.get("total_constant_partition_count"),
+        "average_overlaps": info.get("average_overlaps"),
+        "average_depth": info.get("average_depth"),
+        "depth_histogram": info.get("partition_depth_histogram"),
+        "queries": {},
+    }
+
+    # Bind each query to a real, populated key so the plan reflects typical pruning
+    cur.execute("""
+        SELECT STOCK_CODE, CATEGORY, METRIC_CATEGORY
+        FROM FINANCIALS_QUARTERLY
+        WHERE CATEGORY IS NOT NULL AND METRIC_CATEGORY IS NOT NULL
+        LIMIT 1
+    """)
+    sample = cur.fetchone()
+    samples = dict(zip(["STOCK_CODE", "CATEGORY", "METRIC_CATEGORY"], sample)) if sample else {}
+
+    for route, (query, bind) in ROUTE_QUERIES.items():
+        bind, make_binds = bind if isinstance(bind, tuple) else (bind, lambda value: (value,))
+        if bind and bind not in samples:
+            report["queries"][route] = {"error": "no sample rows to bind"}
+            continue
+        cur.execute(f"EXPLAIN USING JSON {query}", make_binds(samples[bind]) if bind else None)
+        stats = json.loads(cur.fetchone()[0]).get("GlobalStats", {})
+        total = stats.get("partitionsTotal") or 0
+        assigned = stats.get("partitionsAssigned") or 0
+        report["queries"][route] = {
+            "bind": samples.get(bind),
+            "partitions_total": total,
+            "partitions_scanned": assigned,
+            "bytes_assigned": stats.get("bytesAssigned"),
+            "pruned_pct": round(100 * (1 - assigned / total), 1) if total else None,
+        }
+    return report
+
+def create_snowflake_table(conn=None):
+    """Create the enhanced financials table if it doesn't exist (kept for older callers)"""
+    ensure_schema(conn)
+
+# ------------------- Bulk Warehouse Writes -------------------
+# Rows are bulk-loaded into a session-scoped temporary table (write_pandas: Parquet PUT + COPY INTO)
+# and merged with one set-based statement, so query text no longer grows with the row count.
+SNOWFLAKE_WRITE_BATCH_ROWS = int(os.getenv("SNOWFLAKE_WRITE_BATCH_ROWS", "50000"))
+QUARTERLY_STAGE_TABLE = "FINANCIALS_QUARTERLY_STAGE"
+QUARTERLY_ROW_COLUMNS = ["STOCK_CODE", "METRIC", "QUARTER", "VALUE", "INDUSTRY", "CATEGORY", "METRIC_CATEGORY",
+                         "SOURCE_SECTION"]
+QUARTERLY_KEY_COLUMNS = ["STOCK_CODE", "METRIC", "QUARTER"]
+# Everything a MERGE would write for an existing key; a row whose hash of these is unchanged
+# is skipped so refreshes don't rewrite micro-partitions for identical data
+QUARTERLY_HASHED_COLUMNS = ["VALUE", "INDUSTRY", "CATEGORY", "METRIC_CATEGORY", "SOURCE_SECTION"]
+# Typed copies of VALUE and QUARTER, derived by the loader and cast by the MERGE
+QUARTERLY_TYPED_COLUMNS = ["VALUE_NUM", "PERIOD_DATE", "PERIOD_ORDINAL"]
+QUARTERLY_STAGE_COLUMNS = QUARTERLY_ROW_COLUMNS + QUARTERLY_TYPED_COLUMNS + ["ROW_HASH"]
+
+try:
+    from snowflake.connector.pandas_tools import write_pandas
+    WRITE_PANDAS_AVAILABLE = True
+except ImportError:  # connector installed without the [pandas] extra
+    WRITE_PANDAS_AVAILABLE = False
+
+QUARTERLY_MERGE_SQL = f"""
+    MERGE INTO FINANCIALS_QUARTERLY AS tgt
+    USING {QUARTERLY_STAGE_TABLE} AS src
+    ON tgt.STOCK_CODE = src.STOCK_CODE 
+       AND tgt.METRIC = src.METRIC 
+       AND tgt.QUARTER = src.QUARTER
+    WHEN MATCHED AND tgt.ROW_HASH IS DISTINCT FROM src.ROW_HASH THEN 
+        UPDATE SET 
+            VALUE = src.VALUE,
+            INDUSTRY = src.INDUSTRY,
+            CATEGORY = src.CATEGORY,
+            METRIC_CATEGORY = src.METRIC_CATEGORY,
+            SOURCE_SECTION = NULLIF(src.SOURCE_SECTION, ''),
+            VALUE_NUM = TRY_TO_NUMBER(src.VALUE_NUM, 38, 8),
+            PERIOD_DATE = TRY_TO_DATE(src.PERIOD_DATE),
+            PERIOD_ORDINAL = TRY_TO_NUMBER(src.PERIOD_ORDINAL),
+            ROW_HASH = src.ROW_HASH,
+            UPDATED_AT = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN 
+        INSERT (STOCK_CODE, METRIC, QUARTER, VALUE, INDUSTRY, CATEGORY, METRIC_CATEGORY, SOURCE_SECTION, VALUE_NUM,
+                PERIOD_DATE, PERIOD_ORDINAL, ROW_HASH)
+        VALUES (src.STOCK_CODE, src.METRIC, src.QUARTER, src.VALUE, src.INDUSTRY, src.CATEGORY, src.METRIC_CATEGORY,
+                NULLIF(src.SOURCE_SECTION, ''), TRY_TO_NUMBER(src.VALUE_NUM, 38, 8), TRY_TO_DATE(src.PERIOD_DATE),
+                TRY_TO_NUMBER(src.PERIOD_ORDINAL), src.ROW_HASH)
+"""
+
+def quarterly_rows(stock_code: str, financials: Dict, quarters: List, category: str, industry: str) -> List[Tuple]:
+    """Flatten one stock's metrics into FINANCIALS_QUARTERLY rows, skipping empty values.
+    SOURCE_SECTION comes from an ExtractedFinancials; it's '' (stored as NULL) otherwise."""
+    rows = []
+    sections = getattr(financials, "sections", {})
+    for metric, values in financials.items():
+        metric_category = categorize_metric(metric)
+        source_section = sections.get(metric, "")
+        for i, quarter in enumerate(quarters):
+            value = values[i] if i < len(values) else ""
+            if value:  # Only insert non-empty values
+                rows.append((stock_code, metric, quarter, value, industry, category, metric_category, source_section))
+    return rows
+
+@contextmanager
+def warehouse_transaction(conn):
+    """Run the block as one explicit transaction: autocommit off, BEGIN ... COMMIT, ROLLBACK on error.
+
+    Pooled connections autocommit, and Snowflake also commits the open transaction before any
+    DDL (CREATE of a temporary table included, and the temporary stage the connector uploads
+    large executemany binds through), so the block must be set-based DML only; stage rows
+    before entering.
+    """
+    conn.autocommit(False)
+    try:
+        conn.cursor().execute("BEGIN")
+        try:
+            yield
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.autocommit(True)
+
+def _create_string_table(conn, table: str, columns: List[str]):
+    """(Re)create an empty temporary `table` of STRING columns (DDL: not inside a transaction)"""
+    column_types = ", ".join(f"{column} STRING" for column in columns)
+    conn.cursor().execute(f"CREATE OR REPLACE TEMPORARY TABLE {table} ({column_types})")
+
+def _insert_string_rows(conn, frame: pd.DataFrame, table: str, batch_rows: int):
+    """Append `frame` to an existing `table` with bound multi-row INSERTs (DML only)"""
+    # Slower than COPY, but still no literal SQL growth
+    placeholders = ", ".join(["%s"] * len(frame.columns))
+    insert_sql = f"INSERT INTO {table} ({', '.join(frame.columns)}) VALUES ({placeholders})"
+    records = list(frame.itertuples(index=False, name=None))
+    cur = conn.cursor()
+    for offset in range(0, len(records), batch_rows):
+        cur.executemany(insert_sql, records[offset:offset + batch_rows])
+
+def _stage_string_frame(conn, frame: pd.DataFrame, table: str, batch_rows: int):
+    """Load `frame` (all string columns) into a fresh temporary `table` on this connection's session"""
+    _create_string_table(conn, table, list(frame.columns))
+
+    if WRITE_PANDAS_AVAILABLE:
+        success, _, staged, _ = write_pandas(conn, frame, table, chunk_size=batch_rows, compression="snappy")
+        if not success or staged != len(frame):
+            raise RuntimeError(f"Staged {staged} of {len(frame)} rows into {table}")
+        return
+    _insert_string_rows(conn, frame, table, batch_rows)
+
+def period_end_dates(quarters: pd.Series) -> pd.Series:
+    """'Mar 2024' -> '2024-03-31' (ISO month end); '' for labels that aren't a month and year"""
+    parsed = pd.to_datetime(quarters, format=PERIOD_LABEL_FORMAT, errors="coerce") + pd.offsets.MonthEnd(0)
+    return parsed.dt.strftime("%Y-%m-%d").fillna("")
+
+def numeric_values(values: pd.Series) -> pd.Series:
+    """Cleaned VALUE strings that parse as numbers, '' otherwise"""
+    return values.where(pd.to_numeric(values, errors="coerce").notna(), "")
+
+def quarterly_row_hashes(frame: pd.DataFrame) -> pd.Series:
+    """Content hash of the non-key columns of each row"""
+    joined = frame[QUARTERLY_HASHED_COLUMNS].astype(str).agg("\x1f".join, axis=1)
+    return joined.map(lambda text: hashlib.sha1(text.encode("utf-8")).hexdigest())
+
+def stored_row_hashes(conn, stock_codes: List[str]) -> pd.DataFrame:
+    """ROW_HASH of every stored row for `stock_codes` (NULL for rows written before hashing)"""
+    columns = QUARTERLY_KEY_COLUMNS + ["STORED_HASH"]
+    if not stock_codes:
+        return pd.DataFrame(columns=columns)
+    placeholders = ", ".join(["%s"] * len(stock_codes))
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT STOCK_CODE, METRIC, QUARTER, ROW_HASH
+        FROM FINANCIALS_QUARTERLY
+        WHERE STOCK_CODE IN ({placeholders})
+    """, list(stock_codes))
+    return pd.DataFrame(cur.fetchall(), columns=columns)
+
+def stale_snapshot_stocks(conn, stock_codes: Optional[List[str]] = None) -> List[str]:
+    """Stocks among `stock_codes` (default: every stored stock) with stored rows but no
+    snapshot, or one older than their newest row (e.g. written before the refresh shared the
+    MERGE's transaction, or loaded before snapshots existed)"""
+    if stock_codes is not None and not stock_codes:
+        return []
+    where = f"WHERE q.STOCK_CODE IN ({', '.join(['%s'] * len(stock_codes))})" if stock_codes else ""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT q.STOCK_CODE
+        FROM FINANCIALS_QUARTERLY q
+        LEFT JOIN FINANCIALS_SNAPSHOT s ON s.STOCK_CODE = q.STOCK_CODE
+        {where}
+        GROUP BY q.STOCK_CODE, s.UPDATED_AT
+        HAVING s.UPDATED_AT IS NULL OR MAX(q.UPDATED_AT) > s.UPDATED_AT
+        ORDER BY q.STOCK_CODE
+    """, list(stock_codes or []))
+    return [row[0] for row in cur.fetchall()]
+
+def bulk_merge_quarterly(conn, rows: Union[List[Tuple], pd.DataFrame], batch_rows: Optional[int] = None,
+                         skip_unchanged: bool = True) -> Dict[str, int]:
+    """Stage `rows` (any number of stocks) and MERGE them into FINANCIALS_QUARTERLY in one statement.
+
+    `rows` is a list of row tuples or a frame with QUARTERLY_ROW_COLUMNS. With `skip_unchanged`,
+    rows whose stored ROW_HASH already matches are dropped before staging. The MERGE and the
+    rebuild of the changed stocks' snapshots and derived features commit as one transaction,
+    which rolls back as a whole on failure. Stocks whose snapshot is missing or older than
+    their rows are rebuilt too, even when none of their rows changed. Returns
+    {"written": n, "skipped": n, "stocks": [codes written], "rebuilt": [stale codes rebuilt]}.
+    """
+    if len(rows) == 0:
+        return {"written": 0, "skipped": 0, "stocks": [], "rebuilt": []}
+    batch_rows = batch_rows or SNOWFLAKE_WRITE_BATCH_ROWS
+    start = time.monotonic()
+
+    frame = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows, columns=QUARTERLY_ROW_COLUMNS)
+    frame = frame[QUARTERLY_ROW_COLUMNS].astype(str)
+    # MERGE rejects sources with duplicate keys; the last value scraped wins
+    frame = frame.drop_duplicates(subset=QUARTERLY_KEY_COLUMNS, keep="last")
+    frame["VALUE_NUM"] = numeric_values(frame["VALUE"])
+    frame["PERIOD_DATE"] = period_end_dates(frame["QUARTER"])
+    frame["PERIOD_ORDINAL"] = period_ordinals(frame["QUARTER"]).astype("string").fillna("")
+    frame["ROW_HASH"] = quarterly_row_hashes(frame)
+    total = len(frame)
+    input_frame = frame
+    input_stocks = frame["STOCK_CODE"].unique().tolist()
+
+    if skip_unchanged:
+        stored = stored_row_hashes(conn, input_stocks)
+        merged = frame.merge(stored, on=QUARTERLY_KEY_COLUMNS, how="left")
+        frame = merged.loc[merged["STORED_HASH"] != merged["ROW_HASH"], QUARTERLY_STAGE_COLUMNS]
+    changed_stocks = frame["STOCK_CODE"].unique().tolist()
+    stale_stocks = [code for code in stale_snapshot_stocks(conn, input_stocks) if code not in set(changed_stocks)]
+    if frame.empty and not stale_stocks:
+        logger.info(f"📦 All {total} rows unchanged; nothing to merge")
+        return {"written": 0, "skipped": total, "stocks": [], "rebuilt": []}
+    if stale_stocks:
+        logger.warning(f"🩹 Rebuilding stale snapshots for {len(stale_stocks)} unchanged stocks")
+    refresh_stocks = changed_stocks + stale_stocks
+
+    # Staging is DDL and COPY into session temp tables (as is the connector's upload of large
+    # executemany binds), so the rows and everything derived from them are staged before the
+    # transaction, the derived rows computed from the stored values overlaid with the staged ones
+    if not frame.empty:
+        _stage_string_frame(conn, frame, QUARTERLY_STAGE_TABLE, batch_rows)
+    stage_derived(conn, refresh_stocks, pending_merge=not frame.empty)
+    staged = time.monotonic() - start
+    # One transaction of set-based DML, so readers never see rows and snapshot out of step
+    with warehouse_transaction(conn):
+        if not frame.empty:
+            conn.cursor().execute(QUARTERLY_MERGE_SQL)
+        apply_derived(conn, refresh_stocks)
+    categories = input_frame.loc[input_frame["STOCK_CODE"].isin(refresh_stocks), "CATEGORY"].unique()
+    PAYLOAD_CACHE.invalidate_tags([f"stock:{code}" for code in refresh_stocks] +
+                                  [f"category:{category.lower()}" for category in categories])
+
+    elapsed = time.monotonic() - start
+    rate = len(frame) / elapsed if elapsed > 0 else float("inf")
+    logger.info(f"📦 Merged {len(frame)} rows, skipped {total - len(frame)} unchanged, in {elapsed:.2f}s "
+                f"({rate:,.0f} rows/s; staging {staged:.2f}s, "
+                f"{'write_pandas' if WRITE_PANDAS_AVAILABLE else 'executemany'})")
+    return {"written": len(frame), "skipped": total - len(frame), "stocks": changed_stocks,
+            "rebuilt": stale_stocks}
+
+# ------------------- Columnar Pivot -------------------
+# Display rows are pivoted in pandas/numpy instead of nested dict loops: rows are scattered
+# into one (row label x quarter) matrix by factorized codes, and the whole matrix is formatted
+# to strings in a few vectorized passes. Builds the stock snapshots (quarterly_view and
+# visualize) and the sector view. Query results are consumed one Arrow result batch at a
+# time: each batch is reduced to integer codes and a float column before the next is
+# downloaded, so peak memory is one batch plus ~14 bytes per row rather than the whole
+# result as Python tuples. The original loops are kept as *_reference for
+# `--benchmark-pivot`, which also checks both produce identical payloads.
+PIVOT_COLUMNS = ["STOCK_CODE", "METRIC", "QUARTER", "VALUE_NUM", "METRIC_CATEGORY", "PERIOD_ORDINAL"]
+# Values are formatted as integers scaled to VALUE_NUM's 8 decimal places; the rare value
+# too large for int64 at that scale is formatted on its own
+PIVOT_VALUE_SCALE = 10 ** 8
+PIVOT_FAST_FORMAT_LIMIT = 9e10
+# float64 holds ~16 significant digits, so an 8-decimal value formats exactly from its float
+# only below this magnitude; larger stored values are formatted from their Decimal instead
+PIVOT_EXACT_FLOAT_LIMIT = 1e7
+
+# Row chunk size when the result isn't available as Arrow batches
+SNOWFLAKE_FETCH_CHUNK_ROWS = int(os.getenv("SNOWFLAKE_FETCH_CHUNK_ROWS", "50000"))
+
+class FetchStats:
+    """Rows, batches, bytes and download time of one streamed query result"""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.rows = 0
+        self.batches = 0
+        self.bytes = 0
+        self.fetch_seconds = 0.0
+        self.arrow = False
+        self._start = time.monotonic()
+
+    def add(self, rows: int, size: int, seconds: float):
+        self.rows += rows
+        self.batches += 1
+        self.bytes += size
+        self.fetch_seconds += seconds
+
+    def summary(self) -> Dict:
+        return {
+            "rows": self.rows,
+            "batches": self.batches,
+            "mb": round(self.bytes / 1024 / 1024, 2),
+            "fetch_s": round(self.fetch_seconds, 3),
+            "total_s": round(time.monotonic() - self._start, 3),
+            "arrow": self.arrow,
+        }
+
+# Per-route fetch totals and the most recent request, shown on /diagnostic
+RESULT_FETCH_REPORT: Dict[str, Dict] = {}
+_RESULT_FETCH_LOCK = threading.Lock()
+
+def record_fetch(stats: FetchStats, detail: str = ""):
+    """Log one request's fetch and fold it into RESULT_FETCH_REPORT"""
+    summary = stats.summary()
+    logger.info(f"📥 {stats.route}{f' {detail}' if detail else ''}: {summary['rows']} rows in "
+                f"{summary['batches']} {'Arrow' if stats.arrow else 'row'} batches, {summary['mb']} MB, "
+                f"fetched in {summary['fetch_s']}s ({summary['total_s']}s total)")
+    with _RESULT_FETCH_LOCK:
+        route = RESULT_FETCH_REPORT.setdefault(stats.route, {"requests": 0, "rows": 0, "mb": 0.0, "fetch_s": 0.0,
+                                                              "max_rows": 0, "max_mb": 0.0})
+        route["requests"] += 1
+        route["rows"] += summary["rows"]
+        route["mb"] = round(route["mb"] + summary["mb"], 2)
+        route["fetch_s"] = round(route["fetch_s"] + summary["fetch_s"], 3)
+        route["max_rows"] = max(route["max_rows"], summary["rows"])
+        route["max_mb"] = max(route["max_mb"], summary["mb"])
+        route["last"] = summary
+
+def result_fetch_report() -> Dict[str, Dict]:
+    with _RESULT_FETCH_LOCK:
+        return {route: dict(totals) for route, totals in RESULT_FETCH_REPORT.items()}
+
+def iter_result_frames(cur, columns: List[str], stats: FetchStats) -> Iterator[pd.DataFrame]:
+    """Yield the executed query's result one DataFrame at a time.
+
+    Uses the connector's Arrow result batches, each downloaded only when reached; falls back
+    to fetchmany() chunks when the result isn't Arrow (or the connector lacks pandas support).
+    """
     try:
-        # Look for per share data in various sections
-        data = {}
-        
-        # Check for per share ratios or metrics
-        for section in soup.find_all("section"):
-            tables = section.find_all("table")
-            for table in tables:
-                for row in table.select("tbody tr"):
-                    cols = row.find_all("td")
-                    if len(cols) >= 2:
-                        metric = clean_metric_name(cols[0].get_text())
-                        
-                        # Check if this is a per share metric
-                        if any(keyword in metric.lower() for keyword in ['per share', 'eps', 'book value', 'dividend']):
-                            if len(cols) >= len(quarters) + 1:
-                                values = [clean_value(td.get_text()) for td in cols[1:len(quarters)+1]]
-                            else:
-                                # Handle single value metrics
-                                values = [clean_value(cols[1].get_text())] + [""] * (len(quarters) - 1)
-                            
-                            if any(v for v in values):
-                                data[metric] = values
-        
-        if data:
-            logger.info(f"📈 Extracted {len(data)} per share metrics for {stock_code}")
-        return data
-        
-    except Exception as e:
-        logger.warning(f"Could not extract per share data for {stock_code}: {e}")
+        batches = cur.get_result_batches()
+    except (AttributeError, NotSupportedError):
+        batches = None
+
+    for batch in batches or []:
+        start = time.monotonic()
+        try:
+            table = batch.to_arrow()
+        except NotSupportedError:
+            if stats.batches:
+                raise
+            break  # JSON result format; read rows from the cursor instead
+        frame = _narrow_decimals(table).to_pandas()
+        stats.arrow = True
+        stats.add(len(frame), batch.uncompressed_size or table.nbytes, time.monotonic() - start)
+        if len(frame):
+            frame.columns = columns
+            yield frame
+    if stats.arrow:
+        return
+
+    while True:
+        start = time.monotonic()
+        rows = cur.fetchmany(SNOWFLAKE_FETCH_CHUNK_ROWS)
+        if not rows:
+            break
+        frame = pd.DataFrame(rows, columns=columns)
+        stats.add(len(frame), int(frame.memory_usage(index=False, deep=True).sum()), time.monotonic() - start)
+        yield frame
+
+def _narrow_decimals(table):
+    """Arrow decimal columns whose values are all below PIVOT_EXACT_FLOAT_LIMIT become float64
+    (cheap, and exact for format_numbers); a column holding any larger value stays Decimal"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    for position, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            as_float = pc.cast(table.column(position), pa.float64())
+            peak = pc.max(pc.abs(as_float)).as_py()
+            if peak is None or peak < PIVOT_EXACT_FLOAT_LIMIT:
+                table = table.set_column(position, field.name, as_float)
+    return table
+
+def _as_frames(rows) -> Iterable[pd.DataFrame]:
+    """A frame, a list of PIVOT_COLUMNS tuples, or an iterable of frames, as an iterable of frames"""
+    if isinstance(rows, pd.DataFrame):
+        return [rows]
+    if isinstance(rows, list):
+        return [pd.DataFrame(rows, columns=PIVOT_COLUMNS)] if rows else []
+    return rows
+
+def format_numbers(values: np.ndarray) -> np.ndarray:
+    """Vectorized format_number over a float array (NaN = missing).
+
+    Same text as the Decimal path for values below PIVOT_EXACT_FLOAT_LIMIT; beyond that a float
+    can't carry all 8 decimals, so PivotAccumulator formats those from the Decimal itself.
+    Each distinct value is formatted once, so repeated values also share one string object.
+    """
+    values = np.asarray(values, dtype=float)
+    codes, distinct = pd.factorize(values.ravel())
+    fast = np.abs(distinct) < PIVOT_FAST_FORMAT_LIMIT
+    text = np.empty(len(distinct) + 1, dtype=object)
+    text[-1] = ""  # factorize codes missing values as -1
+
+    if fast.any():
+        fast_values = distinct[fast]
+        scaled = np.rint(np.abs(fast_values) * PIVOT_VALUE_SCALE).astype(np.int64)
+        whole, fraction = np.divmod(scaled, PIVOT_VALUE_SCALE)
+        fraction_text = np.char.rstrip(np.char.zfill(fraction.astype(str), 8), "0")
+        digits = np.char.add(whole.astype(str),
+                             np.where(fraction_text == "", "", np.char.add(".", fraction_text)))
+        text[:-1][fast] = np.where((fast_values < 0) & (scaled > 0), np.char.add("-", digits), digits)
+
+    for index in np.flatnonzero(~fast):
+        text[index] = format_number(Decimal(repr(float(distinct[index]))))
+    return text[codes].reshape(values.shape)
+
+class PivotAccumulator:
+    """Builds the pivot of VALUE_NUM by `index_columns` x QUARTER from frames added one at a time.
+
+    Each frame is reduced to a global row code, quarter code and float value per row, so only
+    those compact arrays are kept between batches, plus the original Decimal of any value too
+    large to format exactly from its float.
+    """
+
+    def __init__(self, index_columns: List[str]):
+        self.index_columns = index_columns
+        self._key_ids: Dict[Tuple, int] = {}
+        self._quarter_ids: Dict[str, int] = {}
+        self._quarter_ordinals: List[Optional[int]] = []
+        self._rows: List[np.ndarray] = []
+        self._columns: List[np.ndarray] = []
+        self._values: List[np.ndarray] = []
+        self._exact: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+
+    def add(self, frame: pd.DataFrame):
+        if frame.empty:
+            return
+        # Combine per-column codes into one integer key rather than hashing tuples of strings;
+        # only this batch's distinct keys are looked up in the running key -> row map
+        combined = np.zeros(len(frame), dtype=np.int64)
+        for column in self.index_columns:
+            ids, distinct = pd.factorize(frame[column], use_na_sentinel=False)
+            combined = combined * len(distinct) + ids
+        local_codes, _ = pd.factorize(combined)
+        first_rows = pd.Series(local_codes).drop_duplicates().index
+        local_keys = frame[self.index_columns].iloc[first_rows].itertuples(index=False, name=None)
+        row_ids = np.fromiter((self._key_ids.setdefault(key, len(self._key_ids)) for key in local_keys),
+                              dtype=np.int64, count=len(first_rows))
+
+        label_ids, labels = pd.factorize(frame["QUARTER"])
+        first_rows = pd.Series(label_ids).drop_duplicates().index
+        ordinals = pd.to_numeric(frame["PERIOD_ORDINAL"].iloc[first_rows], errors="coerce").tolist()
+        quarter_ids = np.array([self._quarter_id(label, ordinal) for label, ordinal in zip(labels, ordinals)],
+                               dtype=np.int64)
+
+        rows = row_ids[local_codes].astype(np.int32)
+        columns = quarter_ids[label_ids].astype(np.int16)
+        values = pd.to_numeric(frame["VALUE_NUM"], errors="coerce").to_numpy(dtype=float)
+        self._rows.append(rows)
+        self._columns.append(columns)
+        self._values.append(values)
+        if frame["VALUE_NUM"].dtype == object:
+            wide = np.flatnonzero(np.abs(values) >= PIVOT_EXACT_FLOAT_LIMIT)
+            if len(wide):
+                self._exact.append((rows[wide], columns[wide], values[wide], frame["VALUE_NUM"].to_numpy()[wide]))
+
+    def _quarter_id(self, label: str, ordinal) -> int:
+        quarter_id = self._quarter_ids.get(label)
+        if quarter_id is None:
+            quarter_id = self._quarter_ids[label] = len(self._quarter_ids)
+            self._quarter_ordinals.append(None if pd.isna(ordinal) else int(ordinal))
+        return quarter_id
+
+    def result(self) -> Tuple[pd.DataFrame, List[str], List[Optional[int]], np.ndarray, np.ndarray]:
+        """Returns the distinct index rows (in first-seen order, i.e. the query's ORDER BY), the
+        quarters in chronological order (by their stored PERIOD_ORDINAL) and those ordinals, the
+        formatted (rows x quarters) value matrix with "" for missing cells, and a matrix marking
+        which cells had a row at all. If a key appears twice, the last value wins."""
+        keys = pd.DataFrame(list(self._key_ids), columns=self.index_columns)
+        labels = list(self._quarter_ids)
+        order = sorted(range(len(labels)), key=lambda i: period_sort_key(labels[i], self._quarter_ordinals[i]))
+        position = np.empty(len(labels), dtype=np.int64)
+        position[order] = np.arange(len(labels))
+
+        matrix = np.full((len(keys), len(labels)), np.nan)
+        present = np.zeros(matrix.shape, dtype=bool)
+        for rows, columns, values in zip(self._rows, self._columns, self._values):
+            matrix[rows, position[columns]] = values
+            present[rows, position[columns]] = True
+        text = format_numbers(matrix)
+        for rows, columns, floats, originals in self._exact:
+            for row, column, value, original in zip(rows, position[columns], floats, originals):
+                if matrix[row, column] == value:  # not overwritten by a later duplicate
+                    text[row, column] = format_number(original)
+        return keys, [labels[i] for i in order], [self._quarter_ordinals[i] for i in order], text, present
+
+def pivot_values(rows, index_columns: List[str]) -> Tuple[pd.DataFrame, List[str], List[Optional[int]],
+                                                          np.ndarray, np.ndarray]:
+    """Pivot VALUE_NUM by `index_columns` x QUARTER over a frame, rows or frames (see PivotAccumulator)"""
+    accumulator = PivotAccumulator(index_columns)
+    for frame in _as_frames(rows):
+        accumulator.add(frame)
+    return accumulator.result()
+
+def _categorized(categories: List, labels: List, value_rows: List[List[str]]) -> Dict[str, Dict[str, List[str]]]:
+    categorized = {}
+    for category, label, values in zip(categories, labels, value_rows):
+        categorized.setdefault(category, {})[label] = values
+    return categorized
+
+def pivot_sector(rows) -> Tuple[List[str], Dict[str, Dict[str, List[str]]]]:
+    """Sector view pivot: one "<stock> - <metric>" row per stock metric, grouped by metric category.
+    `rows` is a frame, a list of PIVOT_COLUMNS tuples or an iterable of frames."""
+    keys, quarters, _, text, _ = pivot_values(rows, ["METRIC_CATEGORY", "STOCK_CODE", "METRIC"])
+    if keys.empty:
+        return [], {}
+    labels = (keys["STOCK_CODE"].astype(str) + " - " + keys["METRIC"].astype(str)).tolist()
+    return quarters, _categorized(keys["METRIC_CATEGORY"].tolist(), labels, text.tolist())
+
+def pivot_sector_reference(rows: List[Tuple]) -> Tuple[List[str], Dict[str, Dict[str, List[str]]]]:
+    """Original dict-of-dicts sector pivot, kept for --benchmark-pivot"""
+    sector_data = {}
+    ordinals = {}
+    for stock, metric, quarter, value, metric_category, ordinal in rows:
+        ordinals[quarter] = ordinal
+        sector_data.setdefault((stock, metric, metric_category), {})[quarter] = value
+
+    quarters = sorted(ordinals, key=lambda q: period_sort_key(q, ordinals[q]))
+    categorized_data = {}
+    for (stock, metric, metric_category), quarter_data in sector_data.items():
+        categorized_data.setdefault(metric_category, {})[f"{stock} - {metric}"] = [
+            format_number(quarter_data.get(q)) for q in quarters
+        ]
+    return quarters, categorized_data
+
+def synthetic_quarterly_frame(stocks: int = 500, metrics: int = 300, quarters: int = 40,
+                              missing: float = 0.05, decimals: bool = False, seed: int = 0) -> pd.DataFrame:
+    """PIVOT_COLUMNS rows for `stocks` x `metrics` x `quarters`, ordered like the snapshot query
+    (stock, metric category, metric), with a `missing` fraction of cells dropped"""
+    rng = np.random.default_rng(seed)
+    categories = list(METRIC_CATEGORY_PATTERNS)
+    metric_list = sorted(((categories[i % len(categories)], f"Metric {i:03d}") for i in range(metrics)))
+    year, month, labels = 2024, 12, []
+    for _ in range(quarters):
+        labels.append(datetime.date(year, month, 1).strftime(PERIOD_LABEL_FORMAT))
+        year, month = (year - 1, 12) if month == 3 else (year, month - 3)
+    labels.reverse()
+    ordinals = [int(ordinal) for ordinal in period_ordinals(pd.Series(labels))]
+
+    cells = stocks * metrics * quarters
+    values = np.round(rng.normal(0, 1000, cells), 2)
+    frame = pd.DataFrame({
+        "STOCK_CODE": np.repeat(np.array([f"STK{i:04d}" for i in range(stocks)], dtype=object), metrics * quarters),
+        "METRIC": np.tile(np.repeat(np.array([m for _, m in metric_list], dtype=object), quarters), stocks),
+        "QUARTER": np.tile(np.array(labels, dtype=object), stocks * metrics),
+        "VALUE_NUM": [Decimal(f"{value:.2f}") for value in values] if decimals else values,
+        "METRIC_CATEGORY": np.tile(np.repeat(np.array([c for c, _ in metric_list], dtype=object), quarters), stocks),
+        "PERIOD_ORDINAL": np.tile(np.array(ordinals, dtype=object), stocks * metrics),
+    })
+    return frame[rng.random(cells) >= missing].reset_index(drop=True)
+
+def benchmark_pivot(stocks: int = 500, metrics: int = 300, quarters: int = 40) -> Dict:
+    """Time the reference and vectorized snapshot and sector pivots on a synthetic table, and check
+    they agree exactly on a small Decimal-valued table"""
+    sample = synthetic_quarterly_frame(12, 40, 8, missing=0.1, decimals=True, seed=1)
+    # Include values past float64's exact range, which must keep all their digits
+    sample.loc[:2, "VALUE_NUM"] = [Decimal("123456789012.12345678"), Decimal("89999999999.99999999"),
+                                   Decimal("-12345678.00000001")]
+    sample_rows = list(sample.itertuples(index=False, name=None))
+    identical = {
+        "snapshots": build_stock_payloads(sample) == build_stock_payloads_reference(sample_rows),
+        "sector": pivot_sector(sample) == pivot_sector_reference(sample_rows),
+    }
+
+    frame = synthetic_quarterly_frame(stocks, metrics, quarters)
+    timings = {}
+
+    def timed(label, func, data):
+        start = time.perf_counter()
+        func(data)
+        timings[label] = time.perf_counter() - start
+
+    # The original pivots consumed fetchall() tuples, where NUMBER(38,8) arrives as Decimal;
+    # the vectorized ones get the float64 column fetch_pandas_all returns
+    rows = [(stock, metric, quarter, Decimal(f"{value:.8f}"), category, period)
+            for stock, metric, quarter, value, category, period in frame.itertuples(index=False, name=None)]
+    timed("snapshots_reference", build_stock_payloads_reference, rows)
+    timed("sector_reference", pivot_sector_reference, rows)
+    del rows
+    timed("snapshots_vectorized", build_stock_payloads, frame)
+    timed("sector_vectorized", pivot_sector, frame)
+    return {
+        "stocks": stocks,
+        "metrics": metrics,
+        "quarters": quarters,
+        "rows": len(frame),
+        **{f"{label}_s": round(elapsed, 2) for label, elapsed in timings.items()},
+        "snapshots_speedup": round(timings["snapshots_reference"] / timings["snapshots_vectorized"], 2),
+        "sector_speedup": round(timings["sector_reference"] / timings["sector_vectorized"], 2),
+        "peak_rss_mb": _peak_rss_mb(),
+        "identical": all(identical.values()),
+        "identical_by_pivot": identical,
+    }
+
+# ------------------- Stock Snapshots -------------------
+# One pre-pivoted row per stock: {"quarters": [...chronological], "ordinals": [PERIOD_ORDINAL
+# per quarter], "categorized": {category: {metric: [value per quarter]}}}, so read routes do a
+# key lookup instead of pivoting rows.
+SNAPSHOT_STAGE_TABLE = "FINANCIALS_SNAPSHOT_STAGE"
+
+SNAPSHOT_MERGE_SQL = f"""
+    MERGE INTO FINANCIALS_SNAPSHOT AS tgt
+    USING {SNAPSHOT_STAGE_TABLE} AS src
+    ON tgt.STOCK_CODE = src.STOCK_CODE
+    WHEN MATCHED THEN
+        UPDATE SET PAYLOAD = PARSE_JSON(src.PAYLOAD), ROW_COUNT = TRY_TO_NUMBER(src.ROW_COUNT),
+                   UPDATED_AT = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN
+        INSERT (STOCK_CODE, PAYLOAD, ROW_COUNT)
+        VALUES (src.STOCK_CODE, PARSE_JSON(src.PAYLOAD), TRY_TO_NUMBER(src.ROW_COUNT))
+"""
+SNAPSHOT_STAGE_COLUMNS = ["STOCK_CODE", "PAYLOAD", "ROW_COUNT"]
+
+# Stored values the snapshots and features are derived from
+DERIVED_SOURCE_COLUMNS = PIVOT_COLUMNS + ["SOURCE_SECTION"]
+DERIVED_SOURCE_SQL = """
+    SELECT STOCK_CODE, METRIC, QUARTER, VALUE_NUM, METRIC_CATEGORY, PERIOD_ORDINAL, SOURCE_SECTION
+    FROM FINANCIALS_QUARTERLY
+    WHERE STOCK_CODE IN ({placeholders}) AND VALUE_NUM IS NOT NULL
+    ORDER BY STOCK_CODE, METRIC_CATEGORY, METRIC
+"""
+# The same values as they will be once QUARTERLY_MERGE_SQL has run: staged rows replace the
+# stored rows they match, cast the way the MERGE casts them
+PENDING_DERIVED_SOURCE_SQL = f"""
+    SELECT STOCK_CODE, METRIC, QUARTER, VALUE_NUM, METRIC_CATEGORY, PERIOD_ORDINAL, SOURCE_SECTION
+    FROM (
+        SELECT q.STOCK_CODE, q.METRIC, q.QUARTER, q.VALUE_NUM, q.METRIC_CATEGORY, q.PERIOD_ORDINAL,
+               q.SOURCE_SECTION
+        FROM FINANCIALS_QUARTERLY q
+        WHERE q.STOCK_CODE IN ({{placeholders}})
+          AND NOT EXISTS (SELECT 1 FROM {QUARTERLY_STAGE_TABLE} src
+                          WHERE src.STOCK_CODE = q.STOCK_CODE AND src.METRIC = q.METRIC
+                            AND src.QUARTER = q.QUARTER)
+        UNION ALL
+        SELECT STOCK_CODE, METRIC, QUARTER, TRY_TO_NUMBER(VALUE_NUM, 38, 8), METRIC_CATEGORY,
+               TRY_TO_NUMBER(PERIOD_ORDINAL), NULLIF(SOURCE_SECTION, '')
+        FROM {QUARTERLY_STAGE_TABLE}
+        WHERE STOCK_CODE IN ({{placeholders}})
+    )
+    WHERE VALUE_NUM IS NOT NULL
+    ORDER BY STOCK_CODE, METRIC_CATEGORY, METRIC
+"""
+
+def build_stock_payloads(rows: Union[List[Tuple], pd.DataFrame, Iterable[pd.DataFrame]]) -> Dict[str, Dict]:
+    """Pivot PIVOT_COLUMNS rows (a list of tuples, a frame or an iterable of frames), ordered by
+    stock, metric category and metric, into one display payload per stock (only the quarters
+    that stock has)"""
+    keys, quarters, ordinals, text, present = pivot_values(rows, ["STOCK_CODE", "METRIC_CATEGORY", "METRIC"])
+    if keys.empty:
         return {}
+    key_positions = pd.Series(np.arange(len(keys))).groupby(keys["STOCK_CODE"].to_numpy(), sort=False).indices
+    categories = keys["METRIC_CATEGORY"].to_numpy()
+    metrics = keys["METRIC"].to_numpy()
 
-# ------------------- Enhanced Snowflake Integration -------------------
-def snowflake_connect():
-    """Create Snowflake connection with better error handling"""
-    try:
-        logger.info("Connecting to Snowflake...")
-        
-        # Validate environment variables
-        required_vars = ["SNOWFLAKE_USER", "SNOWFLAKE_PASSWORD", "SNOWFLAKE_ACCOUNT"]
-        for var in required_vars:
-            if not os.getenv(var):
-                raise ValueError(f"Missing required environment variable: {var}")
-        
-        conn = snowflake.connector.connect(
-            user=os.getenv("SNOWFLAKE_USER"),
-            password=os.getenv("SNOWFLAKE_PASSWORD"),
-            account=os.getenv("SNOWFLAKE_ACCOUNT"),
-            warehouse='SNOWFLAKE_LEARNING_WH',
-            database='STOCK_DB',
-            schema='STOCK_SOURCE',
-            client_session_keep_alive=True
-        )
-        
-        logger.info("✅ Snowflake connection established")
-        return conn
-        
-    except Exception as e:
-        logger.error(f"❌ Snowflake connection failed: {e}")
-        raise
+    payloads = {}
+    for stock_code, positions in key_positions.items():
+        stock_present = present[positions]
+        columns = np.flatnonzero(stock_present.any(axis=0))
+        payloads[stock_code] = {
+            "quarters": [quarters[column] for column in columns],
+            "ordinals": [ordinals[column] for column in columns],
+            "categorized": _categorized(categories[positions].tolist(), metrics[positions].tolist(),
+                                        text[np.ix_(positions, columns)].tolist()),
+            "row_count": int(stock_present.sum()),
+        }
+    return payloads
 
-def create_snowflake_table():
-    """Create the enhanced financials table if it doesn't exist"""
-    try:
-        conn = snowflake_connect()
-        cur = conn.cursor()
-        
-        logger.info("📋 Creating/checking enhanced Snowflake table...")
-        
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS FINANCIALS_QUARTERLY (
-                STOCK_CODE STRING,
-                METRIC STRING,
-                QUARTER STRING,
-                VALUE STRING,
-                INDUSTRY STRING,
-                CATEGORY STRING,
-                METRIC_CATEGORY STRING,
-                DATA_SOURCE STRING DEFAULT 'SCREENER',
-                CREATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
-                UPDATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP()
-            )
-        """)
-        
-        conn.commit()
-        conn.close()
-        logger.info("✅ Enhanced table created/verified successfully")
-        
-    except Exception as e:
-        logger.error(f"❌ Error creating table: {e}")
-        raise
+def build_stock_payloads_reference(rows: List[Tuple]) -> Dict[str, Dict]:
+    """Original dict-of-dicts snapshot pivot, kept for --benchmark-pivot"""
+    per_stock = {}
+    for stock_code, metric, quarter, value, metric_category, ordinal in rows:
+        entry = per_stock.setdefault(stock_code, {"metrics": {}, "periods": {}, "rows": 0})
+        entry["metrics"].setdefault((metric_category, metric), {})[quarter] = value
+        entry["periods"][quarter] = ordinal
+        entry["rows"] += 1
+
+    payloads = {}
+    for stock_code, entry in per_stock.items():
+        periods = entry["periods"]
+        quarters = sorted(periods, key=lambda q: period_sort_key(q, periods[q]))
+        ordinals = [None if pd.isna(periods[q]) else int(periods[q]) for q in quarters]
+        categorized = {}
+        for (metric_category, metric), quarter_data in entry["metrics"].items():
+            categorized.setdefault(metric_category, {})[metric] = [format_number(quarter_data.get(q)) for q in quarters]
+        payloads[stock_code] = {"quarters": quarters, "ordinals": ordinals, "categorized": categorized,
+                                "row_count": entry["rows"]}
+    return payloads
+
+def derived_source_frames(conn, stock_codes: List[str], pending_merge: bool = False) -> List[pd.DataFrame]:
+    """DERIVED_SOURCE_COLUMNS frames of the stored values of `stock_codes` (ordered for
+    build_stock_payloads); with `pending_merge`, as they will be after QUARTERLY_MERGE_SQL"""
+    if not stock_codes:
+        return []
+    placeholders = ", ".join(["%s"] * len(stock_codes))
+    if pending_merge:
+        sql, params = PENDING_DERIVED_SOURCE_SQL.format(placeholders=placeholders), list(stock_codes) * 2
+    else:
+        sql, params = DERIVED_SOURCE_SQL.format(placeholders=placeholders), list(stock_codes)
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    stats = FetchStats("derived_source")
+    frames = list(iter_result_frames(cur, DERIVED_SOURCE_COLUMNS, stats))
+    record_fetch(stats, f"({len(stock_codes)} stocks)")
+    return frames
+
+def stage_snapshots(conn, frames: List[pd.DataFrame]) -> Dict[str, Dict]:
+    """Build the snapshots of the stocks in `frames` and bulk-load them into a fresh
+    SNAPSHOT_STAGE_TABLE. DDL, so call it before warehouse_transaction, never inside"""
+    payloads = build_stock_payloads(iter(frames))
+    staged = pd.DataFrame(
+        [(stock_code, json.dumps({key: payload[key] for key in ("quarters", "ordinals", "categorized")}),
+          str(payload["row_count"])) for stock_code, payload in payloads.items()],
+        columns=SNAPSHOT_STAGE_COLUMNS)
+    if staged.empty:
+        _create_string_table(conn, SNAPSHOT_STAGE_TABLE, SNAPSHOT_STAGE_COLUMNS)
+    else:
+        _stage_string_frame(conn, staged, SNAPSHOT_STAGE_TABLE, SNOWFLAKE_WRITE_BATCH_ROWS)
+    return payloads
+
+def stage_derived(conn, stock_codes: List[str], pending_merge: bool = False) -> Dict[str, Dict]:
+    """Compute and stage the snapshots and features of `stock_codes` (see derived_source_frames)
+    ahead of apply_derived, so the transaction itself carries no bulk binds or DDL"""
+    frames = derived_source_frames(conn, stock_codes, pending_merge)
+    payloads = stage_snapshots(conn, frames)
+    stage_features(conn, frames)
+    return payloads
+
+def apply_derived(conn, stock_codes: List[str]):
+    """Swap the staged snapshots and features of `stock_codes` in. DML only, so it runs inside
+    the caller's warehouse_transaction (it doesn't commit)"""
+    conn.cursor().execute(SNAPSHOT_MERGE_SQL)
+    replace_features(conn, stock_codes)
+
+def rebuild_derived(conn, stock_codes: List[str]) -> Dict[str, Dict]:
+    """Rebuild and commit the snapshots and features of `stock_codes` as one transaction"""
+    payloads = stage_derived(conn, stock_codes)
+    with warehouse_transaction(conn):
+        apply_derived(conn, stock_codes)
+    logger.info(f"🗂️ Rebuilt snapshots for {len(payloads)} stocks")
+    return payloads
+
+def load_stock_payload(conn, stock_code: str) -> Optional[Dict]:
+    """Display payload for one stock from its snapshot, or None if it has none.
+
+    A read only: a miss is left to the cold load (whose bulk_merge_quarterly rebuilds missing
+    snapshots) or to --backfill-snapshots, so a page view never issues DDL or writes."""
+    cur = conn.cursor()
+    cur.execute(SNAPSHOT_LOOKUP_SQL, (stock_code,))
+    row = cur.fetchone()
+    if row and row[0]:
+        return json.loads(row[0]) if isinstance(row[0], str) else row[0]
+    return None
+
+def backfill_snapshots(conn, batch_stocks: Optional[int] = None) -> Dict[str, int]:
+    """Rebuild the snapshots and features of stored stocks whose snapshot is missing or stale
+    (e.g. loaded before snapshots existed), committing every `batch_stocks` stocks"""
+    batch_stocks = batch_stocks or FEATURES_REFRESH_BATCH_STOCKS
+    stock_codes = stale_snapshot_stocks(conn)
+    report = {"stocks": len(stock_codes), "snapshots": 0}
+    for offset in range(0, len(stock_codes), batch_stocks):
+        report["snapshots"] += len(rebuild_derived(conn, stock_codes[offset:offset + batch_stocks]))
+    return report
+
+SNOWFLAKE_FLUSH_ROWS = int(os.getenv("SNOWFLAKE_FLUSH_ROWS", "20000"))
+SNOWFLAKE_FLUSH_SECONDS = float(os.getenv("SNOWFLAKE_FLUSH_SECONDS", "60"))
+
+class QuarterlyRowBuffer:
+    """Columnar buffer that accumulates many stocks' rows and merges them in large batches.
+
+    A flush happens when `max_rows` rows are buffered or `max_seconds` have passed since the
+    first unflushed row, whichever comes first. Each flush is one bulk_merge_quarterly call and
+    so one transaction (MERGE plus the snapshot and feature refresh); a load spanning several
+    flushes commits once per flush. If a batch fails it is rolled back as a whole, and its
+    stocks are retried one at a time so a single bad stock doesn't cost the whole batch.
+    """
+
+    def __init__(self, conn, max_rows: int = 20000, max_seconds: float = 60):
+        self.conn = conn
+        self.max_rows = max(1, max_rows)
+        self.max_seconds = max_seconds
+        self.stats = {"flushes": 0, "rows_written": 0, "rows_skipped": 0, "stocks_merged": 0, "stocks_failed": 0}
+        self.failed_stocks: List[str] = []
+        self._reset()
+
+    def _reset(self):
+        self._columns: Dict[str, List] = {column: [] for column in QUARTERLY_ROW_COLUMNS}
+        self._stocks: Dict[str, int] = {}
+        self._started: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._columns["STOCK_CODE"])
+
+    def add(self, stock_code: str, rows: List[Tuple]) -> int:
+        """Buffer one stock's rows; returns rows written if this triggered a flush, else 0"""
+        if not rows:
+            return 0
+        for row in rows:
+            for column, value in zip(QUARTERLY_ROW_COLUMNS, row):
+                self._columns[column].append(value)
+        self._stocks[stock_code] = self._stocks.get(stock_code, 0) + len(rows)
+        if self._started is None:
+            self._started = time.monotonic()
+        if len(self) >= self.max_rows or time.monotonic() - self._started >= self.max_seconds:
+            return self.flush()
+        return 0
+
+    def flush(self) -> int:
+        """Merge everything buffered with a single MERGE; returns rows written"""
+        if not len(self):
+            return 0
+        frame = pd.DataFrame(self._columns)
+        stocks = dict(self._stocks)
+        self._reset()
+        self.stats["flushes"] += 1
+
+        written = skipped = 0
+        try:
+            outcome = bulk_merge_quarterly(self.conn, frame)
+            written, skipped = outcome["written"], outcome["skipped"]
+            self.stats["stocks_merged"] += len(stocks)
+        except Exception as e:
+            # The batch's transaction was rolled back, so nothing of it is committed; should the
+            # failure have been the COMMIT itself, rows that did land hash as unchanged and the
+            # retry skips them rather than merging them twice
+            logger.error(f"❌ Batch merge of {len(stocks)} stocks failed ({e}); retrying stock by stock")
+            for stock_code, group in frame.groupby("STOCK_CODE", sort=False):
+                try:
+                    outcome = bulk_merge_quarterly(self.conn, group)
+                    written += outcome["written"]
+                    skipped += outcome["skipped"]
+                    self.stats["stocks_merged"] += 1
+                except Exception as stock_error:
+                    logger.error(f"❌ Error inserting data for {stock_code}: {stock_error}")
+                    self.stats["stocks_failed"] += 1
+                    self.failed_stocks.append(stock_code)
+
+        self.stats["rows_written"] += written
+        self.stats["rows_skipped"] += skipped
+        logger.info(f"✅ Flushed {len(stocks)} stocks: {written} rows written, {skipped} unchanged")
+        return written
 
 def insert_quarterly_to_snowflake(conn, stock_code: str, financials: Dict, quarters: List, category: str, industry: str):
     """Insert quarterly data with enhanced categorization"""
@@ -1185,90 +4551,163 @@ def insert_quarterly_to_snowflake(conn, stock_code: str, financials: Dict, quart
         return
     
     try:
-        cur = conn.cursor()
-        batch_data = []
-        
-        # Prepare batch data with automatic categorization
-        for metric, values in financials.items():
-            metric_category = categorize_metric(metric)
-            
-            for i, quarter in enumerate(quarters):
-                value = values[i] if i < len(values) else ""
-                
-                if value:  # Only insert non-empty values
-                    batch_data.append((
-                        stock_code, metric, quarter, value, industry, category, metric_category
-                    ))
+        batch_data = quarterly_rows(stock_code, financials, quarters, category, industry)
         
         if not batch_data:
             logger.warning(f"No valid data to insert for {stock_code}")
             return
         
-        # Use batch insert with MERGE for better performance
-        merge_query = """
-            MERGE INTO FINANCIALS_QUARTERLY AS tgt
-            USING (
-                SELECT 
-                    column1 AS STOCK_CODE,
-                    column2 AS METRIC,
-                    column3 AS QUARTER,
-                    column4 AS VALUE,
-                    column5 AS INDUSTRY,
-                    column6 AS CATEGORY,
-                    column7 AS METRIC_CATEGORY
-                FROM VALUES %s
-            ) AS src
-            ON tgt.STOCK_CODE = src.STOCK_CODE 
-               AND tgt.METRIC = src.METRIC 
-               AND tgt.QUARTER = src.QUARTER
-            WHEN MATCHED THEN 
-                UPDATE SET 
-                    VALUE = src.VALUE,
-                    INDUSTRY = src.INDUSTRY,
-                    METRIC_CATEGORY = src.METRIC_CATEGORY,
-                    UPDATED_AT = CURRENT_TIMESTAMP()
-            WHEN NOT MATCHED THEN 
-                INSERT (STOCK_CODE, METRIC, QUARTER, VALUE, INDUSTRY, CATEGORY, METRIC_CATEGORY)
-                VALUES (src.STOCK_CODE, src.METRIC, src.QUARTER, src.VALUE, src.INDUSTRY, src.CATEGORY, src.METRIC_CATEGORY)
-        """
-        
-        # Format data for VALUES clause with proper escaping
-        values_list = []
-        for d in batch_data:
-            escaped_values = [str(val).replace("'", "''") for val in d]
-            values_list.append(f"('{escaped_values[0]}', '{escaped_values[1]}', '{escaped_values[2]}', '{escaped_values[3]}', '{escaped_values[4]}', '{escaped_values[5]}', '{escaped_values[6]}')")
-        
-        values_str = ",".join(values_list)
-        final_query = merge_query % values_str
-        
-        cur.execute(final_query)
-        conn.commit()
-        
-        logger.info(f"✅ Inserted {len(batch_data)} records for {stock_code}")
+        outcome = bulk_merge_quarterly(conn, batch_data)
+        logger.info(f"✅ Inserted {outcome['written']} records for {stock_code} ({outcome['skipped']} unchanged)")
+        return outcome
         
     except Exception as e:
         logger.error(f"❌ Error inserting data for {stock_code}: {e}")
-        conn.rollback()
         raise
 
+# ------------------- Derived Features -------------------
+# Growth and trailing figures per stock x metric x period, precomputed into FINANCIALS_FEATURES
+# by the loader in the same transaction as the snapshots, and only for the stocks whose rows
+# changed. Periods are PERIOD_ORDINAL months, so a lag of 3 is the previous quarter and 12 the
+# same period a year earlier; each lag is one searchsorted over the sorted (series, ordinal)
+# keys, so a batch of stocks is computed in a handful of array passes.
+FEATURES_STAGE_TABLE = "FINANCIALS_FEATURES_STAGE"
+FEATURE_COLUMNS = ["STOCK_CODE", "METRIC", "METRIC_CATEGORY", "QUARTER", "PERIOD_ORDINAL", "VALUE_NUM",
+                   "QOQ_GROWTH", "YOY_GROWTH", "TTM_VALUE", "TTM_YOY_GROWTH", "CAGR_3Y", "CAGR_5Y"]
+# Flows whose last four quarters add up to a trailing-twelve-month figure (metrics quoted
+# in % never do)
+FEATURE_TTM_CATEGORIES = ["Income Statement"]
+FEATURES_REFRESH_BATCH_STOCKS = int(os.getenv("FEATURES_REFRESH_BATCH_STOCKS", "200"))
+
+FEATURES_INSERT_SQL = f"""
+    INSERT INTO FINANCIALS_FEATURES ({", ".join(FEATURE_COLUMNS)})
+    SELECT STOCK_CODE, METRIC, METRIC_CATEGORY, QUARTER, TRY_TO_NUMBER(PERIOD_ORDINAL),
+           TRY_TO_NUMBER(VALUE_NUM, 38, 8), {", ".join(f"TRY_TO_DOUBLE({column})" for column in FEATURE_COLUMNS[6:])}
+    FROM {FEATURES_STAGE_TABLE}
+"""
+
+def _growth(now: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    """(now - previous) / |previous|, NaN where either is missing or previous is 0"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(previous != 0, (now - previous) / np.abs(previous), np.nan)
+
+def _cagr(now: np.ndarray, previous: np.ndarray, years: int) -> np.ndarray:
+    """Compound annual growth over `years`; only defined when both ends are positive"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where((now > 0) & (previous > 0), (now / previous) ** (1 / years) - 1, np.nan)
+
+def compute_features(frame: pd.DataFrame) -> pd.DataFrame:
+    """FEATURE_COLUMNS for every dated quarterly-results row of `frame` (DERIVED_SOURCE_COLUMNS;
+    TTM columns and other sections' rows are dropped).
+
+    QoQ/YoY compare with the same metric 3 and 12 months earlier, TTM sums the last four
+    quarters (all four must exist), and CAGR_3Y/5Y compare with 36 and 60 months earlier.
+    """
+    ordinals = pd.to_numeric(frame["PERIOD_ORDINAL"], errors="coerce")
+    dated = (ordinals.notna() & (ordinals < PERIOD_ORDINAL_TTM) & quarterly_series_mask(frame)).to_numpy()
+    frame = frame.loc[dated]
+    if frame.empty:
+        return pd.DataFrame(columns=FEATURE_COLUMNS)
+
+    series = np.zeros(len(frame), dtype=np.int64)
+    for column in ["STOCK_CODE", "METRIC"]:
+        ids, distinct = pd.factorize(frame[column], use_na_sentinel=False)
+        series = series * len(distinct) + ids
+    # Ordinals stay below PERIOD_ORDINAL_TTM, so a lagged key never crosses into another series
+    keys = series * PERIOD_ORDINAL_TTM + ordinals.to_numpy()[dated].astype(np.int64)
+    # Work in key order throughout: lag lookups are then sorted searches, and a repeated
+    # (stock, metric, period) is adjacent, where the last one wins
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    last = np.append(keys[1:] != keys[:-1], True)
+    order, keys = order[last], keys[last]
+    frame = frame.iloc[order]
+    value = pd.to_numeric(frame["VALUE_NUM"], errors="coerce").to_numpy(dtype=float)
+
+    def lagged(source: np.ndarray, months: int) -> np.ndarray:
+        wanted = keys - months
+        positions = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        return np.where(keys[positions] == wanted, source[positions], np.nan)
+
+    metric_ids, metrics = pd.factorize(frame["METRIC"])
+    category_ids, categories = pd.factorize(frame["METRIC_CATEGORY"])
+    flows = (~np.array(["%" in metric for metric in metrics], dtype=bool)[metric_ids] &
+             np.isin(categories, FEATURE_TTM_CATEGORIES)[category_ids])
+    ttm = np.where(flows, value + lagged(value, 3) + lagged(value, 6) + lagged(value, 9), np.nan)
+
+    features = frame[["STOCK_CODE", "METRIC", "METRIC_CATEGORY", "QUARTER"]].reset_index(drop=True)
+    features["PERIOD_ORDINAL"] = keys % PERIOD_ORDINAL_TTM
+    features["VALUE_NUM"] = value
+    features["QOQ_GROWTH"] = _growth(value, lagged(value, 3))
+    features["YOY_GROWTH"] = _growth(value, lagged(value, 12))
+    features["TTM_VALUE"] = ttm
+    features["TTM_YOY_GROWTH"] = _growth(ttm, lagged(ttm, 12))
+    features["CAGR_3Y"] = _cagr(value, lagged(value, 36), 3)
+    features["CAGR_5Y"] = _cagr(value, lagged(value, 60), 5)
+    return features
+
+def stage_features(conn, frames: List[pd.DataFrame]) -> int:
+    """Compute the features of the stocks in `frames` and bulk-load them into a fresh
+    FEATURES_STAGE_TABLE. DDL, so call it before warehouse_transaction, never inside"""
+    features = compute_features(pd.concat(frames, ignore_index=True) if frames
+                                else pd.DataFrame(columns=DERIVED_SOURCE_COLUMNS))
+    if features.empty:
+        _create_string_table(conn, FEATURES_STAGE_TABLE, FEATURE_COLUMNS)
+        return 0
+    staged = features.astype(str)
+    for column in FEATURE_COLUMNS[5:]:
+        staged[column] = staged[column].where(features[column].notna(), "")
+    _stage_string_frame(conn, staged, FEATURES_STAGE_TABLE, SNOWFLAKE_WRITE_BATCH_ROWS)
+    logger.info(f"📈 Staged {len(features)} feature rows")
+    return len(features)
+
+def replace_features(conn, stock_codes: List[str]):
+    """Replace the FINANCIALS_FEATURES rows of `stock_codes` with the staged ones. DML only, so
+    run it inside warehouse_transaction and readers never see a stock without features"""
+    if not stock_codes:
+        return
+    placeholders = ", ".join(["%s"] * len(stock_codes))
+    cur = conn.cursor()
+    # Replace rather than merge, so periods no longer stored don't leave features behind
+    cur.execute(f"DELETE FROM FINANCIALS_FEATURES WHERE STOCK_CODE IN ({placeholders})", list(stock_codes))
+    cur.execute(FEATURES_INSERT_SQL)
+
+def backfill_features(conn, batch_stocks: Optional[int] = None) -> Dict[str, int]:
+    """Compute features for stored stocks that have none yet (e.g. loaded before the table
+    existed), committing every `batch_stocks` stocks"""
+    batch_stocks = batch_stocks or FEATURES_REFRESH_BATCH_STOCKS
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT DISTINCT STOCK_CODE FROM FINANCIALS_QUARTERLY
+        WHERE STOCK_CODE NOT IN (SELECT DISTINCT STOCK_CODE FROM FINANCIALS_FEATURES)
+        ORDER BY STOCK_CODE
+    """)
+    stock_codes = [row[0] for row in cur.fetchall()]
+    report = {"stocks": len(stock_codes), "rows": 0}
+    for offset in range(0, len(stock_codes), batch_stocks):
+        batch = stock_codes[offset:offset + batch_stocks]
+        report["rows"] += stage_features(conn, derived_source_frames(conn, batch))
+        with warehouse_transaction(conn):
+            replace_features(conn, batch)
+    return report
+
 # ------------------- Additional Analytics Routes -------------------
 @app.route("/metrics-summary")
 def metrics_summary():
     """Show summary of all discovered metrics by category"""
     try:
-        conn = snowflake_connect()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT METRIC_CATEGORY, COUNT(DISTINCT METRIC) as METRIC_COUNT,
-                   COUNT(DISTINCT STOCK_CODE) as STOCK_COUNT
-            FROM FINANCIALS_QUARTERLY
-            GROUP BY METRIC_CATEGORY
-            ORDER BY METRIC_COUNT DESC
-        """)
-        
-        summary_data = cur.fetchall()
-        conn.close()
+        with snowflake_connection() as conn:
+            cur = conn.cursor()
+
+            cur.execute("""
+                SELECT METRIC_CATEGORY, COUNT(DISTINCT METRIC) as METRIC_COUNT,
+                       COUNT(DISTINCT STOCK_CODE) as STOCK_COUNT
+                FROM FINANCIALS_QUARTERLY
+                GROUP BY METRIC_CATEGORY
+                ORDER BY METRIC_COUNT DESC
+            """)
+
+            summary_data = cur.fetchall()
         
         return render_template("metrics_summary.html", summary_data=summary_data)
         
@@ -1278,14 +4717,11 @@ def metrics_summary():
 
 @app.route("/load-data", methods=["POST"])
 def load_data_endpoint():
-    """API endpoint to trigger data loading"""
+    """API endpoint to trigger data loading (returns a job to poll at /jobs/<id>)"""
     try:
-        # This would typically be run in the background
-        import threading
-        thread = threading.Thread(target=load_all_data)
-        thread.start()
-        
-        return json.dumps({"status": "success", "message": "Data loading initiated"})
+        job, created = JOB_MANAGER.submit("load-data", "load-data", load_all_data)
+        message = "Data loading initiated" if created else "Data loading is already in progress"
+        return json.dumps({"status": "success", "message": message, "job_id": job.id, "created": created}), 202
         
     except Exception as e:
         logger.error(f"Error initiating data load: {e}")
@@ -1293,41 +4729,34 @@ def load_data_endpoint():
 
 @app.route("/load-single/<stock>", methods=["POST"])
 def load_single_stock(stock):
-    """Load data for a single stock"""
+    """Load data for a single stock (returns a job to poll at /jobs/<id>)"""
     try:
-        create_snowflake_table()
-        conn = snowflake_connect()
-        
         stock_code = stock.upper()
         logger.info(f"Loading data for single stock: {stock_code}")
-        
-        # Get financial data
-        data, quarters, category, industry = get_financial_data(stock_code)
-        
-        if data and quarters:
-            insert_quarterly_to_snowflake(conn, stock_code, data, quarters, category, industry)
-            conn.close()
-            
-            result = {
-                "status": "success",
-                "message": f"Successfully loaded {len(data)} metrics for {stock_code}",
-                "metrics_count": len(data),
-                "quarters": quarters,
-                "category": category,
-                "industry": industry
-            }
-            return json.dumps(result)
-        else:
-            conn.close()
-            return json.dumps({
-                "status": "error", 
-                "message": f"No data found for {stock_code}. Please check if the stock code is correct."
-            })
+
+        job, created = JOB_MANAGER.submit("load-single", f"load-single:{stock_code}",
+                                          lambda job: load_single_job(job, stock_code))
+        message = f"Loading {stock_code}" if created else f"{stock_code} is already being loaded"
+        return json.dumps({"status": "queued", "message": message, "job_id": job.id, "created": created}), 202
             
     except Exception as e:
         logger.error(f"Error loading single stock {stock}: {e}")
         return json.dumps({"status": "error", "message": str(e)})
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Status and progress of a background job"""
+    job = JOB_MANAGER.get(job_id)
+    if job is None:
+        return json.dumps({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    return json.dumps(job, default=str)
+
+@app.route("/jobs")
+def list_jobs():
+    """Most recent background jobs, newest first"""
+    limit = min(request.args.get("limit", 20, type=int), JOB_HISTORY_LIMIT)
+    return json.dumps({"jobs": JOB_MANAGER.recent(limit)}, default=str)
+
 @app.route("/test-scraper/<stock>")
 def test_scraper_route(stock):
     """Test web scraping for a single stock"""
@@ -1335,23 +4764,20 @@ def test_scraper_route(stock):
         stock_code = stock.upper()
         url = SCREENER_URL.format(stock_code)
         
-        # Test the scraping
-        try:
-            response = requests.get(url, headers=HEADERS, timeout=30)
-            response_status = response.status_code
-            scraping_success = response.status_code == 200
-        except Exception as e:
-            response_status = "Failed"
-            scraping_success = False
+        # Test the scraping (one fetch, reused for extraction below)
+        scrape = fetch_screener_page(stock_code)
+        response_status = scrape.status_code if scrape.status_code is not None else "Failed"
+        scraping_success = scrape.ok
             
         # Test quarterly data extraction
-        data, quarters, category, industry = get_financial_data(stock_code)
+        data, quarters, category, industry = scrape_result_to_financial_data(scrape)
         
         result = {
             "stock_code": stock_code,
             "url": url,
             "response_status": response_status,
             "scraping_success": scraping_success,
+            "page_source": scrape.source if scrape.ok else None,
             "metrics_found": len(data),
             "quarters": quarters,
             "category": category,
@@ -1372,36 +4798,33 @@ def test_full_flow(stock):
     try:
         stock_code = stock.upper()
         
-        # Step 1: Create table
-        create_snowflake_table()
-        
         # Step 2: Get data
         data, quarters, category, industry = get_financial_data(stock_code)
-        
-        # Step 3: Insert to database
-        if data and quarters:
-            conn = snowflake_connect()
-            insert_quarterly_to_snowflake(conn, stock_code, data, quarters, category, industry)
-            conn.close()
-        
-        # Step 4: Retrieve from database
-        conn = snowflake_connect()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT COUNT(*) FROM FINANCIALS_QUARTERLY WHERE STOCK_CODE=%s
-        """, (stock_code,))
-        db_count = cur.fetchone()[0]
-        
-        cur.execute("""
-            SELECT METRIC, QUARTER, VALUE, METRIC_CATEGORY
-            FROM FINANCIALS_QUARTERLY
-            WHERE STOCK_CODE=%s
-            ORDER BY METRIC, QUARTER
-            LIMIT 10
-        """, (stock_code,))
-        sample_rows = cur.fetchall()
-        conn.close()
-        
+
+        with snowflake_connection() as conn:
+            # Step 1: Create/verify table
+            ensure_schema(conn)
+
+            # Step 3: Insert to database
+            if data and quarters:
+                insert_quarterly_to_snowflake(conn, stock_code, data, quarters, category, industry)
+
+            # Step 4: Retrieve from database
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT COUNT(*) FROM FINANCIALS_QUARTERLY WHERE STOCK_CODE=%s
+            """, (stock_code,))
+            db_count = cur.fetchone()[0]
+
+            cur.execute("""
+                SELECT METRIC, QUARTER, VALUE, METRIC_CATEGORY
+                FROM FINANCIALS_QUARTERLY
+                WHERE STOCK_CODE=%s
+                ORDER BY METRIC, QUARTER
+                LIMIT 10
+            """, (stock_code,))
+            sample_rows = cur.fetchall()
+
         result = {
             "stock_code": stock_code,
             "step1_table_created": "✅ Success",
@@ -1423,18 +4846,12 @@ def test_full_flow(stock):
 def api_metrics_by_category(category):
     """API endpoint to get metrics by category"""
     try:
-        conn = snowflake_connect()
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT DISTINCT METRIC
-            FROM FINANCIALS_QUARTERLY
-            WHERE METRIC_CATEGORY = %s
-            ORDER BY METRIC
-        """, (category,))
-        
-        metrics = [row[0] for row in cur.fetchall()]
-        conn.close()
+        with snowflake_connection() as conn:
+            cur = conn.cursor()
+
+            cur.execute(METRICS_BY_CATEGORY_SQL, (category,))
+
+            metrics = [row[0] for row in cur.fetchall()]
         
         return json.dumps({"category": category, "metrics": metrics})
         
@@ -1442,6 +4859,120 @@ def api_metrics_by_category(category):
         logger.error(f"Error in API metrics by category: {e}")
         return json.dumps({"error": str(e)})
 
+def _json_number(value) -> Optional[float]:
+    return None if value is None or pd.isna(value) else round(float(value), 6)
+
+def build_sector_analytics(frames: Iterable[pd.DataFrame]) -> Tuple[Optional[int], Optional[int], Dict[str, Dict]]:
+    """(period ordinal, stocks in the sector, {metric: {category, median, q1, q3, peers, coverage,
+    stocks: [...]}}) from SECTOR_ANALYTICS_SQL rows, which arrive ordered by metric and rank.
+    `peers` is how many stocks have the metric for the period; `coverage` is their share of
+    the sector."""
+    ordinal = sector_stocks = None
+    metrics = {}
+    for frame in frames:
+        for (metric_category, metric, stock_code, row_ordinal, row_sector_stocks, value, qoq, yoy, rank, peers,
+             median, q1, q3) in frame.itertuples(index=False, name=None):
+            ordinal = int(row_ordinal)
+            sector_stocks = int(row_sector_stocks)
+            entry = metrics.get(metric)
+            if entry is None:
+                entry = metrics[metric] = {
+                    "category": metric_category,
+                    "median": _json_number(median),
+                    "q1": _json_number(q1),
+                    "q3": _json_number(q3),
+                    "peers": int(peers),
+                    "coverage": round(int(peers) / sector_stocks, 4) if sector_stocks else None,
+                    "stocks": [],
+                }
+            entry["stocks"].append({
+                "stock": stock_code,
+                "value": _json_number(value),
+                "rank": int(rank),
+                "qoq_growth": _json_number(qoq),
+                "yoy_growth": _json_number(yoy),
+            })
+    return ordinal, sector_stocks, metrics
+
+@app.route("/api/sector/<sector>/analytics")
+def api_sector_analytics(sector):
+    """Per-metric sector comparison (median, quartiles, rank of each stock, QoQ/YoY growth)
+    aggregated in Snowflake for ?period=Mar 2024, or by default the latest period at least
+    SECTOR_ANALYTICS_MIN_COVERAGE of the sector's stocks have reported"""
+    try:
+        period = request.args.get("period")
+        target = period_ordinal(period) if period else None
+        if period and target is None:
+            return json.dumps({"error": f"Unrecognised period '{period}'"}), 400
+        if target is not None and target >= PERIOD_ORDINAL_TTM:
+            # TTM has no previous quarter or year to compare with
+            return json.dumps({"error": f"Period must be a quarter such as 'Mar 2024', not '{period}'"}), 400
+
+        cache_key = ("sector", sector.lower(), "analytics", target or "latest")
+        result, cache_token = PAYLOAD_CACHE.lookup(cache_key)
+        if result is not None:
+            return json.dumps(result)
+
+        with snowflake_connection() as conn:
+            cur = conn.cursor()
+            matched_category = match_sector_category(cur, sector)
+            if not matched_category:
+                return json.dumps({"error": f"Sector '{sector}' not found"}), 404
+
+            cur.execute(SECTOR_ANALYTICS_SQL, sector_analytics_params(matched_category, target))
+            stats = FetchStats("sector_analytics")
+            ordinal, sector_stocks, metrics = build_sector_analytics(
+                iter_result_frames(cur, SECTOR_ANALYTICS_COLUMNS, stats))
+            record_fetch(stats, matched_category)
+
+        result = {
+            "sector": matched_category,
+            "period": period_label(ordinal) if ordinal is not None else None,
+            "sector_stocks": sector_stocks,
+            "metrics": metrics,
+        }
+        PAYLOAD_CACHE.put(cache_key, result, cache_token)
+        return json.dumps(result)
+
+    except Exception as e:
+        logger.error(f"Error in sector analytics for {sector}: {e}")
+        return json.dumps({"error": str(e)})
+
+@app.route("/api/features/<stock>")
+def api_stock_features(stock):
+    """Precomputed QoQ/YoY growth, TTM and CAGR series per metric for one stock"""
+    stock = stock.strip().upper()
+    try:
+        cache_key = ("stock", stock, "features")
+        result, cache_token = PAYLOAD_CACHE.lookup(cache_key)
+        if result is not None:
+            return json.dumps(result)
+
+        with snowflake_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(FEATURES_LOOKUP_SQL, (stock,))
+            rows = cur.fetchall()
+        # Read only: features are written by the loader and --backfill-features, never here
+        if not rows:
+            return json.dumps({"error": f"No data for {stock}"}), 404
+
+        metrics = {}
+        fields = ["value", "qoq_growth", "yoy_growth", "ttm_value", "ttm_yoy_growth", "cagr_3y", "cagr_5y"]
+        for metric, metric_category, quarter, *values in rows:
+            entry = metrics.setdefault(metric, {"category": metric_category, "quarters": [],
+                                                **{field: [] for field in fields}})
+            entry["quarters"].append(quarter)
+            for field, value in zip(fields, values):
+                entry[field].append(_json_number(value))
+
+        result = {"stock": stock, "metrics": metrics}
+        PAYLOAD_CACHE.put(cache_key, result, cache_token)
+        return json.dumps(result)
+
+    except Exception as e:
+        logger.error(f"Error in features for {stock}: {e}")
+        return json.dumps({"error": str(e)})
+
 @app.route("/simple-quarterly/<stock>")
 def simple_quarterly_view(stock):
     """Ultra-simple quarterly view using fallback data to test basic functionality"""
@@ -1620,11 +5151,10 @@ def diagnostic():
     
     # 2. Database Connection Check
     try:
-        conn = snowflake_connect()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        result = cur.fetchone()
-        conn.close()
+        with snowflake_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            result = cur.fetchone()
         
         diagnostics["database_check"]["connection"] = "✅ Successful"
         diagnostics["database_check"]["test_query"] = "✅ Working"
@@ -1634,17 +5164,34 @@ def diagnostic():
     
     # 3. Table Check
     try:
-        conn = snowflake_connect()
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM FINANCIALS_QUARTERLY")
-        count = cur.fetchone()[0]
-        conn.close()
+        with snowflake_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM FINANCIALS_QUARTERLY")
+            count = cur.fetchone()[0]
         
         diagnostics["database_check"]["table_exists"] = "✅ Yes"
         diagnostics["database_check"]["row_count"] = count
     except Exception as e:
         diagnostics["database_check"]["table_check"] = "❌ Failed"
         diagnostics["database_check"]["table_error"] = str(e)
+
+    diagnostics["database_check"]["connection_pool"] = SNOWFLAKE_POOL.stats()
+    diagnostics["database_check"]["schema"] = SCHEMA_MANAGER.status()
+    diagnostics["metric_registry"] = METRIC_REGISTRY.status()
+    diagnostics["last_load"] = LAST_LOAD_REPORT or None
+    diagnostics["payload_cache"] = PAYLOAD_CACHE.summary()
+    diagnostics["cold_loads"] = COLD_LOADS.summary()
+    diagnostics["jobs"] = JOB_MANAGER.summary()
+    diagnostics["result_fetch"] = result_fetch_report()
+    diagnostics["scraper"] = {
+        "parser_backend": ACTIVE_PARSER_BACKEND,
+        "available_parser_backends": available_parser_backends(),
+        "brotli": BROTLI_AVAILABLE,
+        "http_pool_size": SCRAPE_HTTP_POOL_SIZE,
+        "stream_early_stop": SCRAPE_STREAM_EARLY_STOP,
+        "partial_parse": SCRAPE_PARTIAL_PARSE,
+        "page_cache": PAGE_CACHE.summary(),
+    }
     
     # 4. Fallback Data Check
     try:
@@ -1969,10 +5516,77 @@ if __name__ == '__main__':
     parser.add_argument('--load-data', action='store_true', help='Load all stock data')
     parser.add_argument('--run-app', action='store_true', help='Run Flask application')
     parser.add_argument('--test-single', type=str, help='Test scraping for a single stock')
+    parser.add_argument('--migrate', action='store_true', help='Apply pending Snowflake schema migrations and exit')
+    parser.add_argument('--clustering-report', action='store_true',
+                        help='Report clustering depth and partitions scanned by each route query')
+    parser.add_argument('--backfill-features', action='store_true',
+                        help='Compute FINANCIALS_FEATURES for stored stocks that have none yet')
+    parser.add_argument('--backfill-snapshots', action='store_true',
+                        help='Rebuild FINANCIALS_SNAPSHOT (and features) for stored stocks whose snapshot is missing or stale')
+    parser.add_argument('--offline', action='store_true', help='Scrape from the on-disk page cache only (no network)')
+    parser.add_argument('--replay-cache', action='store_true', help='Re-parse every cached page and report parse timings')
+    parser.add_argument('--verify-parsers', nargs='?', const='', metavar='DIR',
+                        help='Check all HTML parser backends agree on saved pages (DIR of .html + .golden.json files, '
+                             'default: fixtures/screener_pages)')
+    parser.add_argument('--write-golden', action='store_true', help='With --verify-parsers, (re)write the golden files')
+    parser.add_argument('--benchmark-parse', nargs='?', const='', metavar='DIR',
+                        help='Compare multi-pass vs single-pass extraction on saved pages (DIR of .html files, default: page cache)')
+    parser.add_argument('--benchmark-partial', nargs='?', const='', metavar='DIR',
+                        help='Compare full-page vs partial (financial sections only) parsing time and peak memory')
+    parser.add_argument('--benchmark-categorizer', nargs='?', const='', metavar='DIR',
+                        help='Compare the compiled metric categorizer with the original on metric names from saved pages')
+    parser.add_argument('--benchmark-pivot', nargs='?', const='500x300x40', metavar='STOCKSxMETRICSxQUARTERS',
+                        help='Compare the vectorized and original route pivots on a synthetic table (default 500x300x40)')
     
     args = parser.parse_args()
+
+    if args.offline:
+        SCRAPE_OFFLINE = True
     
-    if args.test_single:
+    if args.verify_parsers is not None:
+        verify_dir = args.verify_parsers or PARSER_FIXTURES_DIR
+        pages = load_benchmark_pages(verify_dir)
+        report = verify_parser_backends(pages, verify_dir, args.write_golden)
+        print(json.dumps(report, indent=2))
+        if not report["all_identical"]:
+            raise SystemExit(1)
+    elif args.benchmark_parse is not None:
+        pages = load_benchmark_pages(args.benchmark_parse or None)
+        print(json.dumps(benchmark_parse(pages), indent=2))
+    elif args.benchmark_partial is not None:
+        pages = load_benchmark_pages(args.benchmark_partial or None)
+        print(json.dumps(benchmark_partial_parse(pages), indent=2))
+    elif args.benchmark_categorizer is not None:
+        pages = load_benchmark_pages(args.benchmark_categorizer or None)
+        report = benchmark_categorizer(categorizer_benchmark_names(pages))
+        print(json.dumps(report, indent=2))
+        if not report["identical"]:
+            raise SystemExit(1)
+    elif args.benchmark_pivot is not None:
+        stocks, metrics, quarters = (int(part) for part in args.benchmark_pivot.lower().split("x"))
+        report = benchmark_pivot(stocks, metrics, quarters)
+        print(json.dumps(report, indent=2))
+        if not report["identical"]:
+            raise SystemExit(1)
+    elif args.replay_cache:
+        print(f"Replaying cached pages from {PAGE_CACHE.directory}")
+        print(json.dumps(replay_cached_pages(), indent=2))
+    elif args.migrate:
+        ensure_schema()
+        print(json.dumps(SCHEMA_MANAGER.status(), indent=2))
+    elif args.backfill_features:
+        with snowflake_connection() as conn:
+            ensure_schema(conn)
+            print(json.dumps(backfill_features(conn), indent=2))
+    elif args.backfill_snapshots:
+        with snowflake_connection() as conn:
+            ensure_schema(conn)
+            print(json.dumps(backfill_snapshots(conn), indent=2))
+    elif args.clustering_report:
+        with snowflake_connection() as conn:
+            ensure_schema(conn)
+            print(json.dumps(clustering_report(conn), indent=2, default=str))
+    elif args.test_single:
         # Test scraping for a single stock
         data, quarters, category, industry = get_financial_data(args.test_single)
         print(f"Found {len(data)} metrics for {args.test_single}")
@@ -1981,6 +5595,8 @@ if __name__ == '__main__':
     elif args.load_data:
         load_all_data()
     elif args.run_app:
+        bootstrap_schema()
+        bootstrap_metric_registry()
         app.run(debug=True, host='0.0.0.0', port=5000)
     else:
         # Default behavior: load data then run app
@@ -0,0 +1,103 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+# Keep the module's on-disk state (page cache, job history, metric registry) out of the checkout
+_STATE_DIR = tempfile.mkdtemp(prefix="stockrec-tests-")
+os.environ.setdefault("SCRAPE_CACHE_DIR", _STATE_DIR)
+os.environ.setdefault("JOB_HISTORY_DB", ":memory:")
+os.environ.setdefault("METRIC_REGISTRY_FILE", os.path.join(_STATE_DIR, "metric_registry.json"))
+os.environ.setdefault("SHARED_CACHE_URL", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stock_recommender as sr  # noqa: E402
+
+
+class FakeCursor:
+    """Just enough of a Snowflake cursor: answers come from the connection's `results`, keyed by
+    a substring of the whitespace-normalized SQL (rows, or a callable taking (sql, params)); the
+    first matching key wins"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.connection.log.append(sql)
+        self._rows = []
+        for fragment, answer in self.connection.results.items():
+            if fragment in sql:
+                self._rows = list(answer(sql, params) if callable(answer) else answer)
+                break
+        return self
+
+    def executemany(self, sql, seq):
+        self.connection.log.append("EXECUTEMANY " + " ".join(sql.split()))
+        return self
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Records every statement (and COMMIT/ROLLBACK) in `log`"""
+
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.log = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.log.append("COMMIT")
+
+    def rollback(self):
+        self.log.append("ROLLBACK")
+
+    def autocommit(self, mode):
+        self.log.append(f"AUTOCOMMIT {mode}")
+
+    def is_closed(self):
+        return False
+
+    def close(self):
+        pass
+
+    def transaction(self):
+        """Statements between BEGIN and the following COMMIT/ROLLBACK"""
+        start = self.log.index("BEGIN")
+        end = next(i for i in range(start, len(self.log)) if self.log[i] in ("COMMIT", "ROLLBACK"))
+        return self.log[start + 1:end]
+
+
+@pytest.fixture
+def fake_warehouse(monkeypatch):
+    """Routes and loaders talk to one FakeConnection; schema checks and write_pandas are off"""
+    connection = FakeConnection()
+
+    @contextmanager
+    def connect():
+        yield connection
+
+    monkeypatch.setattr(sr, "snowflake_connection", connect)
+    monkeypatch.setattr(sr, "ensure_schema", lambda conn=None: None)
+    monkeypatch.setattr(sr, "WRITE_PANDAS_AVAILABLE", False)
+    sr.PAYLOAD_CACHE.clear()
+    yield connection
+    sr.PAYLOAD_CACHE.clear()
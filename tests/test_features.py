@@ -0,0 +1,123 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import stock_recommender as sr
+
+PAGES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures", "screener_pages")
+
+
+def quarterly_frame(values, metric="Sales +", category="Income Statement", section="quarters", stock="TCS",
+                    start=(2019, 3)):
+    """DERIVED_SOURCE_COLUMNS rows of one series, one value per quarter from `start`"""
+    year, month = start
+    rows = []
+    for value in values:
+        label = f"{pd.Timestamp(year=year, month=month, day=1):%b %Y}"
+        rows.append((stock, metric, label, value, category, sr.period_ordinal(label), section))
+        year, month = (year + 1, 3) if month == 12 else (year, month + 3)
+    return pd.DataFrame(rows, columns=sr.DERIVED_SOURCE_COLUMNS)
+
+
+def feature(features, quarter, column, metric="Sales +"):
+    row = features[(features["QUARTER"] == quarter) & (features["METRIC"] == metric)]
+    assert len(row) == 1
+    return row[column].iloc[0]
+
+
+def test_growth_compares_with_three_and_twelve_months_earlier():
+    # Mar 2019 .. Mar 2024: 100, 110, 120, ... (+10 a quarter)
+    features = sr.compute_features(quarterly_frame([100.0 + 10 * n for n in range(21)]))
+
+    assert feature(features, "Mar 2024", "VALUE_NUM") == 300
+    assert feature(features, "Mar 2024", "QOQ_GROWTH") == pytest.approx(10 / 290)
+    assert feature(features, "Mar 2024", "YOY_GROWTH") == pytest.approx(40 / 260)
+    assert np.isnan(feature(features, "Mar 2019", "QOQ_GROWTH"))
+    assert np.isnan(feature(features, "Dec 2019", "YOY_GROWTH"))
+
+
+def test_ttm_sums_four_quarters_and_needs_all_of_them():
+    features = sr.compute_features(quarterly_frame([100.0 + 10 * n for n in range(21)]))
+
+    assert np.isnan(feature(features, "Sep 2019", "TTM_VALUE"))
+    assert feature(features, "Dec 2019", "TTM_VALUE") == 100 + 110 + 120 + 130
+    assert feature(features, "Mar 2024", "TTM_VALUE") == 270 + 280 + 290 + 300
+    assert feature(features, "Mar 2024", "TTM_YOY_GROWTH") == pytest.approx((1140 - 980) / 980)
+
+
+def test_gap_in_the_series_leaves_the_dependent_lags_missing():
+    frame = quarterly_frame([100.0 + 10 * n for n in range(21)])
+    features = sr.compute_features(frame[frame["QUARTER"] != "Dec 2023"])
+
+    assert np.isnan(feature(features, "Mar 2024", "QOQ_GROWTH"))
+    assert np.isnan(feature(features, "Mar 2024", "TTM_VALUE"))
+    assert feature(features, "Mar 2024", "YOY_GROWTH") == pytest.approx(40 / 260)
+
+
+def test_cagr_looks_back_three_and_five_years_and_needs_positive_ends():
+    values = [100.0] * 21
+    values[8], values[20] = 50.0, 200.0  # Mar 2021, Mar 2024
+    features = sr.compute_features(quarterly_frame(values))
+
+    assert feature(features, "Mar 2024", "CAGR_3Y") == pytest.approx(4 ** (1 / 3) - 1)
+    assert feature(features, "Mar 2024", "CAGR_5Y") == pytest.approx(2 ** (1 / 5) - 1)
+    assert np.isnan(feature(features, "Dec 2023", "CAGR_5Y"))
+
+    values[8] = -50.0
+    features = sr.compute_features(quarterly_frame(values))
+    assert np.isnan(feature(features, "Mar 2024", "CAGR_3Y"))
+
+
+def test_ttm_only_for_income_statement_flows():
+    frame = pd.concat([quarterly_frame([10.0, 12.0, 11.0, 13.0], metric="OPM %"),
+                       quarterly_frame([5.0, 6.0, 7.0, 8.0], metric="Cash Equivalents", category="Balance Sheet")])
+    features = sr.compute_features(frame)
+
+    assert np.isnan(feature(features, "Dec 2019", "TTM_VALUE", metric="OPM %"))
+    assert np.isnan(feature(features, "Dec 2019", "TTM_VALUE", metric="Cash Equivalents"))
+    assert feature(features, "Dec 2019", "QOQ_GROWTH", metric="OPM %") == pytest.approx(2 / 11)
+
+
+def test_only_dated_quarterly_results_rows_are_kept():
+    frame = pd.concat([
+        quarterly_frame([100.0, 110.0]),
+        quarterly_frame([300.0], metric="Reserves", category="Balance Sheet", section="balance-sheet"),
+        quarterly_frame([7.0], metric="EPS in Rs", section="profit-loss"),
+        pd.DataFrame([("TCS", "Sales +", "TTM", 210.0, "Income Statement", sr.PERIOD_ORDINAL_TTM, "quarters")],
+                     columns=sr.DERIVED_SOURCE_COLUMNS),
+    ])
+    features = sr.compute_features(frame)
+
+    assert list(features.columns) == sr.FEATURE_COLUMNS
+    assert sorted(zip(features["METRIC"], features["QUARTER"])) == [("Sales +", "Jun 2019"), ("Sales +", "Mar 2019")]
+
+
+def test_series_are_kept_apart_and_a_repeated_period_keeps_its_last_value():
+    frame = pd.concat([quarterly_frame([100.0, 110.0]), quarterly_frame([1.0, 2.0], stock="INFY"),
+                       quarterly_frame([120.0], start=(2019, 6))])
+    features = sr.compute_features(frame)
+
+    assert len(features) == 4
+    assert feature(features[features["STOCK_CODE"] == "TCS"], "Jun 2019", "QOQ_GROWTH") == pytest.approx(0.2)
+    assert feature(features[features["STOCK_CODE"] == "INFY"], "Jun 2019", "QOQ_GROWTH") == pytest.approx(1.0)
+
+
+def test_extracted_metrics_record_the_section_they_were_read_from():
+    with open(os.path.join(PAGES, "smallco.html"), "rb") as f:
+        data, quarters, category, industry = sr.extract_financial_page(f.read(), "SMALLCO")
+    with open(os.path.join(PAGES, "SMALLCO.golden.json"), encoding="utf-8") as f:
+        golden = json.load(f)
+
+    assert data.sections == golden["sections"]
+    rows = sr.quarterly_rows("SMALLCO", data, quarters, category, industry)
+    assert {row[1]: row[7] for row in rows}["Reserves"] == "balance-sheet"
+    assert {row[1]: row[7] for row in rows}["Sales +"] == "quarters"
+
+    frame = pd.DataFrame([(code, metric, quarter, float(value), metric_category, sr.period_ordinal(quarter), section)
+                          for code, metric, quarter, value, _, _, metric_category, section in rows],
+                         columns=sr.DERIVED_SOURCE_COLUMNS)
+    featured = set(sr.compute_features(frame)["METRIC"])
+    assert featured == {metric for metric, section in golden["sections"].items() if section == "quarters"}
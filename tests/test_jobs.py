@@ -0,0 +1,82 @@
+import threading
+
+import stock_recommender as sr
+
+
+def finish(manager, job_id):
+    """Let the manager's workers drain, then return the job's record"""
+    manager._executor.shutdown(wait=True)
+    return manager.get(job_id)
+
+
+def test_finished_jobs_survive_a_restart(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    manager = sr.JobManager(workers=1, history=sr.JobHistory(path))
+
+    def load(job):
+        job.set_total(2)
+        job.advance("TCS", rows_written=10)
+        job.advance("INFY", rows_written=25, error="parse failed")
+        return {"stocks": 2}
+
+    job, created = manager.submit("load", "load:all", load)
+    assert created
+    finish(manager, job.id)
+
+    record = sr.JobHistory(path).get(job.id)
+    assert record["status"] == "succeeded"
+    assert record["key"] == "load:all"
+    assert (record["done"], record["total"], record["percent"]) == (2, 2, 100.0)
+    assert record["rows_written"] == 25
+    assert record["errors"] == ["INFY: parse failed"]
+    assert record["result"] == {"stocks": 2}
+
+
+def test_jobs_left_running_by_a_previous_process_are_marked_interrupted(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    history = sr.JobHistory(path)
+    job = sr.Job("load", "load:all")
+    job.status = "running"
+    history.save(job)
+
+    assert sr.JobHistory(path).get(job.id)["status"] == "interrupted"
+
+
+def test_history_keeps_only_the_most_recent_finished_jobs(tmp_path):
+    history = sr.JobHistory(str(tmp_path / "jobs.sqlite"), limit=3)
+    for n in range(5):
+        job = sr.Job("load", f"load:{n}")
+        job.created_at = 1000.0 + n
+        job.status, job.finished_at = "succeeded", 2000.0 + n
+        history.save(job)
+
+    assert [record["key"] for record in history.recent()] == ["load:4", "load:3", "load:2"]
+
+
+def test_a_job_already_queued_or_running_is_returned_instead_of_a_duplicate():
+    manager = sr.JobManager(workers=1, history=sr.JobHistory(":memory:"))
+    release = threading.Event()
+
+    first, created = manager.submit("load", "load:TCS", lambda job: release.wait(5))
+    second, duplicate_created = manager.submit("load", "load:TCS", lambda job: True)
+    assert created and not duplicate_created
+    assert second is first
+    assert manager.stats["deduplicated"] == 1
+
+    release.set()
+    finish(manager, first.id)
+    assert manager.get(first.id)["status"] == "succeeded"
+
+
+def test_failed_job_records_its_error():
+    manager = sr.JobManager(workers=1, history=sr.JobHistory(":memory:"))
+
+    def fail(job):
+        raise RuntimeError("warehouse unavailable")
+
+    job, _ = manager.submit("load", "load:all", fail)
+    record = finish(manager, job.id)
+
+    assert record["status"] == "failed"
+    assert record["errors"] == ["warehouse unavailable"]
+    assert manager.history.get(job.id)["status"] == "failed"
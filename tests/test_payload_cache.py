@@ -0,0 +1,68 @@
+import json
+
+import stock_recommender as sr
+
+
+def test_invalidating_a_tag_drops_only_its_entries():
+    cache = sr.PayloadCache(max_entries=8, ttl=60)
+    for key in [("stock", "TCS"), ("stock", "TCS", "last:4"), ("stock", "INFY"), ("sector", "Large Cap")]:
+        _, token = cache.lookup(key)
+        cache.put(key, {"key": list(key)}, token)
+
+    assert cache.invalidate_tags(["stock:TCS", "category:large cap"]) == 3
+
+    assert cache.lookup(("stock", "TCS"))[0] is None
+    assert cache.lookup(("stock", "TCS", "last:4"))[0] is None
+    assert cache.lookup(("sector", "Large Cap"))[0] is None
+    assert cache.lookup(("stock", "INFY"))[0] == {"key": ["stock", "INFY"]}
+
+
+def test_put_after_an_invalidation_is_dropped():
+    cache = sr.PayloadCache(max_entries=8, ttl=60)
+    _, token = cache.lookup(("stock", "TCS"))
+    # A load lands while the payload is being read from the warehouse
+    cache.invalidate_tags(["stock:TCS"])
+    cache.put(("stock", "TCS"), {"stale": True}, token)
+
+    assert cache.lookup(("stock", "TCS"))[0] is None
+    assert cache.stats["stale_puts"] == 1
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = sr.PayloadCache(max_entries=2, ttl=60)
+    for name in ["A", "B"]:
+        cache.put(("stock", name), name, cache.lookup(("stock", name))[1])
+    cache.lookup(("stock", "A"))
+    cache.put(("stock", "C"), "C", cache.lookup(("stock", "C"))[1])
+
+    assert cache.lookup(("stock", "B"))[0] is None
+    assert cache.lookup(("stock", "A"))[0] == "A"
+    assert cache.stats["evictions"] == 1
+
+
+def test_expired_entries_miss(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sr.time, "monotonic", lambda: now[0])
+    cache = sr.PayloadCache(max_entries=8, ttl=60)
+    cache.put(("stock", "TCS"), "payload", cache.lookup(("stock", "TCS"))[1])
+
+    now[0] += 61
+
+    assert cache.lookup(("stock", "TCS"))[0] is None
+    assert cache.stats["expired"] == 1
+
+
+def test_lowercase_route_caches_under_the_code_a_load_invalidates(fake_warehouse):
+    fake_warehouse.results = {"FROM FINANCIALS_FEATURES": [
+        ("Sales +", "Income Statement", "Mar 2024", 10.0, 25.0, None, None, None, None, None)]}
+    client = sr.app.test_client()
+    lookup = " ".join(sr.FEATURES_LOOKUP_SQL.split())
+
+    first = client.get("/api/features/tcs")
+    assert json.loads(first.data)["stock"] == "TCS"
+    client.get("/api/features/TCS")
+    assert fake_warehouse.log.count(lookup) == 1
+
+    sr.PAYLOAD_CACHE.invalidate_tags(["stock:TCS"])
+    client.get("/api/features/Tcs")
+    assert fake_warehouse.log.count(lookup) == 2
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import stock_recommender as sr
+
+# Decimal(38, 8) values as VALUE_NUM stores them
+STORED = ["0", "1", "-1", "0.1", "0.30000000", "-0.00000001", "12.5", "1234.56789012",
+          "-98765.4321", "100000", "0.07", "9999999.99999999", "-9999999.12345678"]
+
+
+@pytest.mark.parametrize("stored", STORED)
+def test_float_path_matches_the_decimal_path_below_the_exact_limit(stored):
+    assert sr.format_numbers(np.array([float(stored)]))[0] == sr.format_number(Decimal(stored))
+
+
+def test_missing_cells_format_as_empty_and_repeats_share_one_string():
+    text = sr.format_numbers(np.array([[1.5, np.nan], [1.5, -0.0]]))
+
+    assert text.tolist() == [["1.5", ""], ["1.5", "0"]]
+    assert text[0, 0] is text[1, 0]
+
+
+def test_wide_values_keep_every_stored_digit():
+    wide = Decimal("123456789012.12345678")
+    frame = pd.DataFrame([("A", "Sales", "Mar 2024", wide, "Income Statement", 24290),
+                          ("A", "Cash", "Mar 2024", Decimal("10000000.00000001"), "Balance Sheet", 24290)],
+                         columns=sr.PIVOT_COLUMNS)
+
+    _, _, _, text, _ = sr.pivot_values(iter([frame]), ["STOCK_CODE", "METRIC"])
+
+    assert text.tolist() == [["123456789012.12345678"], ["10000000.00000001"]]
+
+
+def test_a_later_duplicate_replaces_a_wide_value():
+    frames = [pd.DataFrame([("A", "Sales", "Mar 2024", Decimal("123456789012.5"), "Income Statement", 24290)],
+                           columns=sr.PIVOT_COLUMNS),
+              pd.DataFrame([("A", "Sales", "Mar 2024", Decimal("7.25"), "Income Statement", 24290)],
+                           columns=sr.PIVOT_COLUMNS)]
+
+    _, _, _, text, _ = sr.pivot_values(iter(frames), ["STOCK_CODE", "METRIC"])
+
+    assert text.tolist() == [["7.25"]]
+
+
+def test_quarters_are_ordered_by_stored_ordinal_with_ttm_last():
+    rows = [("A", "Sales", "TTM", 30.0, "Income Statement", sr.PERIOD_ORDINAL_TTM),
+            ("A", "Sales", "Mar 2024", 10.0, "Income Statement", 24290),
+            ("A", "Sales", "Dec 2023", 8.0, "Income Statement", 24287)]
+
+    _, quarters, ordinals, text, _ = sr.pivot_values(rows, ["STOCK_CODE", "METRIC"])
+
+    assert quarters == ["Dec 2023", "Mar 2024", "TTM"]
+    assert ordinals == [24287, 24290, sr.PERIOD_ORDINAL_TTM]
+    assert text.tolist() == [["8", "10", "30"]]
+
+
+def test_vectorized_payloads_match_the_reference_loops():
+    frame = sr.synthetic_quarterly_frame(6, 20, 8, missing=0.1, decimals=True, seed=3)
+    rows = list(frame.itertuples(index=False, name=None))
+
+    assert sr.build_stock_payloads(frame) == sr.build_stock_payloads_reference(rows)
+    assert sr.pivot_sector(frame) == sr.pivot_sector_reference(rows)
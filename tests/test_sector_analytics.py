@@ -0,0 +1,59 @@
+import json
+
+import pandas as pd
+
+import stock_recommender as sr
+
+ANALYTICS_ROWS = [
+    ("Income Statement", "Sales +", "TCS", 24290, 3, 120.0, 0.2, 0.5, 1, 2, 100.0, 90.0, 110.0),
+    ("Income Statement", "Sales +", "INFY", 24290, 3, 80.0, None, -0.1, 2, 2, 100.0, 90.0, 110.0),
+    ("Income Statement", "EPS in Rs", "TCS", 24290, 3, 30.5, 0.1, 0.1, 1, 1, 30.5, 30.5, 30.5),
+]
+
+
+def test_rows_group_per_metric_in_rank_order():
+    frame = pd.DataFrame(ANALYTICS_ROWS, columns=sr.SECTOR_ANALYTICS_COLUMNS)
+
+    ordinal, sector_stocks, metrics = sr.build_sector_analytics(iter([frame]))
+
+    assert (ordinal, sector_stocks) == (24290, 3)
+    assert list(metrics) == ["Sales +", "EPS in Rs"]
+    sales = metrics["Sales +"]
+    assert (sales["median"], sales["q1"], sales["q3"], sales["peers"], sales["coverage"]) == (100, 90, 110, 2, 0.6667)
+    assert [(s["stock"], s["rank"], s["qoq_growth"]) for s in sales["stocks"]] == [("TCS", 1, 0.2), ("INFY", 2, None)]
+
+
+def test_analytics_only_compare_quarterly_series():
+    sql = " ".join(sr.SECTOR_ANALYTICS_SQL.split())
+
+    assert sql.count("SOURCE_SECTION = 'quarters'") == 2
+    assert "q.SOURCE_SECTION = 'quarters'" in sql
+    frame = pd.DataFrame({"SOURCE_SECTION": ["quarters", "balance-sheet", "cash-flow"]})
+    assert sr.quarterly_series_mask(frame).tolist() == [True, False, False]
+
+
+def test_route_binds_the_matched_category_and_period(fake_warehouse):
+    binds = []
+    fake_warehouse.results = {"SELECT DISTINCT CATEGORY": [("Large Cap",)],
+                              "WITH reported AS": lambda sql, params: binds.append(params) or ANALYTICS_ROWS}
+
+    response = sr.app.test_client().get("/api/sector/large cap/analytics?period=Mar 2024")
+
+    body = json.loads(response.data)
+    assert response.status_code == 200
+    assert (body["sector"], body["period"], body["sector_stocks"]) == ("Large Cap", "Mar 2024", 3)
+    assert binds == [sr.sector_analytics_params("Large Cap", 24290)]
+
+
+def test_ttm_and_unknown_periods_are_rejected_before_querying(fake_warehouse):
+    client = sr.app.test_client()
+
+    assert client.get("/api/sector/Large Cap/analytics?period=TTM").status_code == 400
+    assert client.get("/api/sector/Large Cap/analytics?period=someday").status_code == 400
+    assert fake_warehouse.log == []
+
+
+def test_unknown_sector_is_a_404(fake_warehouse):
+    fake_warehouse.results = {"SELECT DISTINCT CATEGORY": [("Large Cap",)]}
+
+    assert sr.app.test_client().get("/api/sector/Tiny Cap/analytics").status_code == 404
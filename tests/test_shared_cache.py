@@ -0,0 +1,81 @@
+import pytest
+
+import stock_recommender as sr
+
+
+class BrokenBackend:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError("shared cache down")
+        return fail
+
+
+def cache_in(shared, ttl=900.0):
+    return sr.PayloadCache(max_entries=8, ttl=ttl, shared=shared)
+
+
+def test_payload_built_in_one_worker_is_served_by_another():
+    shared = sr.MemoryCacheBackend()
+    first, second = cache_in(shared), cache_in(shared)
+    _, token = first.lookup(("stock", "TCS"))
+    first.put(("stock", "TCS"), {"stock": "TCS"}, token)
+
+    assert second.lookup(("stock", "TCS"))[0] == {"stock": "TCS"}
+    assert second.stats["shared_hits"] == 1
+    # Copied into the local tier on the way
+    second.lookup(("stock", "TCS"))
+    assert second.stats["hits"] == 1
+
+
+def test_invalidation_in_one_worker_reaches_every_worker():
+    shared = sr.MemoryCacheBackend()
+    first, second = cache_in(shared), cache_in(shared)
+    for cache in (first, second):
+        _, token = cache.lookup(("stock", "TCS"))
+        cache.put(("stock", "TCS"), {"version": "old"}, token)
+
+    first.invalidate_tags(["stock:TCS"])
+
+    assert shared.get(sr.shared_cache_key("version", "stock:TCS")) == b"1"
+    assert second.lookup(("stock", "TCS"))[0] is None
+    assert first.lookup(("stock", "TCS"))[0] is None
+
+
+def test_payload_built_before_a_remote_invalidation_lands_under_the_old_version():
+    shared = sr.MemoryCacheBackend()
+    reader, writer = cache_in(shared), cache_in(shared)
+    _, token = reader.lookup(("stock", "TCS"))
+    writer.invalidate_tags(["stock:TCS"])
+    reader.put(("stock", "TCS"), {"version": "old"}, token)
+
+    assert writer.lookup(("stock", "TCS"))[0] is None
+    assert reader.lookup(("stock", "TCS"))[0] is None
+
+
+def test_fractional_ttl_is_sent_as_whole_seconds():
+    shared = sr.MemoryCacheBackend()
+    cache = cache_in(shared, ttl=900.0)
+    _, token = cache.lookup(("stock", "TCS"))
+    cache.put(("stock", "TCS"), {"stock": "TCS"}, token)
+
+    assert cache.stats["shared_errors"] == 0
+    assert cache_in(shared).lookup(("stock", "TCS"))[0] == {"stock": "TCS"}
+
+
+def test_memory_backend_rejects_what_redis_rejects():
+    shared = sr.MemoryCacheBackend()
+    with pytest.raises(ValueError):
+        shared.set("key", "value", ex=900.0)
+    with pytest.raises(ValueError):
+        shared.set("key", "value", ex=0)
+    assert shared.get("key") is None
+
+
+def test_unreachable_shared_tier_degrades_to_the_local_cache():
+    cache = cache_in(BrokenBackend())
+    _, token = cache.lookup(("stock", "TCS"))
+    cache.put(("stock", "TCS"), {"stock": "TCS"}, token)
+
+    assert cache.lookup(("stock", "TCS"))[0] == {"stock": "TCS"}
+    assert cache.invalidate_tags(["stock:TCS"]) == 1
+    assert cache.stats["shared_errors"] > 0
@@ -0,0 +1,115 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import stock_recommender as sr
+
+CALLERS = 8
+
+
+def run_concurrently(flight, fn):
+    """Call flight.do("TCS", fn) from CALLERS threads once the first call is in flight"""
+    started, release = threading.Event(), threading.Event()
+
+    def leader_fn():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    outcomes = []
+
+    def call(call_fn):
+        try:
+            outcomes.append(("ok", flight.do("TCS", call_fn, timeout=5)))
+        except Exception as e:
+            outcomes.append(("error", e))
+
+    threads = [threading.Thread(target=call, args=(leader_fn,))]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=call, args=(fn,)) for _ in range(CALLERS - 1)]
+    for thread in threads[1:]:
+        thread.start()
+    # Followers register before the leader finishes
+    deadline = time.monotonic() + 5
+    while flight.stats["followers"] < CALLERS - 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_concurrent_calls_share_one_run():
+    flight = sr.SingleFlight(outcome_ttl=30)
+    calls = []
+
+    outcomes = run_concurrently(flight, lambda: calls.append(1) or True)
+
+    assert calls == [1]
+    assert outcomes == [("ok", True)] * CALLERS
+    assert flight.stats["leaders"] == 1
+    assert flight.stats["followers"] == CALLERS - 1
+
+
+def test_leader_error_is_raised_in_every_caller():
+    flight = sr.SingleFlight(outcome_ttl=30)
+    error = RuntimeError("scrape failed")
+
+    def fail():
+        raise error
+
+    outcomes = run_concurrently(flight, fail)
+
+    assert outcomes == [("error", error)] * CALLERS
+    assert flight.stats["leaders"] == 1
+
+
+def test_recent_outcome_is_reused_until_it_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sr.time, "monotonic", lambda: now[0])
+    flight = sr.SingleFlight(outcome_ttl=30)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return len(calls)
+
+    assert flight.do("TCS", load) == 1
+    now[0] += 10
+    assert flight.do("TCS", load) == 1
+    assert flight.stats["reused"] == 1
+
+    now[0] += 30
+    assert flight.outcome("TCS") is None
+    assert flight.do("TCS", load) == 2
+    assert flight.stats["leaders"] == 2
+
+
+def test_recent_error_is_replayed():
+    flight = sr.SingleFlight(outcome_ttl=30)
+
+    def fail():
+        raise ValueError("no such stock")
+
+    with pytest.raises(ValueError):
+        flight.do("NOPE", fail)
+    with pytest.raises(ValueError):
+        flight.do("NOPE", lambda: True)
+    assert flight.stats == {"leaders": 1, "followers": 0, "reused": 1, "background": 0}
+
+
+def test_background_submit_joins_a_running_load():
+    flight = sr.SingleFlight(outcome_ttl=30)
+    release = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert flight.submit("TCS", lambda: release.wait(5), executor) is True
+        assert flight.submit("TCS", lambda: True, executor) is False
+        assert flight.summary()["in_flight"] == ["TCS"]
+        release.set()
+
+    assert flight.outcome("TCS") == (True, None)
+    assert flight.stats["background"] == 1
@@ -0,0 +1,117 @@
+import pandas as pd
+import pytest
+
+import stock_recommender as sr
+
+QUARTERS = ["Dec 2023", "Mar 2024"]
+
+
+def stock_rows(stock_code="TCS", sales=("8", "10")):
+    financials = sr.ExtractedFinancials()
+    financials.add("quarters", {"Sales +": list(sales)})
+    return sr.quarterly_rows(stock_code, financials, QUARTERS, "Large Cap", "IT - Software")
+
+
+def stored_values(stock_code="TCS"):
+    """Rows the derived-source queries return for `stock_code` (DERIVED_SOURCE_COLUMNS)"""
+    return [(stock_code, "Sales +", "Dec 2023", 8.0, "Income Statement", 24287, "quarters"),
+            (stock_code, "Sales +", "Mar 2024", 10.0, "Income Statement", 24290, "quarters")]
+
+
+def stored_hashes(rows):
+    frame = pd.DataFrame(rows, columns=sr.QUARTERLY_ROW_COLUMNS).astype(str)
+    return [row[:3] + (digest,) for row, digest in zip(rows, sr.quarterly_row_hashes(frame))]
+
+
+def test_merge_and_derived_refresh_are_one_transaction_of_set_based_dml(fake_warehouse):
+    fake_warehouse.results = {"NOT EXISTS": lambda sql, params: stored_values()}
+
+    outcome = sr.bulk_merge_quarterly(fake_warehouse, stock_rows())
+
+    assert outcome == {"written": 2, "skipped": 0, "stocks": ["TCS"], "rebuilt": []}
+    transaction = fake_warehouse.transaction()
+    assert [statement.split(" (")[0].split(" USING")[0] for statement in transaction] == [
+        "MERGE INTO FINANCIALS_QUARTERLY AS tgt",
+        "MERGE INTO FINANCIALS_SNAPSHOT AS tgt",
+        "DELETE FROM FINANCIALS_FEATURES WHERE STOCK_CODE IN",
+        "INSERT INTO FINANCIALS_FEATURES",
+    ]
+    # Staging (DDL, bulk binds) all happened before BEGIN
+    staged = fake_warehouse.log[:fake_warehouse.log.index("BEGIN")]
+    assert any(s.startswith("EXECUTEMANY INSERT INTO FINANCIALS_SNAPSHOT_STAGE") for s in staged)
+    assert any(s.startswith("EXECUTEMANY INSERT INTO FINANCIALS_FEATURES_STAGE") for s in staged)
+    assert fake_warehouse.log[-2:] == ["COMMIT", "AUTOCOMMIT True"]
+
+
+def test_failure_inside_the_transaction_rolls_back_the_merge(fake_warehouse):
+    def fail(sql, params):
+        raise RuntimeError("warehouse unavailable")
+
+    fake_warehouse.results = {"NOT EXISTS": lambda sql, params: stored_values(),
+                              "MERGE INTO FINANCIALS_SNAPSHOT": fail}
+
+    with pytest.raises(RuntimeError):
+        sr.bulk_merge_quarterly(fake_warehouse, stock_rows())
+
+    assert "ROLLBACK" in fake_warehouse.log
+    assert "COMMIT" not in fake_warehouse.log
+    assert fake_warehouse.log[-1] == "AUTOCOMMIT True"
+
+
+def test_stale_snapshot_is_rebuilt_even_when_no_row_changed(fake_warehouse):
+    rows = stock_rows()
+    fake_warehouse.results = {
+        "ROW_HASH FROM FINANCIALS_QUARTERLY": stored_hashes(rows),
+        "LEFT JOIN FINANCIALS_SNAPSHOT": [("TCS",)],
+        "VALUE_NUM IS NOT NULL ORDER BY": lambda sql, params: stored_values(),
+    }
+
+    outcome = sr.bulk_merge_quarterly(fake_warehouse, rows)
+
+    assert outcome == {"written": 0, "skipped": 2, "stocks": [], "rebuilt": ["TCS"]}
+    transaction = fake_warehouse.transaction()
+    assert not any(s.startswith("MERGE INTO FINANCIALS_QUARTERLY") for s in transaction)
+    assert any(s.startswith("MERGE INTO FINANCIALS_SNAPSHOT") for s in transaction)
+
+
+def test_unchanged_rows_with_a_fresh_snapshot_write_nothing(fake_warehouse):
+    rows = stock_rows()
+    fake_warehouse.results = {"ROW_HASH FROM FINANCIALS_QUARTERLY": stored_hashes(rows)}
+
+    outcome = sr.bulk_merge_quarterly(fake_warehouse, rows)
+
+    assert outcome == {"written": 0, "skipped": 2, "stocks": [], "rebuilt": []}
+    assert "BEGIN" not in fake_warehouse.log
+
+
+def test_snapshot_miss_is_a_read_only_lookup(fake_warehouse):
+    assert sr.load_stock_payload(fake_warehouse, "UNKNOWN") is None
+    assert fake_warehouse.log == [sr.SNAPSHOT_LOOKUP_SQL]
+
+
+def test_backfill_rebuilds_stale_snapshots_in_batches(fake_warehouse):
+    fake_warehouse.results = {
+        "LEFT JOIN FINANCIALS_SNAPSHOT": [("A",), ("B",), ("C",)],
+        "VALUE_NUM IS NOT NULL ORDER BY": lambda sql, params: [
+            row for code in params for row in stored_values(code)],
+    }
+
+    report = sr.backfill_snapshots(fake_warehouse, batch_stocks=2)
+
+    assert report == {"stocks": 3, "snapshots": 3}
+    assert fake_warehouse.log.count("BEGIN") == 2
+    assert fake_warehouse.log.count("COMMIT") == 2
+
+
+def test_window_slices_on_stored_ordinals():
+    frame = pd.DataFrame([("A", "Sales", quarter, value, "Income Statement", ordinal) for quarter, value, ordinal in
+                          [("Sep 2023", 1, 24284), ("Dec 2023", 2, 24287), ("Mar 2024", 3, 24290),
+                           ("TTM", 6, sr.PERIOD_ORDINAL_TTM)]], columns=sr.PIVOT_COLUMNS)
+    payload = sr.build_stock_payloads(frame)["A"]
+    assert payload["ordinals"] == [24284, 24287, 24290, sr.PERIOD_ORDINAL_TTM]
+
+    window = sr.window_payload(payload, 2)
+
+    assert window["quarters"] == ["Dec 2023", "Mar 2024", "TTM"]
+    assert window["ordinals"] == [24287, 24290, sr.PERIOD_ORDINAL_TTM]
+    assert window["categorized"] == {"Income Statement": {"Sales": ["2", "3", "6"]}}